@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the broadcast backend, for benchmarks.
+
+Serves, on one aiohttp app:
+- POST /login: the form/JSON contract LoginClient.login() expects
+  ({"status": 1, "token": ..., "area": [{"code", "name"}, ...]}).
+- GET /assets/<id>: raw audio registered with `add_asset()` (bearer token
+  required).
+- Socket.IO connects must carry "Authorization: Bearer <token>";
+  `rotate_token()` invalidates the current one, like a server-side expiry.
+- Socket.IO with the client protocol: "subscribe" {"channel": ...} joins a
+  room (with batch_subscribe=True also {"channels": [...]}, acked with the
+  list), "client:ping" is echoed as "server:pong", and broadcasts arrive as
+  ("PlayAudioEvent", channel, payload).
+
+The server runs its own event loop on a daemon thread; the public methods
+are thread-safe, so benchmark code can drive it synchronously.
+
+Usage:
+    srv = FakeBroadcastServer(areas=8).start()
+    srv.broadcast("private-audio.A0", {"audio": b64, "format": "wav"})
+    srv.restart()          # bounce the listener (reconnect storm)
+    srv.rotate_token()     # clients must log in again
+    srv.stop()
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import socketio
+from aiohttp import web
+
+
+class FakeBroadcastServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, areas: int = 4,
+                 token: str = "bench-token", batch_subscribe: bool = True):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.batch_subscribe = batch_subscribe
+        self.areas: List[Dict[str, str]] = [
+            {"code": f"A{i}", "name": f"Area {i}"} for i in range(int(areas))
+        ]
+        self.subscriptions: Dict[str, int] = {}
+        self.logins = 0
+        self.assets: Dict[str, bytes] = {}
+        self.asset_fetches = 0
+        self.connects = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._ready = threading.Event()
+
+        self.sio = socketio.AsyncServer(async_mode="aiohttp", max_http_buffer_size=64 * 1024 * 1024)
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.sio.attach(self.app)
+        self.app.router.add_post("/login", self._login)
+        self.app.router.add_get("/assets/{id}", self._asset)
+        self.sio.on("connect", self._on_connect)
+        self.sio.on("subscribe", self._on_subscribe)
+        self.sio.on("client:ping", self._on_ping)
+
+    # --- HTTP -------------------------------------------------------------
+    async def _login(self, request: web.Request) -> web.Response:
+        self.logins += 1
+        form = await request.post()
+        if not form.get("username"):
+            return web.json_response({"status": 0, "message": "missing username"})
+        return web.json_response({"status": 1, "token": self.token, "area": self.areas})
+
+    async def _asset(self, request: web.Request) -> web.Response:
+        if request.headers.get("Authorization") != f"Bearer {self.token}":
+            return web.Response(status=401)
+        data = self.assets.get(request.match_info["id"])
+        if data is None:
+            return web.Response(status=404)
+        self.asset_fetches += 1
+        return web.Response(body=data, content_type="audio/wav")
+
+    def add_asset(self, asset_id: str, data: bytes) -> None:
+        self.assets[asset_id] = data
+
+    # --- Socket.IO --------------------------------------------------------
+    async def _on_connect(self, sid, environ, auth=None):
+        if environ.get("HTTP_AUTHORIZATION") != f"Bearer {self.token}":
+            raise socketio.exceptions.ConnectionRefusedError("401 unauthorized")
+        self.connects += 1
+
+    async def _on_subscribe(self, sid, data):
+        data = data or {}
+        if self.batch_subscribe and isinstance(data.get("channels"), list):
+            for channel in data["channels"]:
+                await self._join(sid, channel)
+            return {"ok": True, "channels": data["channels"]}
+        channel = data.get("channel")
+        if channel:
+            await self._join(sid, channel)
+        return {"ok": True, "channel": channel}
+
+    async def _join(self, sid, channel):
+        await self.sio.enter_room(sid, channel)
+        self.subscriptions[channel] = self.subscriptions.get(channel, 0) + 1
+
+    async def _on_ping(self, sid, data):
+        await self.sio.emit("server:pong", data, to=sid)
+
+    # --- lifecycle --------------------------------------------------------
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeBroadcastServer":
+        threading.Thread(target=self._serve, name="fake-server", daemon=True).start()
+        if not self._ready.wait(10):
+            raise RuntimeError("fake server did not start")
+        return self
+
+    def _serve(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+        async def _up():
+            self._runner = web.AppRunner(self.app, shutdown_timeout=0.5)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+
+        self._loop.run_until_complete(_up())
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _call(self, coro, timeout: float = 30):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        self._call(self._runner.cleanup())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # --- driving ----------------------------------------------------------
+    def broadcast(self, channel: str, payload: Dict[str, Any]) -> None:
+        self._call(self.sio.emit("PlayAudioEvent", (channel, payload), room=channel))
+
+    def broadcast_many(self, items) -> float:
+        """Emit [(channel, payload), ...] back to back; returns seconds taken."""
+        async def _burst():
+            t0 = time.perf_counter()
+            for channel, payload in items:
+                await self.sio.emit("PlayAudioEvent", (channel, payload), room=channel)
+            return time.perf_counter() - t0
+        return self._call(_burst(), timeout=600)
+
+    def rotate_token(self) -> str:
+        self.token = f"bench-token-{time.monotonic_ns()}"
+        return self.token
+
+    def restart(self, down_sec: float = 0.2) -> None:
+        """Bounce the listener like a backend restart.
+
+        Every websocket is closed at the transport level, so clients see a
+        dropped connection and run their reconnect logic (a Socket.IO
+        server-side disconnect would not trigger reconnection).
+        """
+        async def _bounce():
+            await self._runner.cleanup()
+            await asyncio.sleep(down_sec)
+            self._runner = web.AppRunner(self.app, shutdown_timeout=0.5)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        self._call(_bounce())
+
+
+__all__ = ["FakeBroadcastServer"]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Null/virtual audio output for benchmarks.
+
+`install()` makes the player run without speakers: every output stream is
+replaced by `NullOutputStream`, which pulls frames through the player's
+callback on its own thread (optionally faster than real time) and throws
+them away. Device enumeration returns `devices` virtual outputs. Call it
+before importing `services.Audio`; on machines without PortAudio the real
+`sounddevice` cannot even be imported, so a minimal stand-in module is
+registered instead.
+
+Usage:
+    from bench import null_sink
+    null_sink.install(devices=12, speed=20.0)
+    from services.Audio import get_player
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+BLOCK_FRAMES = 1024
+
+_state = {"speed": 1.0, "devices": 4, "samplerate": 48000, "channels": 2}
+frames_played = {}          # device -> frames consumed by the null sink
+_frames_lock = threading.Lock()
+
+
+class NullOutputStream:
+    """Drop-in for sd.OutputStream (callback or blocking write mode)."""
+
+    def __init__(self, device=None, samplerate=None, channels=None, dtype="float32",
+                 callback=None, blocksize=0, finished_callback=None, **_kw):
+        self.device = device
+        self.samplerate = float(samplerate or _state["samplerate"])
+        self.channels = int(channels or _state["channels"])
+        self.dtype = dtype
+        self.callback = callback
+        self.blocksize = blocksize or BLOCK_FRAMES
+        self.finished_callback = finished_callback
+        self.active = False
+        self.closed = False
+        self._thread = None
+
+    def start(self):
+        self.active = True
+        if self.callback is not None:
+            self._thread = threading.Thread(target=self._pump, name="null-sink", daemon=True)
+            self._thread.start()
+
+    def _pump(self):
+        out = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+        period = self.blocksize / self.samplerate / max(_state["speed"], 1e-6)
+        next_t = time.perf_counter()
+        while self.active:
+            try:
+                self.callback(out, self.blocksize, None, None)
+            except Exception:
+                self.active = False
+                break
+            _count(self.device, self.blocksize)
+            next_t += period
+            delay = next_t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def write(self, data):
+        _count(self.device, len(data))
+        time.sleep(len(data) / self.samplerate / max(_state["speed"], 1e-6))
+        return False
+
+    def stop(self):
+        self.active = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+
+    abort = stop
+
+    def close(self):
+        self.stop()
+        self.closed = True
+        if self.finished_callback:
+            self.finished_callback()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _count(device, n):
+    with _frames_lock:
+        frames_played[device] = frames_played.get(device, 0) + n
+
+
+def _devices():
+    return [
+        {
+            "name": f"Null Output {i}",
+            "hostapi": 0,
+            "max_input_channels": 0,
+            "max_output_channels": _state["channels"],
+            "default_samplerate": float(_state["samplerate"]),
+        }
+        for i in range(_state["devices"])
+    ]
+
+
+def query_devices(device=None, kind=None):
+    devs = _devices()
+    return devs if device is None else devs[device]
+
+
+def query_hostapis(index=None):
+    apis = [{"name": "Null", "devices": list(range(_state["devices"]))}]
+    return apis if index is None else apis[index]
+
+
+def install(devices: int = 4, speed: float = 1.0, samplerate: int = 48000, channels: int = 2):
+    """Route all audio output to null devices. speed > 1 drains faster than real time."""
+    _state.update(devices=int(devices), speed=float(speed),
+                  samplerate=int(samplerate), channels=int(channels))
+    try:
+        import sounddevice as sd
+    except OSError:
+        # No PortAudio on this box: provide just the API surface the player uses
+        sd = types.ModuleType("sounddevice")
+        sd.PortAudioError = type("PortAudioError", (Exception,), {})
+        sd.CallbackStop = type("CallbackStop", (Exception,), {})
+        sd._initialize = sd._terminate = lambda: None
+        sys.modules["sounddevice"] = sd
+    sd.OutputStream = NullOutputStream
+    sd.query_devices = query_devices
+    sd.query_hostapis = query_hostapis
+    return sd
+
+
+__all__ = ["install", "NullOutputStream", "frames_played"]
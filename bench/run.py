@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Client hot-path benchmarks against a local fake backend and null audio.
+
+Runs the real LoginClient -> AudioSocketClient -> AudioQueuePlayer path
+end to end; only the backend (bench.fake_server) and the speakers
+(bench.null_sink) are local stand-ins.
+
+Scenarios:
+    burst        many small clips to one area, back to back
+    large        one long message split into many chunks
+    chunked      the same, one chunk per event, partly out of order
+    many_areas   clips spread across many areas/devices
+    reconnect    backend restarts repeatedly; time until the client is back
+                 and until all its areas are subscribed again
+
+Reported per scenario: events/sec received by the client, time-to-first-
+audio percentiles (event arrival -> first frame handed to the device),
+drain time, and memory (tracemalloc peak, process max RSS).
+
+Usage:
+    python -m bench.run                       # all scenarios
+    python -m bench.run burst large --events 500 --speed 50
+    python -m bench.run burst --engine       # output streams in services.engine
+"""
+from __future__ import annotations
+
+import argparse
+import functools
+import base64
+import io
+import json
+import resource
+import sys
+import time
+import tracemalloc
+
+from bench import null_sink
+
+SCENARIOS = ("burst", "large", "chunked", "many_areas", "reconnect")
+
+
+def _percentiles(values, ps=(50, 90, 99)):
+    if not values:
+        return {f"p{p}": None for p in ps}
+    vs = sorted(values)
+    return {f"p{p}": round(vs[min(len(vs) - 1, int(len(vs) * p / 100))], 4) for p in ps}
+
+
+def _wav_bytes(seconds: float, samplerate: int = 48000, freq: float = 440.0) -> bytes:
+    import numpy as np
+    import soundfile as sf
+
+    t = np.arange(int(seconds * samplerate), dtype=np.float32) / samplerate
+    pcm = (0.2 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    buf = io.BytesIO()
+    sf.write(buf, pcm, samplerate, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+
+def _wav_b64(seconds: float, samplerate: int = 48000, freq: float = 440.0) -> str:
+    return base64.b64encode(_wav_bytes(seconds, samplerate, freq)).decode("ascii")
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        null_sink.install(devices=max(args.areas, 1), speed=args.speed)
+
+        # imported after the sink is installed so the player binds to it
+        from bench.fake_server import FakeBroadcastServer
+        from services import metrics
+        from services.Audio import get_player
+        from services.client import AudioSocketClient
+        from services.login import LoginClient
+        from services.routing import RoutingTable
+
+        self.metrics = metrics
+        self.ttfa = []
+        observe = metrics.TIME_TO_FIRST_AUDIO.observe
+
+        def _record(value, **labels):
+            self.ttfa.append(value)
+            observe(value, **labels)
+
+        metrics.TIME_TO_FIRST_AUDIO.observe = _record
+
+        self.server = FakeBroadcastServer(areas=args.areas).start()
+        login = LoginClient(self.server.url, "bench", "bench", log_func=lambda m: None)
+        token, self.area_list = login.get_token()
+        self.channels = [f"private-audio.{a['code']}" for a in self.area_list]
+        routes = RoutingTable.from_device_map({i: ch for i, ch in enumerate(self.channels)})
+        self.engine = None
+        if args.engine:
+            from services.engine import AudioEngine
+            init = functools.partial(null_sink.install, devices=max(args.areas, 1), speed=args.speed)
+            self.engine = AudioEngine(init=init).start()
+        self.player = get_player(gap_sec=args.gap, engine=self.engine)
+        self.client = AudioSocketClient(
+            self.server.url, routes, self.area_list, token, gap_sec=args.gap,
+            log_func=lambda m: None, transports=["websocket"], ping_interval=0,
+        )
+        self.client.connect()
+        self._wait(lambda: sum(self.server.subscriptions.values()) >= len(self.channels), 10)
+
+    # --- helpers ----------------------------------------------------------
+    @staticmethod
+    def _wait(cond, timeout: float) -> bool:
+        end = time.perf_counter() + timeout
+        while time.perf_counter() < end:
+            if cond():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def _received(self) -> float:
+        return self.metrics.EVENTS_RECEIVED.value(event="PlayAudioEvent")
+
+    def _drained(self) -> bool:
+        if any(self.player.queue_depths().values()):
+            return False
+        # written ahead into the device rings but not yet played
+        return not any(w.output and w.output.ring.available()
+                       for w in list(self.player._workers.values()))
+
+    def _dropped(self) -> int:
+        return sum(self.player.drop_stats().values())
+
+    def _run_events(self, items, plays=None):
+        plays = len(items) if plays is None else plays  # items that start playback
+        self.ttfa.clear()
+        before = self._received()
+        dropped = self._dropped()
+        t0 = time.perf_counter()
+        self.server.broadcast_many(items)
+        self._wait(lambda: self._received() - before >= len(items), 120)
+        t_recv = time.perf_counter() - t0
+        # every item either starts playing (one TTFA sample) or is dropped;
+        # only then can an empty queue mean "drained"
+        self._wait(lambda: len(self.ttfa) + self._dropped() - dropped >= plays, 600)
+        self._wait(self._drained, 600)
+        t_drain = time.perf_counter() - t0
+        n = self._received() - before
+        return {
+            "events": int(n),
+            "events_per_sec": round(n / t_recv, 1) if t_recv else None,
+            "drain_sec": round(t_drain, 3),
+            "ttfa_sec": _percentiles(self.ttfa),
+            "dropped": self._dropped() - dropped,
+        }
+
+    def _clip(self, seconds: float, freq: float = 440.0):
+        # --binary sends Socket.IO binary attachments instead of base64 text
+        if self.args.binary:
+            return _wav_bytes(seconds, freq=freq)
+        return _wav_b64(seconds, freq=freq)
+
+    # --- scenarios --------------------------------------------------------
+    # distinct clips: identical payloads would be coalesced by the player
+    def burst(self):
+        items = [(self.channels[0], {"audio": self._clip(self.args.clip_sec, 300 + i), "format": "wav"})
+                 for i in range(self.args.events)]
+        return self._run_events(items)
+
+    def large(self):
+        chunks = {str(i): self._clip(1.0, freq=200 + i) for i in range(self.args.chunks)}
+        return self._run_events([(self.channels[0], {"audio": chunks, "format": "wav"})])
+
+    def chunked(self):
+        n = self.args.chunks
+        mid = f"bench-{time.monotonic_ns()}"
+        items = [(self.channels[0], {"message_id": mid, "seq": i, "total": n,
+                                     "audio": self._clip(1.0, freq=200 + i), "format": "wav"})
+                 for i in range(n)]
+        for i in range(1, n - 1, 2):  # swap neighbours: out-of-order delivery
+            items[i], items[i + 1] = items[i + 1], items[i]
+        return self._run_events(items, plays=1)
+
+    def many_areas(self):
+        items = [(self.channels[i % len(self.channels)],
+                  {"audio": self._clip(self.args.clip_sec, 300 + i), "format": "wav"})
+                 for i in range(self.args.events)]
+        return self._run_events(items)
+
+    def reconnect(self):
+        times, subscribed = [], []
+        stats = self.client.connect_stats
+        for _ in range(self.args.storms):
+            stats.pop("reconnect_sec", None)
+            stats.pop("subscribed_sec", None)
+            self.server.restart(self.args.down_sec)
+            if self._wait(lambda: "reconnect_sec" in stats, 30):
+                times.append(stats["reconnect_sec"])
+            if self._wait(lambda: "subscribed_sec" in stats, 30):
+                subscribed.append(stats["subscribed_sec"])
+        return {"storms": self.args.storms, "reconnected": len(times),
+                "reconnect_sec": _percentiles(times),
+                "subscribed_sec": _percentiles(subscribed)}
+
+    def close(self):
+        try:
+            self.client.disconnect()
+        finally:
+            self.player.stop()
+            if self.engine is not None:
+                self.engine.stop()
+            self.server.stop()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="AudioSocketClient benchmarks")
+    ap.add_argument("scenarios", nargs="*", metavar="scenario",
+                    help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    ap.add_argument("--events", type=int, default=200, help="events for burst/many_areas")
+    ap.add_argument("--areas", type=int, default=12, help="areas (= null devices)")
+    ap.add_argument("--chunks", type=int, default=30, help="1 s chunks in the large/chunked message")
+    ap.add_argument("--storms", type=int, default=5, help="server restarts for reconnect")
+    ap.add_argument("--down-sec", type=float, default=0.2, help="server downtime per restart")
+    ap.add_argument("--clip-sec", type=float, default=0.5, help="duration of each test clip")
+    ap.add_argument("--gap", type=float, default=0.0, help="player gap_sec")
+    ap.add_argument("--speed", type=float, default=50.0, help="null sink speed vs real time")
+    ap.add_argument("--binary", action="store_true", help="send audio as binary attachments")
+    ap.add_argument("--engine", action="store_true", help="play through a separate engine process")
+    args = ap.parse_args(argv)
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        ap.error(f"unknown scenario(s): {', '.join(unknown)}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    tracemalloc.start()
+    bench = Bench(args)
+    results = {}
+    try:
+        for name in args.scenarios:
+            tracemalloc.reset_peak()
+            res = getattr(bench, name)()
+            res["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            results[name] = res
+            print(f"{name}: {json.dumps(res, ensure_ascii=False)}", flush=True)
+    finally:
+        bench.close()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["max_rss_mb"] = round(rss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+# headless.py
+"""
+Headless player / daemon entry point (no display, no PySide6).
+
+Reads everything the GUI would ask for from a JSON config file, logs in
+with LoginClient, binds output devices to areas and plays broadcasts until
+SIGINT/SIGTERM. Nothing on this path imports Qt. Login and the first
+connect are retried with a jittered backoff while the server cannot be
+reached, so the daemon may start before it; only an auth failure (401/403)
+exits.
+
+Usage:
+    python headless.py --config player.json
+    python headless.py --list-devices
+
+Config example:
+    {
+      "app_base": "https://tta-ad",
+      "username": "player01",
+      "password": "secret",
+      "cafile": "app.crt",
+      "gap_sec": 1.0,
+      "transports": ["websocket"],
+      "ping_interval": 20,
+      "metrics_port": 9464,
+      "preempt_priority": 100,
+      "chunk_timeout": 30,
+      "token_ttl": 43200,
+      "batch_subscribe": false,
+      "randomization_factor": 0.5,
+      "asset_dir": "/var/lib/audq/assets",
+      "endpoints": ["https://tta-ad", "https://tta-ad-2"],
+      "failover": "standby",
+      "audio_process": true,
+      "queue": {"max_items": 100, "max_bytes": 33554432, "policy": "coalesce"},
+      "mapping": [
+        {"device": "USB Audio Device", "area": "Lobby", "gap_sec": 0.5},
+        {"device": 3, "area": "B1"}
+      ]
+    }
+
+`device` is a PortAudio output id or device name; `area` is an area code
+or name from the login response; `gap_sec` (optional) overrides the
+silence between clips on that device. `metrics_port` (optional) serves
+Prometheus metrics on http://127.0.0.1:<port>/metrics. Broadcasts carry an
+optional "priority" (default `default_priority`, 0); at or above
+`preempt_priority` they interrupt whatever is playing on their devices.
+`queue` (optional) sets the playback queue limits, see
+services.Audio.QueueLimits; `decode_workers`, `lookahead`, `ahead_bytes`
+and `max_channels` tune the player. `chunk_timeout` (optional) is how long a
+broadcast sent as one chunk per event may go without a chunk before its
+missing rest is given up.
+
+The login token and area list are cached in a per-user file (see
+services.token_store; `token_store` sets the path, false disables it), so
+a restart connects without a /login round trip while the token is valid.
+`token_ttl` is the assumed lifetime when the server does not say; the
+token is refreshed in the background before it runs out.
+
+Area subscriptions are pipelined one per area. `batch_subscribe: true`
+sends one batched request instead, for servers that support it; null
+probes for support, which delays the first connect by up to the ack
+timeout on servers that do not ack. Reconnects back off from `reconnection_delay` to
+`reconnection_delay_max` seconds, each delay randomized by
++/- `randomization_factor` so a fleet does not reconnect in lockstep.
+
+`asset_dir` (optional) keeps decoded clips on disk (services.assets, up to
+`asset_max_bytes`), so repeats skip decoding even after a restart and
+broadcasts may send just an "asset_id"; unknown ids are downloaded from
+`asset_url` (default "{app_base}/assets/{id}").
+
+`endpoints` (optional) lists backend URLs to stay connected to at once
+(services.multi; login goes to `app_base`, whose token all of them must
+accept). With `failover` "standby" (default) only the first healthy one
+plays and a dead or silent (`stale_sec`) one is replaced without a
+reconnect; "active" plays from all of them and drops duplicates.
+
+`audio_process: true` runs the output streams in a separate process fed
+through shared-memory rings (services.engine), holding up to
+`audio_buffer_sec` of audio per device; the engine is restarted on its
+own if it dies.
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import signal
+import sys
+import threading
+
+from services.Audio import QueueLimits, get_player
+from services.assets import AssetStore
+from services.client import AudioSocketClient
+from services.engine import AudioEngine
+from services.login import LoginClient
+from services.multi import MultiEndpointClient
+from services.token_store import TokenStore
+from services.routing import RoutingTable
+from util.devices import get_registry
+from util.logs import get_logger, setup as setup_logging
+
+_log = get_logger("headless")
+log = _log.info
+
+STARTUP_RETRY_SEC = 2.0       # first delay between startup attempts, doubled per failure
+STARTUP_RETRY_MAX_SEC = 60.0
+
+
+def load_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    missing = [k for k in ("app_base", "username", "password") if not cfg.get(k)]
+    if missing:
+        raise SystemExit(f"config {path}: missing {', '.join(missing)}")
+    return cfg
+
+
+def _resolve_device(dev):
+    registry = get_registry()
+    return registry.by_id(dev) if isinstance(dev, int) else registry.by_name(str(dev))
+
+
+def build_routes(mapping, area_list):
+    """Resolve config device/area entries into a RoutingTable."""
+    areas = {}
+    for area in area_list or []:
+        areas[str(area["code"])] = area
+        areas[str(area["name"])] = area
+    device_map = {}
+    for entry in mapping or []:
+        dev = entry.get("device")
+        info = _resolve_device(dev)
+        if info is None:
+            _log.warning("找不到輸出裝置: %r", dev)
+            continue
+        area = areas.get(str(entry.get("area")))
+        if area is None:
+            _log.warning("帳號沒有此區域: %r", entry.get("area"))
+            continue
+        device_map[info["id"]] = f"private-audio.{area['code']}"
+    return RoutingTable.from_device_map(device_map)
+
+
+def apply_device_gaps(mapping, player):
+    """Per-device gap_sec overrides from the config mapping."""
+    for entry in mapping or []:
+        if entry.get("gap_sec") is None:
+            continue
+        info = _resolve_device(entry.get("device"))
+        if info is not None:
+            player.set_device_gap(info["id"], float(entry["gap_sec"]))
+
+
+def list_devices():
+    for d in get_registry().output_devices():
+        print(f"[{d['id']}] {d['name']} | {d['hostapi_name']} | "
+              f"{d['channels']}ch @ {d['samplerate']} Hz")
+
+
+def _token_store(cfg):
+    path = cfg.get("token_store", True)
+    if path is False:
+        return None
+    kwargs = {"default_ttl": float(cfg["token_ttl"])} if cfg.get("token_ttl") else {}
+    return TokenStore(path if isinstance(path, str) else None, **kwargs)
+
+
+def _asset_store(cfg):
+    if not cfg.get("asset_dir"):
+        return None
+    kwargs = {"max_bytes": int(cfg["asset_max_bytes"])} if cfg.get("asset_max_bytes") else {}
+    return AssetStore(cfg["asset_dir"], **kwargs)
+
+
+def _retry_startup(attempt, done, what):
+    """attempt() until it succeeds, with jittered backoff in between.
+
+    python-socketio only reconnects a client that was connected once, so a
+    daemon started before the server is reachable has to keep trying on
+    its own. Auth failures (401/403) are raised; returns None if `done`
+    is set while waiting.
+    """
+    delay = STARTUP_RETRY_SEC
+    while True:
+        try:
+            return attempt()
+        except Exception as e:
+            if AudioSocketClient._is_auth_error(e):
+                raise
+            wait = delay * (1 + random.uniform(-0.5, 0.5))
+            _log.warning("%s失敗：%s（%.1f 秒後重試）", what, e, wait)
+        if done.wait(wait):
+            return None
+        delay = min(delay * 2, STARTUP_RETRY_MAX_SEC)
+
+
+def run(cfg, use_async=False):
+    cafile = cfg.get("cafile") or None
+    done = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *a: done.set())
+    signal.signal(signal.SIGINT, lambda *a: done.set())
+    if cfg.get("metrics_port"):
+        from services import metrics
+        metrics.serve(int(cfg["metrics_port"]), cfg.get("metrics_host", "127.0.0.1"))
+    login = LoginClient(
+        app_base=cfg["app_base"],
+        username=cfg["username"],
+        password=cfg["password"],
+        ca_verify=cafile,
+        log_func=log,
+        store=_token_store(cfg),
+    )
+    started = _retry_startup(login.get_token, done, "登入")
+    if started is None:
+        return
+    token, area_list = started
+    login.start_auto_refresh()
+    routes = build_routes(cfg.get("mapping"), area_list)
+    if not len(routes):
+        _log.warning("沒有任何裝置綁定區域，將不會播放")
+    log(f"裝置頻道 routes：{routes.as_dict()}")
+
+    engine = None
+    if cfg.get("audio_process"):
+        engine = AudioEngine(float(cfg.get("audio_buffer_sec", AudioEngine.BUFFER_SEC)),
+                             log_func=log).start()
+    # The client picks up this player (module singleton)
+    get_player(
+        gap_sec=float(cfg.get("gap_sec", 1.0)),
+        limits=QueueLimits(**cfg["queue"]) if cfg.get("queue") else None,
+        assets=_asset_store(cfg),
+        engine=engine,
+        **{k: cfg[k] for k in ("decode_workers", "lookahead", "ahead_bytes", "max_channels",
+                               "default_priority", "preempt_priority") if k in cfg},
+    )
+
+    kwargs = dict(gap_sec=float(cfg.get("gap_sec", 1.0)), log_func=log, cafile=cafile, login=login)
+    # Optional connection tuning, passed straight to the client
+    for key in ("transports", "ping_interval", "connect_timeout", "ws_trace", "trace_events",
+                "default_priority", "preempt_priority", "chunk_timeout", "batch_subscribe",
+                "reconnection_delay", "reconnection_delay_max", "randomization_factor",
+                "asset_url"):
+        if key in cfg:
+            kwargs[key] = cfg[key]
+    endpoints = cfg.get("endpoints") or [cfg["app_base"]]
+    if use_async and len(endpoints) > 1:
+        _log.warning("--async 不支援多個 endpoints，改用一般連線")
+        use_async = False
+    if use_async:
+        from services.async_client import AsyncAudioSocketClient
+        cli = AsyncAudioSocketClient(cfg["app_base"], routes, area_list, token, **kwargs)
+        apply_device_gaps(cfg.get("mapping"), cli.player)
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            cli.run()
+        finally:
+            if engine is not None:
+                engine.stop()
+        return
+
+    if len(endpoints) > 1:
+        cli = MultiEndpointClient(endpoints, routes, area_list, token,
+                                  mode=cfg.get("failover", "standby"),
+                                  stale_sec=cfg.get("stale_sec"), **kwargs)
+    else:
+        cli = AudioSocketClient(endpoints[0], routes, area_list, token, **kwargs)
+    apply_device_gaps(cfg.get("mapping"), cli.player)
+    stats = _retry_startup(cli.connect, done, "連線")
+    if stats is None:
+        pass  # stopped before the first connect
+    elif len(endpoints) > 1:
+        up = [e["url"] for e in stats["endpoints"] if e["connected"]]
+        log(f"廣播連線開始 → {len(up)}/{len(endpoints)} 個伺服器（{stats['mode']}）：{', '.join(up)}")
+    else:
+        log(f"廣播連線開始 → 目標：{endpoints[0]} ({stats['transport']}, {stats['connect_sec']:.3f}s)")
+    done.wait()
+    log("Stopping...")
+    login.stop_auto_refresh()
+    try:
+        cli.disconnect()
+    finally:
+        cli.player.stop()
+        if engine is not None:
+            engine.stop()
+    log("Stopped")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Headless AudioSocketClient player")
+    ap.add_argument("--config", "-c", help="JSON config file")
+    ap.add_argument("--list-devices", action="store_true", help="print output devices and exit")
+    ap.add_argument("--async", dest="use_async", action="store_true",
+                    help="use the asyncio client instead of the threaded one")
+    ap.add_argument("--log-level", default=None, help="DEBUG, INFO, WARNING (default: $AUDQ_LOG_LEVEL or INFO)")
+    args = ap.parse_args(argv)
+    setup_logging(args.log_level, stream=True)
+    if args.list_devices:
+        list_devices()
+        return 0
+    if not args.config:
+        ap.error("--config is required")
+    run(load_config(args.config), use_async=args.use_async)
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # frozen builds: the audio engine child starts here
+    sys.exit(main())
@@ -1,17 +1,21 @@
 # main.py
-import sys, threading
+import multiprocessing, os, sys, threading
 from services.login import LoginClient
+from services.token_store import TokenStore
 from util.AudioInput import OutputDeviceDetector, AudioUIManager
 from PySide6.QtWidgets import QApplication, QMainWindow, QPushButton, QPlainTextEdit, QWidget, QVBoxLayout, QLineEdit, QLabel, QFormLayout, QFileDialog, QHBoxLayout, QComboBox
 from PySide6.QtUiTools import QUiLoader
-from PySide6.QtCore import Signal, QObject, QTimer, QFile
+from PySide6.QtCore import QTimer, QFile
 import signal
+from services.Audio import get_player
 from services.client import AudioSocketClient
+from services.engine import AudioEngine
+from util.logs import get_logger, setup as setup_logging
 
 
-class Bus(QObject):
-    log = Signal(str)
-BUS = Bus()
+LOG = get_logger("gui")
+LOG_MAX_BLOCKS = 5000      # lines kept in the log widget
+LOG_FLUSH_MS = 100         # GUI-side batch flush interval
 
 
 class Win(QMainWindow):
@@ -74,58 +78,84 @@ class Win(QMainWindow):
             self.btn.clicked.connect(self.start)
         if self.btn_stop is not None:
             self.btn_stop.clicked.connect(self.stop)
+        # Producer threads only append to the log ring; the GUI drains it in batches
+        self._log_ring = setup_logging()
         if self.log is not None:
-            BUS.log.connect(lambda s: self.log.appendPlainText(s))
+            self.log.setMaximumBlockCount(LOG_MAX_BLOCKS)
+            self._log_timer = QTimer(self)
+            self._log_timer.timeout.connect(self._flush_log)
+            self._log_timer.start(LOG_FLUSH_MS)
 
         # Runtime state
         self.worker = None
         self.cli = None
+        self.client = None  # LoginClient, set by login()
+        # AUDQ_AUDIO_PROCESS=1: play through a separate engine process so GUI
+        # stalls cannot starve the audio callback (services.engine)
+        self.engine = None
+        if os.environ.get("AUDQ_AUDIO_PROCESS", "").lower() in ("1", "true", "yes"):
+            self.engine = AudioEngine(log_func=LOG.info).start()
+            get_player(engine=self.engine)
+
+    def _flush_log(self):
+        lines = self._log_ring.drain() if self._log_ring is not None else None
+        if lines:
+            self.log.appendPlainText("\n".join(lines))
 
     def _choose_cafile(self):
         fn, _ = QFileDialog.getOpenFileName(self, "Select Certificate", "", "Certificate Files (*.crt *.pem);;All Files (*)")
         if fn and self.in_cafile is not None:
             self.in_cafile.setText(fn)
     def login(self):
-        BUS.log.emit("登入中...")
+        LOG.info("登入中...")
         self.client = LoginClient(
             app_base=self.in_app_base.text(),
             username=self.in_username.text(),
             password=self.in_password.text(),
             ca_verify=self.in_cafile.text(),
-            log_func=lambda msg: BUS.log.emit(msg)
+            log_func=LOG.info,
+            store=TokenStore(),
         )
-        self.token, self.area = self.client.get_token()
+        # Interactive login: always check the typed credentials with /login
+        # (a cached token would skip that; the store still gets the new one)
+        self.token, self.area = self.client.get_token(refresh=True)
 
         self.ui_channel_map_manager.populate_output_devices(self.area)
         self.channel_mape_group.setVisible(True)
 
     def start(self):
         if self.worker and self.worker.is_alive():
-            BUS.log.emit("已經正在連線")
+            LOG.info("已經正在連線")
             return
         if self.token is None or self.token == "":
-            BUS.log.emit("尚未登入")
+            LOG.info("尚未登入")
         app_base = self.in_app_base.text().strip()
         token = self.token
         cafile = self.in_cafile
         # create client and keep reference for stopping later
         cafile = self.in_cafile.text().strip() or None
-        self.cli = AudioSocketClient(app_base, self.ui_channel_map_manager, self.area, token, log_func=lambda msg: BUS.log.emit(msg),cafile=cafile, )
+        self.cli = AudioSocketClient(app_base, self.ui_channel_map_manager, self.area, token, log_func=LOG.info,cafile=cafile, login=self.client, )
+        if self.client is not None:
+            self.client.start_auto_refresh()  # new tokens reach the socket via login=
         def _worker():
             try:
                 self.cli.connect()
                 self.cli.run_forever()
             except Exception as e:
-                BUS.log.emit(f"連線失敗: {e}")
+                LOG.info(f"連線失敗: {e}")
         self.worker = threading.Thread(target=_worker, daemon=True)
         self.worker.start()
-        BUS.log.emit(f"廣播練線開始 → 目標：{app_base}")
+        LOG.info(f"廣播練線開始 → 目標：{app_base}")
 
     def stop(self):
         if not self.worker:
-            BUS.log.emit("Not running")
+            LOG.info("Not running")
             return
-        BUS.log.emit("Stopping...")
+        LOG.info("Stopping...")
+        if self.client is not None:
+            self.client.stop_auto_refresh()
+            if self.cli is not None:
+                self.client.remove_listener(self.cli.set_token)  # no pushes to the old socket
         try:
             if self.cli is not None:
                 # Prefer class-provided disconnect if available
@@ -137,20 +167,26 @@ class Win(QMainWindow):
                     except Exception:
                         pass
         except Exception as e:
-            BUS.log.emit(f"Stop error: {e}")
+            LOG.info(f"Stop error: {e}")
         # give the thread a moment to exit
         self.worker.join(timeout=3)
         self.worker = None
         self.cli = None
-        BUS.log.emit("Stopped")
+        LOG.info("Stopped")
 
     def closeEvent(self, event):
         try:
             self.stop()
+            if self.engine is not None:
+                get_player().stop()
+                self.engine.stop()
         finally:
             super().closeEvent(event)
 
 if __name__ == "__main__":
+    # Frozen (PyInstaller) builds: the spawned audio engine process must run
+    # its target here instead of starting another GUI
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     # Allow Ctrl+C to work in terminal with Qt
     signal.signal(signal.SIGINT, lambda *args: QApplication.quit())
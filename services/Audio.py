@@ -1,9 +1,40 @@
 # -*- coding: utf-8 -*-
 """
 Audio queue player for base64 audio blobs coming from Socket.IO events.
-- Enqueue base64-encoded audio (mp3/wav/ogg/flac)
-- Plays sequentially with a configurable gap (default 1s)
-- macOS-friendly: uses the built-in `afplay` (no third-party deps)
+- Enqueue base64-encoded audio (mp3/wav/ogg/flac), or raw bytes from a
+  Socket.IO binary attachment; decoded from memory (raw bytes are read
+  through a memoryview, never copied whole), a temp file is only used as
+  a fallback for formats libsndfile can't read through a buffer
+- One queue + worker per output device; clips on different devices play
+  concurrently, each device applies its own gap (default 1s)
+- Gaps are written into the device's continuous stream as exact runs of
+  silence (in samples), overridable per device and per message; an idle
+  worker blocks on its queue and closes the stream after IDLE_CLOSE_SEC
+- Each device keeps one long-lived callback OutputStream fed from a ring
+  buffer; `enqueue_stream` plays the chunks of one message gaplessly,
+  starting as soon as the first chunk is decoded; the chunks may also
+  come from a live source and still be arriving (services.reassembly)
+- Decoded PCM is converted to each device's native sample rate and
+  channel count (services.resample) before it reaches PortAudio
+- Decode runs ahead of playback on a small shared thread pool: the next
+  `lookahead` clips of each device are decoded while earlier ones play,
+  bounded by `ahead_bytes` of decoded-but-unplayed PCM
+- Queues are bounded by item count and encoded bytes, per device and in
+  total (`QueueLimits`); on overflow the oldest lowest-priority clip or
+  the new one is dropped, and "coalesce" first drops a duplicate payload
+- Decoded PCM is kept in a content-addressed LRU cache (`PCMCache`), keyed
+  per target format, so a repeated announcement skips decoding and
+  conversion and starts immediately
+- With an `assets` store (services.assets) decoded clips are also kept on
+  disk, surviving restarts, and can be played by asset id alone
+- With an `engine` (services.engine) the device rings live in shared
+  memory and the output streams run in a separate process, so stalls in
+  this interpreter do not reach the audio callback
+- Device queues are priority ordered: higher `priority` jumps ahead of
+  queued clips, `preempt_priority` and above also cuts off the clip that
+  is playing, and clips whose `ttl_sec` runs out while queued are dropped
+- Plays through sounddevice (PortAudio) on every platform; no external
+  player process
 
 Usage:
     from Audio import AudioQueuePlayer
@@ -11,71 +42,925 @@ Usage:
     player = AudioQueuePlayer(gap_sec=1.0)
 
     # When you receive an event with base64 audio:
-    # player.enqueue_base64(b64_string, fmt_hint="mp3")
+    # player.enqueue_base64(b64_string, device_id, fmt_hint="mp3")
+    # ...or with a binary attachment (raw file bytes):
+    # player.enqueue_bytes(audio_bytes, device_id)
+    # Chunked message, streamed without gaps between chunks:
+    # player.enqueue_stream([b64_0, b64_1, ...], device_id, fmt_hint="mp3")
+    # ...or still arriving over several events (services.reassembly):
+    # player.enqueue_stream(message.reader(), device_id, fmt_hint="mp3")
     # ...or if the payload is a dict you can do:
-    # player.enqueue_event_payload(event_dict)
+    # player.enqueue_event_payload(event_dict, device_id)
+    # Emergency message: plays next and interrupts the current clip
+    # player.enqueue_base64(b64_string, device_id, priority=100)
+    # Promo that is worthless after 10 minutes in the queue
+    # player.enqueue_base64(b64_string, device_id, priority=-10, ttl_sec=600)
+    # Bounded queues for small boxes; replayed duplicates are coalesced
+    # player = AudioQueuePlayer(limits=QueueLimits(max_bytes=16 << 20, policy="coalesce"))
+    # player.drop_stats()     # {"overflow": 3, "coalesced": 12, ...}
+
+    # Per-device / per-message silence after a clip
+    # player.set_device_gap(device_id, 0.25)
+    # player.enqueue_base64(b64_string, device_id, gap_sec=0.0)
+
+    # Disk library: keep decoded clips, replay them by id without the audio
+    # player = AudioQueuePlayer(assets=AssetStore("/var/lib/audq/assets"))
+    # player.enqueue_base64(b64_string, device_id, asset_id="welcome-v3")
+    # player.enqueue_asset("welcome-v3", device_id)   # False if not stored
+
+    # Output streams in their own process (shared-memory rings)
+    # player = AudioQueuePlayer(engine=AudioEngine().start())
+
+    # Pending clips per device:
+    # player.queue_depths()   # {device_id: n, ...}
 
     # Stop when app exits:
     # player.stop()
 """
 
 from __future__ import annotations
-import base64
+import binascii
+import hashlib
+import heapq
+import io
+import itertools
 import os
-import platform
-import queue
-import shutil
-import signal
-import subprocess
+import re
 import tempfile
 import threading
 import time
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Callable, Dict, Any, Iterable, List, Tuple, Union
+import numpy as np
 import sounddevice as sd
 import soundfile as sf
 
+from services import metrics
+from services.assets import AssetStore
+from services.engine import AudioEngine
+from services.reassembly import PENDING
+from services.resample import convert
+from util.devices import get_registry
+from util.logs import get_logger
+
+_log = get_logger("audio")
+
+Buffer = Union[bytes, bytearray, memoryview]
+_B64_HEAD = re.compile(rb"(data:[^,]{0,100},)?[A-Za-z0-9+/=\s]*")
+
+
+
+class PCMCache:
+    """Content-addressed LRU cache of decoded PCM.
+
+    Keys are a BLAKE2b digest of the encoded audio bytes; values are the
+    float32 (frames x channels) array plus its sample rate. Entries are
+    evicted least-recently-used first once `max_bytes` is exceeded.
+    Cached arrays are marked read-only since playback shares them.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(data: Union[bytes, bytearray, memoryview]) -> str:
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, int]]:
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return hit
+
+    def put(self, key: str, pcm: np.ndarray, samplerate: int) -> None:
+        size = pcm.nbytes
+        if size > self.max_bytes:
+            return
+        pcm.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0].nbytes
+            self._entries[key] = (pcm, int(samplerate))
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class QueueLimits:
+    """Backpressure settings for AudioQueuePlayer; None disables a limit.
+
+    Sizes are encoded (base64-decoded) bytes of queued items. Policies:
+      drop_oldest  make room by dropping the oldest clip of the lowest
+                   queued priority
+      drop_newest  reject the incoming clip instead
+      coalesce     when a limit is reached, first drop an incoming clip
+                   identical to one already queued on that device, then
+                   behave like drop_oldest (below the limits, repeats
+                   all play)
+    Clips at or above the player's preempt_priority are never dropped and
+    always admitted.
+    """
+
+    POLICIES = ("drop_oldest", "drop_newest", "coalesce")
+
+    def __init__(self, max_items: Optional[int] = 100, max_bytes: Optional[int] = 32 * 1024 * 1024,
+                 max_total_items: Optional[int] = 500,
+                 max_total_bytes: Optional[int] = 96 * 1024 * 1024,
+                 policy: str = "drop_oldest"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(self.POLICIES)}")
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_total_items = max_total_items
+        self.max_total_bytes = max_total_bytes
+        self.policy = policy
+
+
+class _BufferReader(io.RawIOBase):
+    """Read-only file object over a memoryview for libsndfile's virtual IO.
+
+    soundfile pulls data with readinto() straight into libsndfile's own
+    buffer, so the encoded payload is never copied as a whole (BytesIO
+    would copy anything that is not an exact bytes object).
+    """
+
+    def __init__(self, data: Buffer):
+        self._mv = memoryview(data).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self._mv) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._mv[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = (0, self._pos, len(self._mv))[whence]
+        self._pos = min(max(base + offset, 0), len(self._mv))
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class _Item:
+    """Common scheduling and timing fields (perf_counter seconds) for queued work."""
+
+    __slots__ = ("t_enqueued", "received_at", "first_audio", "priority", "expires_at",
+                 "preempts", "gap_sec", "future", "ahead_bytes", "nbytes", "key", "asset_id")
+
+    def __init__(self, received_at: Optional[float]):
+        self.t_enqueued = time.perf_counter()
+        self.received_at = received_at
+        self.first_audio = False
+        self.priority = 0
+        self.expires_at: Optional[float] = None
+        self.preempts = False
+        self.gap_sec: Optional[float] = None  # None: the device's gap
+        self.future: Optional[Future] = None  # decode-ahead result
+        self.ahead_bytes = 0                  # its share of the decode-ahead budget
+        self.nbytes = 0                       # encoded size, for queue limits
+        self.key: Optional[str] = None        # content digest (coalescing, PCM cache)
+        self.asset_id: Optional[str] = None   # server asset id to remember it by
+
+
+class _Clip(_Item):
+    """Encoded audio bytes waiting on a device queue (no temp file)."""
+
+    __slots__ = ("data", "ext")
+
+    def __init__(self, data: Buffer, ext: str, received_at: Optional[float] = None):
+        super().__init__(received_at)
+        self.data = data
+        self.ext = ext
+        self.nbytes = len(data)
+
+
+class _Asset(_Clip):
+    """A clip already in the asset store, played by its content key."""
+
+    __slots__ = ()
+
+    def __init__(self, key: str, received_at: Optional[float] = None):
+        super().__init__(b"", "", received_at)
+        self.key = key
+
+
+class _Stream(_Item):
+    """Chunks of one message, decoded lazily and played back-to-back.
+
+    `chunks` is a complete list, or a live chunk source (anything with the
+    services.reassembly.ChunkReader get() protocol) whose later chunks may
+    still be in flight; live sources are not coalesced, prefetched or
+    counted against the queue byte limits (the Reassembler caps them).
+    """
+
+    __slots__ = ("chunks", "fmt_hint")
+
+    def __init__(self, chunks: Any, fmt_hint: Optional[str], received_at: Optional[float] = None):
+        super().__init__(received_at)
+        self.chunks = chunks
+        self.fmt_hint = fmt_hint
+        if self.live:
+            self.nbytes = 0
+        else:
+            # encoded size, like _Clip: base64 text is 4/3 of the bytes it holds
+            self.nbytes = sum(len(c) * 3 // 4 if isinstance(c, str) else len(c) for c in chunks)
+
+    @property
+    def live(self) -> bool:
+        return not isinstance(self.chunks, list)
+
+
+class _ListSource:
+    """The chunk source protocol over a complete list."""
+
+    def __init__(self, chunks: list):
+        self._it = iter(chunks)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None, stop=None):
+        return next(self._it, None)
+
+
+# Marks an item whose decode-ahead slot was consumed or dropped
+_CLAIMED: Future = Future()
+
+
+class _ClipQueue:
+    """Priority queue for one device, with expiry and preemption.
+
+    Highest priority first, FIFO within a priority. Items past their
+    `expires_at` are dropped when they reach the head. An item at or above
+    `preempt_priority` that outranks the one being written is marked
+    `preempts` and sets `preempt`; the flag is reset under the same lock
+    when the worker takes its next item, so a preemption can never be lost
+    or hit the urgent item itself.
+    """
+
+    def __init__(self, preempt_priority: int):
+        self.preempt_priority = preempt_priority
+        self.preempt = threading.Event()
+        self.current: Optional[_Item] = None
+        self.closed = False
+        self.woken = False  # the last get() returned None because of wake()
+        self.on_drop: Optional[Callable[[_Item], None]] = None
+        self.nbytes = 0
+        self._wake = False
+        self._heap: List[Tuple[int, int, _Item]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def put(self, item: _Item) -> bool:
+        """Queue `item`; True if it preempts what the device is playing."""
+        with self._cond:
+            heapq.heappush(self._heap, (-item.priority, next(self._seq), item))
+            self.nbytes += item.nbytes
+            item.preempts = item.priority >= self.preempt_priority and (
+                self.current is None or self.current.priority < item.priority)
+            if item.preempts:
+                self.preempt.set()
+            self._cond.notify()
+            return item.preempts
+
+    def get(self, timeout: Optional[float] = None) -> Optional[_Item]:
+        """Next live item (marked current); None after `timeout`, on wake()
+        or once closed.
+
+        With timeout=None this blocks until an item arrives, no polling.
+        """
+        with self._cond:
+            self.woken = False
+            while not self.closed:
+                while self._heap:
+                    _, _, item = heapq.heappop(self._heap)
+                    self.nbytes -= item.nbytes
+                    if item.expires_at is not None and time.perf_counter() > item.expires_at:
+                        metrics.CLIPS_DROPPED.inc(reason="expired")
+                        _log.info("丟棄過期音訊（優先權 %s）", item.priority)
+                        if self.on_drop is not None:
+                            self.on_drop(item)
+                        continue
+                    self.current = item
+                    self.preempt.clear()
+                    self._wake = False
+                    return item
+                if self._wake:
+                    self._wake = False
+                    self.woken = True
+                    return None
+                if not self._cond.wait(timeout):
+                    return None
+            return None
+
+    def wake(self) -> None:
+        """Make a blocked get() return None now, without closing the queue."""
+        with self._cond:
+            self._wake = True
+            self._cond.notify_all()
+
+    def done(self) -> None:
+        with self._cond:
+            self.current = None
+
+    def peek(self, n: int) -> List[_Item]:
+        """The next `n` items in play order, left queued."""
+        with self._cond:
+            return [e[2] for e in heapq.nsmallest(n, self._heap)]
+
+    def has_key(self, key: str, min_priority: int) -> bool:
+        """True if an item with this content and at least `min_priority` is queued."""
+        with self._cond:
+            return key is not None and any(
+                e[2].key == key and e[2].priority >= min_priority for e in self._heap)
+
+    def evict(self) -> Optional[_Item]:
+        """Remove the oldest item of the lowest priority below preempt_priority."""
+        with self._cond:
+            victim = None
+            for i, (neg, seq, item) in enumerate(self._heap):
+                if item.priority >= self.preempt_priority:
+                    continue
+                if victim is None or (neg, -seq) > (self._heap[victim][0], -self._heap[victim][1]):
+                    victim = i
+            if victim is None:
+                return None
+            item = self._heap[victim][2]
+            self._heap[victim] = self._heap[-1]
+            self._heap.pop()
+            heapq.heapify(self._heap)
+            self.nbytes -= item.nbytes
+            return item
+
+    def close(self) -> None:
+        """Wake a blocked get() for shutdown."""
+        with self._cond:
+            self.closed = True
+            self.preempt.set()
+            self._cond.notify_all()
+
+    def qsize(self) -> int:
+        return len(self._heap)
+
+
+class _Interrupt:
+    """Stop flag for the item being played: player stopping or preempted.
+
+    Duck-types the `is_set()` the ring buffer polls while it blocks.
+    """
+
+    __slots__ = ("stop", "preempt")
+
+    def __init__(self, stop: threading.Event, preempt: threading.Event):
+        self.stop = stop
+        self.preempt = preempt
+
+    def is_set(self) -> bool:
+        return self.stop.is_set() or self.preempt.is_set()
+
+
+class _PCMRing:
+    """Single-producer / single-consumer float32 ring buffer.
+
+    The device worker writes, the PortAudio callback reads. `_w` and `_r`
+    are monotonically increasing frame counters each owned by one side, so
+    no lock is taken inside the audio callback. Waits give up once the
+    stream behind the ring is closed or no longer active (`alive()`), as
+    nothing would ever read again.
+    """
+
+    def __init__(self, frames: int, channels: int):
+        self.buf = np.zeros((frames, channels), dtype=np.float32)
+        self.size = frames
+        self._w = 0
+        self._r = 0
+        self._skip = 0
+        self._space = threading.Event()
+        self.closed = False
+        self.alive: Callable[[], bool] = lambda: True
+
+    def available(self) -> int:
+        return self._w - self._r
+
+    def write(self, data: np.ndarray, stop: Union[threading.Event, _Interrupt]) -> bool:
+        """Copy `data` in, blocking while the ring is full. False if stopped."""
+        return self._put(data, len(data), stop)
+
+    def write_silence(self, frames: int, stop: Union[threading.Event, _Interrupt]) -> bool:
+        """Append exactly `frames` frames of silence."""
+        return self._put(None, frames, stop)
+
+    def _put(self, data: Optional[np.ndarray], n: int,
+             stop: Union[threading.Event, _Interrupt]) -> bool:
+        off = 0
+        while off < n:
+            if self.closed:
+                return False
+            free = self.size - (self._w - self._r)
+            if free <= 0:
+                self._space.clear()
+                if self.size - (self._w - self._r) <= 0:
+                    self._space.wait(0.1)
+                if stop.is_set() or self._dead():
+                    return False
+                continue
+            k = min(free, n - off)
+            pos = self._w % self.size
+            first = min(k, self.size - pos)
+            if data is None:
+                self.buf[pos:pos + first] = 0
+                self.buf[:k - first] = 0
+            else:
+                self.buf[pos:pos + first] = data[off:off + first]
+                if k > first:
+                    self.buf[:k - first] = data[off + first:off + k]
+            self._w += k
+            off += k
+        return True
+
+    def flush(self) -> None:
+        """Producer side: drop everything written but not yet played."""
+        self._skip = self._w
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Fill `out` from the ring, zero-padding on underrun."""
+        if self._skip > self._r:
+            self._r = self._skip
+        k = min(len(out), self._w - self._r)
+        pos = self._r % self.size
+        first = min(k, self.size - pos)
+        out[:first] = self.buf[pos:pos + first]
+        if k > first:
+            out[first:k] = self.buf[:k - first]
+        out[k:] = 0
+        self._r += k
+        self._space.set()
+        return k
+
+    def drain(self, stop: Union[threading.Event, _Interrupt]) -> None:
+        """Block until the callback has consumed everything written."""
+        while self.available() > 0 and not stop.is_set() and not self._dead():
+            self._space.clear()
+            if self.available() > 0:
+                self._space.wait(0.1)
+
+    def unplayed(self) -> np.ndarray:
+        """Copy of the frames written but not played (once nothing reads)."""
+        r = max(self._r, self._skip)
+        pos = r % self.size
+        n = self._w - r
+        first = min(n, self.size - pos)
+        return np.concatenate((self.buf[pos:pos + first], self.buf[:n - first]))
+
+    def _dead(self) -> bool:
+        if self.closed:
+            return True
+        try:
+            return not self.alive()
+        except Exception:  # stream torn down under us (PortAudio re-init)
+            return True
+
+
+class _StreamOutput:
+    """Long-lived callback OutputStream for one device, fed through a ring."""
+
+    BUFFER_SEC = 2.0
+
+    def __init__(self, device: Any, samplerate: int, channels: int):
+        self.device = device
+        self.samplerate = int(samplerate)
+        self.channels = int(channels)
+        self.ring = _PCMRing(int(self.samplerate * self.BUFFER_SEC), self.channels)
+        self.stream = sd.OutputStream(
+            device=device,
+            samplerate=self.samplerate,
+            channels=self.channels,
+            dtype="float32",
+            callback=self._callback,
+        )
+        self.stream.start()
+        self.ring.alive = lambda: self.stream.active
+
+    def _callback(self, outdata, frames, time_info, status) -> None:
+        self.ring.read_into(outdata)
+
+    def matches(self, samplerate: int, channels: int) -> bool:
+        return self.samplerate == int(samplerate) and self.channels == int(channels)
+
+    def close(self) -> None:
+        """Idempotent; may be called from another thread (device reload)."""
+        self.ring.closed = True
+        self.ring._space.set()  # wake a blocked writer
+        try:
+            self.stream.stop()
+            self.stream.close()
+        except Exception:
+            pass
+
+
+class _DeviceWorker:
+    """Independent priority queue + playback thread bound to one output device.
+
+    Each device gets its own queue so a long clip on one zone never delays
+    clips routed to another zone; the inter-item gap is applied per device.
+    All audio for the device goes through one persistent `_StreamOutput`,
+    which is only reopened when the sample rate or channel count changes.
+
+    Items and gaps are written back to back into the ring: the gap is
+    `round(gap_sec * samplerate)` frames of silence, so spacing is exact
+    and the stream never stops between clips. The ring write blocking is
+    the only pacing; an empty queue parks the thread on a condition, and
+    after IDLE_CLOSE_SEC without work the stream itself is closed.
+
+    A preempting item interrupts ring writes and discards what is
+    buffered, so it starts within one decode plus ~0.1 s whatever the
+    backlog.
+    """
+
+    IDLE_CLOSE_SEC = 30.0
+    REOPEN_TRIES = 3  # a write gives up after this many streams in a row played nothing
+
+    def __init__(self, player: "AudioQueuePlayer", device: Any, gap_sec: float):
+        self.player = player
+        self.device = device
+        self.gap_sec = float(gap_sec)
+        self.q = _ClipQueue(player.preempt_priority)
+        self.q.on_drop = player._release
+        self.interrupt = _Interrupt(player._stop, self.q.preempt)
+        self.busy = False
+        self.output: Optional[_StreamOutput] = None
+        self._audio_end = 0  # ring frame count where the last written audio ends
+        self._audio_priority = 0
+        self.thread = threading.Thread(
+            target=self._run, name=f"audq-dev-{device}", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self) -> None:
+        stop = self.player._stop
+        while not stop.is_set():
+            item = self.q.get(timeout=self.IDLE_CLOSE_SEC if self.output is not None else None)
+            try:
+                if item is None:
+                    out = self.output
+                    if out is None or stop.is_set():
+                        continue
+                    if out.ring.closed:
+                        if isinstance(out, _StreamOutput) and out.ring.available() > 0:
+                            # closed under us (device reload) with audio left:
+                            # _write() plays it out on a reopened stream
+                            self._write(np.empty((0, out.channels), np.float32), out.samplerate)
+                        else:
+                            self._close_output()
+                    elif not self.q.woken:
+                        out.ring.drain(stop)
+                        self._close_output()
+                    continue
+                self._play_item(item)
+                if self.output is not None and not self.q.preempt.is_set():
+                    # inter-item gap (per message, else per device), as silence
+                    gap = self.gap_sec if item.gap_sec is None else item.gap_sec
+                    frames = int(round(max(gap, 0.0) * self.output.samplerate))
+                    if frames:
+                        self.output.ring.write_silence(frames, self.interrupt)
+            except Exception as e:
+                _log.warning("playback failed on device %s: %s", self.device, e)
+                # the stream may be broken; the next write opens a fresh one
+                self._close_output()
+        self._close_output()
+
+    def _play_item(self, item: _Item) -> None:
+        if item.preempts:
+            self._cut(item)
+        self.player._prefetch(self)
+        self.busy = True
+        metrics.QUEUE_WAIT_SECONDS.observe(time.perf_counter() - item.t_enqueued)
+        try:
+            if isinstance(item, _Stream):
+                self._play_stream(item)
+            else:
+                pcm, samplerate = self.player._take(item, self.device)
+                item.data = b""  # release the encoded bytes early
+                self._play_pcm(pcm, samplerate, item)
+        finally:
+            self.busy = False
+            self.q.done()
+
+    def _cut(self, item: _Item) -> None:
+        """Discard buffered audio (and gap) ahead of a preempting item."""
+        out = self.output
+        if out is None:
+            return
+        if out.ring._r < self._audio_end:
+            if self._audio_priority >= item.priority:
+                return  # still playing something at least as urgent
+            metrics.CLIPS_DROPPED.inc(reason="preempted")
+            _log.info("裝置 %s 播放被高優先權廣播中斷", self.device)
+        out.ring.flush()
+
+    def _play_pcm(self, data: np.ndarray, samplerate: int, item: Optional[_Item] = None) -> None:
+        if self._write(data, samplerate, item):
+            metrics.PLAYBACK_SECONDS.observe(len(data) / samplerate, device=self.device)
+
+    def _play_stream(self, item: _Stream) -> None:
+        """Decode chunk by chunk; audio starts as soon as chunk 0 is in the ring.
+
+        Chunk i+1 is decoding on the pool while chunk i is written, if it
+        has arrived; otherwise (live source) it is waited for and decoded
+        inline while the ring plays out what was already written.
+        """
+        player = self.player
+        src = item.chunks if item.live else _ListSource(item.chunks)
+        wrote = False
+        played = 0.0
+        first = True
+        cur: Optional[Future] = None
+        nxt: Optional[Future] = None
+        try:
+            raw = src.get(True, stop=self.interrupt)
+            while raw is not None:
+                nraw = src.get(False)
+                nxt = None
+                if nraw is not None and nraw is not PENDING:
+                    nxt = player._decode_pool.submit(
+                        player._decode_chunk, nraw, item.fmt_hint, self.device)
+                try:
+                    if first:
+                        pcm, samplerate = player._take(item, self.device, raw)
+                    elif cur is not None:
+                        pcm, samplerate = cur.result()
+                    else:
+                        pcm, samplerate = player._decode_chunk(raw, item.fmt_hint, self.device)
+                except Exception as e:
+                    _log.warning("skipping undecodable chunk on device %s: %s", self.device, e)
+                    pcm = None
+                first = False
+                if pcm is not None:
+                    if not self._write(pcm, samplerate, item) or self.interrupt.is_set():
+                        return
+                    wrote = True
+                    played += len(pcm) / samplerate
+                if nraw is PENDING:
+                    raw, cur = src.get(True, stop=self.interrupt), None
+                else:
+                    raw, cur = nraw, nxt
+                nxt = None
+        finally:
+            item.chunks = []
+            if nxt is not None:
+                nxt.cancel()
+            if wrote:
+                metrics.PLAYBACK_SECONDS.observe(played, device=self.device)
+
+    def _write(self, data: np.ndarray, samplerate: int, item: Optional[_Item] = None) -> bool:
+        out = self.output
+        if isinstance(out, _StreamOutput) and out.ring.closed and out.matches(samplerate, data.shape[1]):
+            # closed under us (device reload) while idle: what it had not
+            # played yet goes out first on the reopened stream
+            self._close_output()
+            data = np.concatenate((out.ring.unplayed(), data))
+        stalls = 0
+        while True:
+            out = self._output_for(samplerate, data.shape[1])
+            if item is not None and not item.first_audio:
+                item.first_audio = True
+                if item.received_at is not None:
+                    # our first frame leaves once the frames already queued ahead have played
+                    lead = out.ring.available() / out.samplerate
+                    metrics.TIME_TO_FIRST_AUDIO.observe(time.perf_counter() - item.received_at + lead)
+            ring = out.ring
+            w0, r0 = ring._w, ring._r
+            ok = ring.write(data, self.interrupt)
+            self._audio_end = ring._w
+            self._audio_priority = item.priority if item is not None else 0
+            if ok or self.interrupt.is_set():
+                return ok
+            self._close_output()
+            if not isinstance(out, _StreamOutput):
+                return False  # engine rings only close when the engine stops
+            # the stream was closed under us (device reload) or died: replay
+            # everything it had not played yet, then the rest of the clip
+            data = np.concatenate((ring.unplayed(), data[ring._w - w0:]))
+            stalls = 0 if ring._r > r0 else stalls + 1
+            if stalls >= self.REOPEN_TRIES:
+                return False  # reopened streams die before playing anything
+            _log.warning("裝置 %s 輸出串流中斷，重新開啟", self.device)
+
+    def _output_for(self, samplerate: int, channels: int):
+        out = self.output
+        if out is not None and (out.ring.closed or not out.matches(samplerate, channels)):
+            out.ring.drain(self.interrupt)  # returns at once if the ring is dead
+            self._close_output()
+            out = None
+        if out is None:
+            # A dedicated stream per device: sd.play() shares one global
+            # stream, so concurrent devices would cut each other off.
+            # Opened under the registry gate: never while PortAudio re-inits,
+            # and the "reinit" listener sees (and closes) it if one follows.
+            try:
+                with get_registry().opening():
+                    out = self.output = self.player._open_output(self.device, samplerate, channels)
+            except Exception:
+                # Device unplugged/renumbered: let the registry re-scan
+                self.player._open_failed(self.device)
+                raise
+        return out
+
+    def _close_output(self) -> None:
+        if self.output is not None:
+            self.output.close()
+            self.output = None
 
 
 class AudioQueuePlayer:
-    def __init__(self, gap_sec: float = 1.0):
+    DEFAULT_PRIORITY = 0
+    PREEMPT_PRIORITY = 100
+    MAX_CHANNELS = 2
+
+    DECODE_WORKERS = 2
+    LOOKAHEAD = 2
+    AHEAD_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, gap_sec: float = 1.0, cache_bytes: int = 64 * 1024 * 1024,
+                 default_priority: int = DEFAULT_PRIORITY, preempt_priority: int = PREEMPT_PRIORITY,
+                 max_channels: int = MAX_CHANNELS, decode_workers: int = DECODE_WORKERS,
+                 lookahead: int = LOOKAHEAD, ahead_bytes: int = AHEAD_BYTES,
+                 limits: Optional[QueueLimits] = None, assets: Optional[AssetStore] = None,
+                 engine: Optional[AudioEngine] = None):
         self.gap_sec = float(gap_sec)
-        self._q: queue.Queue[tuple[str, int]] = queue.Queue()
+        self.limits = limits or QueueLimits()
+        self._admit_lock = threading.Lock()
+        self._drops: Dict[str, int] = {}
+        self._drops_logged = 0.0
+        # Decode-ahead: up to `lookahead` queued items per device are decoded
+        # on the pool while the device plays; no new decode-ahead starts once
+        # `ahead_bytes` of decoded PCM is waiting (lookahead=0 disables it)
+        self.lookahead = max(int(lookahead), 0)
+        self.ahead_bytes = int(ahead_bytes)
+        self._ahead_used = 0
+        self._ahead_lock = threading.Lock()
+        self._decode_pool = ThreadPoolExecutor(max(int(decode_workers), 1),
+                                               thread_name_prefix="audq-decode")
+        # Output layout: the device's channel count, capped (mono PA amps stay
+        # mono, an 8-channel HDMI sink gets stereo instead of 8 copies)
+        self.max_channels = int(max_channels)
+        # Clips without an explicit priority get default_priority; anything at
+        # or above preempt_priority interrupts lower-priority playback
+        self.default_priority = int(default_priority)
+        self.preempt_priority = int(preempt_priority)
+        # Decoded PCM of repeated announcements; cache_bytes=0 disables it
+        self.cache: Optional[PCMCache] = PCMCache(cache_bytes) if cache_bytes > 0 else None
+        # Cache misses being decoded right now, by cache key: a broadcast fanned
+        # out to N devices is decoded once while the other N-1 wait for it
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        # Decoded clips on disk (mmap), behind the in-memory cache; None = off
+        self.assets = assets
+        # Output streams in a separate process (started by the caller); None = here
+        self.engine = engine
         self._stop = threading.Event()
-        self._worker = threading.Thread(target=self._run, daemon=True)
-        self._current_proc: Optional[subprocess.Popen] = None
+        self._workers: Dict[Any, _DeviceWorker] = {}
+        self._workers_lock = threading.Lock()
+        self._device_gaps: Dict[Any, float] = {}
         self._tmp_files: set[str] = set()
-        self._worker.start()
+        metrics.QUEUE_DEPTH.set_function(self.queue_depths)
+        metrics.DECODE_AHEAD_BYTES.set_function(lambda: self._ahead_used)
+        metrics.QUEUE_BYTES.set_function(self.queue_bytes)
+        get_registry().add_listener(self._on_devices)
 
     # --- Public API -------------------------------------------------------
-    def enqueue_base64(self, b64: str, deviceName: int, fmt_hint: Optional[str] = None) -> None:
-        """Decode base64 -> temp file -> enqueue file path for playback.
+    def enqueue_base64(self, b64: str, deviceName: int, fmt_hint: Optional[str] = None,
+                       received_at: Optional[float] = None, priority: Optional[int] = None,
+                       ttl_sec: Optional[float] = None, gap_sec: Optional[float] = None,
+                       asset_id: Optional[str] = None) -> None:
+        """Decode base64 -> enqueue the raw bytes on the device's queue.
+        The worker decodes straight from memory; no temp file is written.
         fmt_hint can be like "mp3", "wav", "audio/mpeg", etc.
+        received_at (time.perf_counter()) feeds the time-to-first-audio metric.
+        priority (default: default_priority) orders the device queue;
+        ttl_sec drops the clip if it has not started within that time;
+        gap_sec overrides the device's silence after this clip.
+        asset_id names the clip in the asset store, for enqueue_asset later.
         """
-        print(f"456456")
-        if not isinstance(b64, (bytes, str)):
-            raise TypeError("b64 must be str or bytes")
-        if isinstance(b64, bytes):
-            b64 = b64.decode("utf-8", "ignore")
+        data = self._b64decode(b64)
+        ext = self._sniff_ext(data, fmt_hint)
+        self._submit(deviceName, self._clip(data, ext, received_at, asset_id),
+                     priority, ttl_sec, gap_sec)
 
-        try:
-            data = base64.b64decode(b64, validate=True)
-        except Exception:
-            # Some backends send "data:...;base64,XXXXX"; try to split
-            if "," in b64:
-                data = base64.b64decode(b64.split(",", 1)[1], validate=False)
-            else:
-                raise
-        print(f"111")
+    def enqueue_bytes(self, data: Buffer, deviceName: Any, fmt_hint: Optional[str] = None,
+                      received_at: Optional[float] = None, priority: Optional[int] = None,
+                      ttl_sec: Optional[float] = None, gap_sec: Optional[float] = None,
+                      asset_id: Optional[str] = None) -> None:
+        """Enqueue raw encoded audio (e.g. a Socket.IO binary attachment).
+
+        The buffer is kept as a memoryview and decoded in place; bytes that
+        turn out to be base64 text are decoded as such. Other arguments as
+        for enqueue_base64.
+        """
+        data = self._raw_audio(data)
         ext = self._sniff_ext(data, fmt_hint)
-        print(f"22")
-        tmp_fd, tmp_path = tempfile.mkstemp(prefix="audq_", suffix=ext)
-        os.close(tmp_fd)
-        with open(tmp_path, "wb") as f:
-            f.write(data)
-        print(f"33")
-        self._tmp_files.add(tmp_path)
-        print("deviceid. :",deviceName)
-        self._q.put((tmp_path, deviceName))
+        self._submit(deviceName, self._clip(data, ext, received_at, asset_id),
+                     priority, ttl_sec, gap_sec)
+
+    def enqueue_many(self, audio: Union[str, Buffer], devices: Iterable[Any],
+                     fmt_hint: Optional[str] = None, received_at: Optional[float] = None,
+                     priority: Optional[int] = None, ttl_sec: Optional[float] = None,
+                     gap_sec: Optional[float] = None, asset_id: Optional[str] = None) -> None:
+        """Queue one clip (base64 str or raw bytes) on several devices.
+
+        The audio is base64-decoded, sniffed and hashed once; every device
+        queue gets the same bytes and content key, so the decodes share
+        the PCM cache. Other arguments as for enqueue_base64.
+        """
+        data = self._b64decode(audio) if isinstance(audio, str) else self._raw_audio(audio)
+        ext = self._sniff_ext(data, fmt_hint)
+        key = PCMCache.key(data)
+        for deviceName in devices:
+            clip = self._clip(data, ext, received_at, asset_id)
+            clip.key = key
+            self._submit(deviceName, clip, priority, ttl_sec, gap_sec)
+
+    def enqueue_asset(self, asset_id: str, deviceName: Any, received_at: Optional[float] = None,
+                      priority: Optional[int] = None, ttl_sec: Optional[float] = None,
+                      gap_sec: Optional[float] = None) -> bool:
+        """Queue a clip from the asset store by asset id (or content key).
+
+        Returns False, queuing nothing, if the store does not have it; the
+        caller then has to get the audio itself. Other arguments as for
+        enqueue_base64.
+        """
+        key = self.assets.resolve(asset_id) if self.assets is not None else None
+        if key is None:
+            return False
+        self._submit(deviceName, _Asset(key, received_at), priority, ttl_sec, gap_sec)
+        return True
+
+    @staticmethod
+    def _clip(data: Buffer, ext: str, received_at: Optional[float],
+              asset_id: Optional[str]) -> _Clip:
+        clip = _Clip(data, ext, received_at)
+        clip.asset_id = asset_id
+        return clip
+
+    def enqueue_stream(self, chunks: Iterable[Union[str, Buffer]], deviceName: int,
+                       fmt_hint: Optional[str] = None, received_at: Optional[float] = None,
+                       priority: Optional[int] = None, ttl_sec: Optional[float] = None,
+                       gap_sec: Optional[float] = None) -> None:
+        """Queue the chunks (base64 str or raw bytes) of one message for gapless streaming.
+
+        Chunks are decoded one at a time by the device worker and fed into
+        the device's persistent output stream, so playback starts once the
+        first chunk is decoded and no gap is inserted between chunks.
+        `chunks` may also be a live source such as a
+        services.reassembly.ChunkReader, for messages whose chunks arrive
+        over several events; the worker then waits for each next chunk.
+        priority/ttl_sec/gap_sec as for enqueue_base64.
+        """
+        if hasattr(chunks, "get"):
+            self._submit(deviceName, _Stream(chunks, fmt_hint, received_at),
+                         priority, ttl_sec, gap_sec)
+            return
+        chunks = [c for c in chunks if isinstance(c, (str, bytes, bytearray, memoryview)) and c]
+        if chunks:
+            self._submit(deviceName, _Stream(chunks, fmt_hint, received_at),
+                         priority, ttl_sec, gap_sec)
 
     def enqueue_event_payload(self, payload: Dict[str, Any], deviceName: str) -> None:
         """Convenience: try common keys in your event payload.
@@ -87,7 +972,7 @@ class AudioQueuePlayer:
         cand = None
         hint = None
         if isinstance(payload, dict):
-            if "audio" in payload and isinstance(payload["audio"], (str, bytes)):
+            if "audio" in payload and isinstance(payload["audio"], (str, bytes, bytearray, memoryview)):
                 cand = payload["audio"]
                 hint = payload.get("format") or payload.get("mime")
             elif "data" in payload and isinstance(payload["data"], dict):
@@ -96,17 +981,78 @@ class AudioQueuePlayer:
                 hint = d.get("format") or d.get("mime")
         if cand is None:
             raise ValueError("payload does not contain a base64 audio field")
-        self.enqueue_base64(cand, hint, deviceName)
+        if isinstance(cand, str):
+            self.enqueue_base64(cand, deviceName, hint, **self.schedule_fields(payload))
+        else:
+            self.enqueue_bytes(cand, deviceName, hint, **self.schedule_fields(payload))
+
+    # payload field -> (enqueue keyword, type)
+    SCHEDULE_FIELDS = {"priority": ("priority", int), "ttl": ("ttl_sec", float),
+                       "gap": ("gap_sec", float)}
+
+    @classmethod
+    def schedule_fields(cls, msg: Dict[str, Any]) -> Dict[str, Any]:
+        """Enqueue keywords (priority, ttl_sec, gap_sec) found in an event payload.
+
+        Looks at the payload and its "data" dict; absent or invalid fields
+        are left out:
+          {"priority": 100, "ttl": 30, "gap": 0.5, ...}
+        """
+        out: Dict[str, Any] = {}
+        for d in (msg, msg.get("data") if isinstance(msg, dict) else None):
+            if not isinstance(d, dict):
+                continue
+            for field, (kw, typ) in cls.SCHEDULE_FIELDS.items():
+                if kw not in out and d.get(field) is not None:
+                    try:
+                        out[kw] = typ(d[field])
+                    except (TypeError, ValueError):
+                        pass
+        return out
+
+    def set_device_gap(self, deviceName: Any, gap_sec: Optional[float]) -> None:
+        """Override the inter-item gap for one device (None restores the default)."""
+        if gap_sec is None:
+            self._device_gaps.pop(deviceName, None)
+        else:
+            self._device_gaps[deviceName] = float(gap_sec)
+        with self._workers_lock:
+            w = self._workers.get(deviceName)
+        if w is not None:
+            w.gap_sec = self._device_gaps.get(deviceName, self.gap_sec)
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters and memory use of the PCM cache."""
+        return self.cache.stats() if self.cache is not None else {}
+
+    def queue_depths(self) -> Dict[Any, int]:
+        """Pending clips per device (includes the one currently playing)."""
+        with self._workers_lock:
+            workers = list(self._workers.items())
+        return {dev: w.q.qsize() + (1 if w.busy else 0) for dev, w in workers}
+
+    def queue_bytes(self) -> Dict[Any, int]:
+        """Encoded bytes waiting per device."""
+        with self._workers_lock:
+            workers = list(self._workers.items())
+        return {dev: w.q.nbytes for dev, w in workers}
+
+    def drop_stats(self) -> Dict[str, int]:
+        """Clips dropped by backpressure, by reason (overflow, rejected, coalesced)."""
+        return dict(self._drops)
 
     def stop(self) -> None:
-        """Stop the background worker and cleanup temp files."""
+        """Stop all device workers and cleanup temp files."""
+        get_registry().remove_listener(self._on_devices)
         self._stop.set()
-        if self._current_proc and self._current_proc.poll() is None:
-            try:
-                self._current_proc.send_signal(signal.SIGTERM)
-            except Exception:
-                pass
-        self._worker.join(timeout=5)
+        with self._workers_lock:
+            for w in self._workers.values():
+                w.q.close()  # wake idle workers
+        with self._workers_lock:
+            workers = list(self._workers.values())
+        self._decode_pool.shutdown(wait=False, cancel_futures=True)
+        for w in workers:
+            w.thread.join(timeout=5)
         # cleanup tmp files
         for p in list(self._tmp_files):
             try:
@@ -117,63 +1063,371 @@ class AudioQueuePlayer:
                 self._tmp_files.discard(p)
 
     # --- Internals --------------------------------------------------------
-    def _run(self) -> None:
-        while not self._stop.is_set():
-            try:
-                path, deviceName = self._q.get(timeout=0.25)
-                print("deviceID:",deviceName)
-            except queue.Empty:
-                continue
+    def _submit(self, deviceName: Any, item: _Item, priority: Optional[int],
+                ttl_sec: Optional[float], gap_sec: Optional[float]) -> None:
+        item.priority = self.default_priority if priority is None else int(priority)
+        if ttl_sec is not None and ttl_sec > 0:
+            item.expires_at = item.t_enqueued + float(ttl_sec)
+        if gap_sec is not None:
+            item.gap_sec = float(gap_sec)
+        w = self._worker_for(deviceName)
+        if self.limits.policy == "coalesce" and item.key is None:
+            item.key = self._content_key(item)
+        with self._admit_lock:
+            if not self._admit(w, item):
+                return
+            if w.q.put(item):
+                _log.info("高優先權廣播（%s）插播至裝置 %s", item.priority, deviceName)
+        self._prefetch(w)
+
+    def _admit(self, w: _DeviceWorker, item: _Item) -> bool:
+        """Apply the queue limits for `item`, dropping clips as the policy says."""
+        lim = self.limits
+        urgent = item.priority >= self.preempt_priority
+        coalesce = lim.policy == "coalesce"
+
+        def full(queues, max_items, max_bytes) -> bool:
+            return ((max_items is not None and sum(q.qsize() for q in queues) + 1 > max_items)
+                    or (max_bytes is not None
+                        and sum(q.nbytes for q in queues) + item.nbytes > max_bytes))
+
+        with self._workers_lock:
+            queues = [x.q for x in self._workers.values()]
+        for scope, max_items, max_bytes in ((queues, lim.max_total_items, lim.max_total_bytes),
+                                            ([w.q], lim.max_items, lim.max_bytes)):
+            while full(scope, max_items, max_bytes):
+                if coalesce:
+                    coalesce = False  # checked once, and only once a limit is hit
+                    if w.q.has_key(item.key, item.priority):
+                        self._dropped(item, "coalesced")
+                        return False
+                if lim.policy == "drop_newest" and not urgent:
+                    self._dropped(item, "rejected")
+                    return False
+                # make room where the most bytes are queued
+                victim = None
+                for q in sorted(scope, key=lambda q: q.nbytes, reverse=True):
+                    victim = q.evict()
+                    if victim is not None:
+                        break
+                if victim is None:  # only urgent clips left
+                    if urgent:
+                        break
+                    self._dropped(item, "rejected")
+                    return False
+                self._dropped(victim, "overflow")
+        return True
+
+    def _dropped(self, item: _Item, reason: str) -> None:
+        self._release(item)
+        self._drops[reason] = self._drops.get(reason, 0) + 1
+        metrics.CLIPS_DROPPED.inc(reason=reason)
+        now = time.monotonic()
+        if now - self._drops_logged >= 10.0:
+            self._drops_logged = now
+            _log.warning("播放佇列背壓，累計丟棄音訊：%s", self._drops)
+
+    @staticmethod
+    def _content_key(item: _Item) -> Optional[str]:
+        if isinstance(item, _Asset):
+            return item.key
+        if isinstance(item, _Clip):
+            return PCMCache.key(item.data)
+        if item.live:
+            return None  # not all there yet; replays are de-duplicated by message id
+        h = hashlib.blake2b(digest_size=16)
+        for c in item.chunks:
+            h.update(c.encode("ascii", "ignore") if isinstance(c, str) else c)
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _prefetch(self, w: _DeviceWorker) -> None:
+        """Start decoding the next `lookahead` items of `w` within the budget."""
+        if not self.lookahead:
+            return
+        for item in w.q.peek(self.lookahead):
+            if isinstance(item, _Stream) and item.live:
+                continue  # chunk 0 may not have arrived
+            with self._ahead_lock:
+                if item.future is not None:
+                    continue
+                if self._ahead_used >= self.ahead_bytes or self._stop.is_set():
+                    return
+                item.future = self._decode_pool.submit(self._decode_ahead, item, w.device)
+
+    def _decode_ahead(self, item: _Item, device: Any) -> Tuple[np.ndarray, int]:
+        if isinstance(item, _Stream):
+            pcm, samplerate = self._decode_chunk(item.chunks[0], item.fmt_hint, device)
+        else:
+            pcm, samplerate = self._decode(item.data, item.ext, device, item.key, item.asset_id)
+        with self._ahead_lock:
+            item.ahead_bytes = pcm.nbytes
+            self._ahead_used += pcm.nbytes
+        return pcm, samplerate
+
+    def _claim(self, item: _Item) -> Optional[Future]:
+        """Detach an item's decode-ahead future; no new one can be started after."""
+        with self._ahead_lock:
+            fut, item.future = item.future, _CLAIMED
+        return None if fut is _CLAIMED else fut
+
+    def _release(self, item: _Item, fut: Optional[Future] = None) -> None:
+        """Return an item's decode-ahead bytes to the budget (now or when done)."""
+        if fut is None:
+            fut = self._claim(item)
+        if fut is None or fut.cancel():
+            return
+
+        def _give_back(_f):
+            with self._ahead_lock:
+                self._ahead_used -= item.ahead_bytes
+                item.ahead_bytes = 0
+
+        fut.add_done_callback(_give_back)
+
+    def _take(self, item: _Item, device: Any, raw: Optional[Union[str, bytes]] = None
+              ) -> Tuple[np.ndarray, int]:
+        """Decoded PCM for `item` (chunk `raw` for streams): the decode-ahead
+        result if one was started, else decoded inline."""
+        fut = self._claim(item)
+        if fut is not None:
             try:
-                self._play_file(path, deviceName)
+                return fut.result()
             finally:
-                # remove after play to avoid disk pile-up
-                try:
-                    os.remove(path)
-                except Exception:
-                    pass
-                self._tmp_files.discard(path)
-                self._q.task_done()
-                # inter-item gap
-                self._sleep_interruptible(self.gap_sec)
-
-    def _find_ffplay(self) -> Optional[str]:
-        # Prefer a bundled ffplay.exe next to this file; fallback to PATH
-        candidates = []
-        base = os.path.abspath(os.path.dirname(__file__))
-        candidates.append(os.path.join(base, 'ffplay.exe'))
-        # On mac/linux also allow plain 'ffplay'
-        candidates.append(shutil.which('ffplay'))
-        for c in candidates:
-            if c and os.path.exists(c):
-                return c
-        return None
+                self._release(item, fut)
+        if isinstance(item, _Stream):
+            return self._decode_chunk(raw, item.fmt_hint, device)
+        return self._decode(item.data, item.ext, device, item.key, item.asset_id)
+
+    def _decode_chunk(self, raw: Union[str, Buffer], fmt_hint: Optional[str],
+                      device: Any) -> Tuple[np.ndarray, int]:
+        data = self._b64decode(raw) if isinstance(raw, str) else self._raw_audio(raw)
+        return self._decode(data, self._sniff_ext(data, fmt_hint), device)
+
+    def _on_devices(self, event: str) -> None:
+        """Registry listener: release every stream before PortAudio is re-initialised.
+
+        Workers notice the closed ring and reopen their device on the next
+        write, replaying what the old stream had not played yet; idle ones
+        are woken on "changed" to do so. The engine process has its own
+        PortAudio, so it is restarted to see the new device set as well.
+        """
+        with self._workers_lock:
+            workers = list(self._workers.values())
+        if event == "changed":
+            for w in workers:
+                w.q.wake()  # idle workers replay what the closed streams held
+            return
+        if event != "reinit":
+            return
+        outputs = [w.output for w in workers]
+        for out in outputs:
+            if isinstance(out, _StreamOutput):
+                out.close()
+        if self.engine is not None and self.engine.alive:
+            self.engine.restart("devices")
+
+    def _open_failed(self, device: Any) -> None:
+        """A device did not open: re-enumerate, and re-init PortAudio only if
+        the device is gone from the list, no other zone is playing and the
+        last re-init is REINIT_MIN_SEC old (a re-init closes every stream)."""
+        reg = get_registry()
+        if not reg.invalidate(device) or not reg.reinit_due():
+            return
+        with self._workers_lock:
+            others = [w for w in self._workers.values() if w.device != device]
+        if any(w.busy or (w.output is not None and w.output.ring.available() > 0) for w in others):
+            _log.info("裝置 %s 不在清單中；其他裝置播放中，暫不重新初始化音訊", device)
+            return
+        reg.reload()
+
+    def _open_output(self, device: Any, samplerate: int, channels: int):
+        if self.engine is not None:
+            return self.engine.open(device, samplerate, channels)
+        return _StreamOutput(device, samplerate, channels)
+
+    def _worker_for(self, deviceName: Any) -> _DeviceWorker:
+        with self._workers_lock:
+            w = self._workers.get(deviceName)
+            if w is None:
+                gap = self._device_gaps.get(deviceName, self.gap_sec)
+                w = _DeviceWorker(self, deviceName, gap)
+                self._workers[deviceName] = w
+            return w
+
+    @staticmethod
+    def _b64decode(b64: Union[str, Buffer]) -> bytes:
+        """Single-pass base64 decode of str or ASCII bytes.
+
+        A "data:...;base64," prefix is stripped up front (some backends send
+        data URLs); a2b_base64 then skips whitespace and other non-alphabet
+        characters in the same pass, so nothing is decoded twice.
+        """
+        if not isinstance(b64, (bytes, bytearray, memoryview, str)):
+            raise TypeError("b64 must be str or bytes")
+        t0 = time.perf_counter()
+        if isinstance(b64, str):
+            if b64.startswith("data:"):
+                b64 = b64[b64.index(",", 0, 256) + 1:]
+        else:
+            mv = memoryview(b64).cast("B")
+            if mv[:5] == b"data:":
+                mv = mv[bytes(mv[:256]).index(b",") + 1:]
+            b64 = mv
+        data = binascii.a2b_base64(b64)
+        metrics.DECODE_SECONDS.observe(time.perf_counter() - t0, stage="base64")
+        return data
+
+    @classmethod
+    def _raw_audio(cls, data: Buffer) -> Buffer:
+        """Zero-copy view of raw audio bytes; base64 text in bytes is decoded."""
+        mv = memoryview(data).cast("B")
+        if cls._magic_ext(mv) is None and _B64_HEAD.fullmatch(bytes(mv[:128])):
+            return cls._b64decode(mv)
+        return mv
+
+    def _decode(self, data: Buffer, ext: str, device: Any = None,
+                key: Optional[str] = None, asset_id: Optional[str] = None
+                ) -> Tuple[np.ndarray, int]:
+        """Return (float32 frames x channels, samplerate), cached by content.
+
+        With a known `device` the PCM is already in its native format, and
+        the cache entry is keyed by content + that format, so devices
+        sharing a format share the converted copy.
+        """
+        target = self._target_format(device)
+        if self.cache is None:
+            return self._convert(*self._load_pcm(data, ext, key, asset_id), target)
+        key = key or PCMCache.key(data)
+        ckey = key if target is None else f"{key}@{target[0]}x{target[1]}"
+        hit = self.cache.get(ckey)
+        if hit is not None:
+            metrics.CACHE_REQUESTS.inc(result="hit")
+            if asset_id and self.assets is not None and asset_id not in self.assets:
+                self._load_pcm(data, ext, key, asset_id)  # stored before ids were sent
+            return hit
+
+        def _fill() -> Tuple[np.ndarray, int]:
+            hit = self.cache.get(ckey)  # filled while we were getting here
+            if hit is not None:
+                return hit
+            metrics.CACHE_REQUESTS.inc(result="miss")
+            # devices with another native format still share the decode
+            loaded = self._single_flight(f"{key}#decode", lambda: self._load_pcm(data, ext, key, asset_id))
+            pcm, samplerate = self._convert(*loaded, target)
+            self.cache.put(ckey, pcm, samplerate)
+            return pcm, samplerate
+
+        return self._single_flight(ckey, _fill)
+
+    def _single_flight(self, key: str, fn: Callable[[], Tuple[np.ndarray, int]]
+                       ) -> Tuple[np.ndarray, int]:
+        """fn(), unless a call for `key` is already running: then its result."""
+        with self._inflight_lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if not owner:
+            metrics.CACHE_REQUESTS.inc(result="shared")
+            return fut.result()
+        try:
+            res = fn()
+            fut.set_result(res)
+            return res
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _load_pcm(self, data: Buffer, ext: str, key: Optional[str] = None,
+                  asset_id: Optional[str] = None) -> Tuple[np.ndarray, int]:
+        """Decoded PCM as stored: from the asset store, else decoded (and stored)."""
+        if self.assets is None:
+            return self._decode_uncached(data, ext)
+        key = key or PCMCache.key(data)
+        hit = self.assets.get(key)
+        if hit is not None:
+            metrics.CACHE_REQUESTS.inc(result="disk")
+            if asset_id:
+                self.assets.put(key, *hit, alias=asset_id)
+            return hit
+        if not len(data):
+            raise LookupError(f"asset {key} is no longer in the store")
+        pcm, samplerate = self._decode_uncached(data, ext)
+        self.assets.put(key, pcm, samplerate, alias=asset_id)
+        return pcm, samplerate
 
-    def _play_file(self, path: str, deviceName) -> None:
-        # Use sounddevice to play audio on specified device
-        system = platform.system()
+    def _target_format(self, device: Any) -> Optional[Tuple[int, int]]:
+        """(samplerate, channels) to play on `device`; None = leave PCM as decoded."""
+        if device is None:
+            return None
+        native = get_registry().native_format(device)
+        if not native or native[0] <= 0 or native[1] <= 0:
+            return None
+        return int(native[0]), min(int(native[1]), self.max_channels)
+
+    @staticmethod
+    def _convert(pcm: np.ndarray, samplerate: int,
+                 target: Optional[Tuple[int, int]]) -> Tuple[np.ndarray, int]:
+        if target is None or (samplerate == target[0] and pcm.shape[1] == target[1]):
+            return pcm, samplerate
+        t0 = time.perf_counter()
+        out = convert(pcm, samplerate, target[0], target[1])
+        metrics.DECODE_SECONDS.observe(time.perf_counter() - t0, stage="convert")
+        return out, target[0]
+
+    def _decode_uncached(self, data: Buffer, ext: str):
+        """Decode encoded audio to float32 frames x channels, from memory.
+
+        libsndfile sniffs the container from the header and reads through
+        `_BufferReader`, so the payload is not copied first. Falls back to
+        a temp file only if libsndfile cannot decode the format through its
+        virtual-IO interface (e.g. old builds without MP3).
+        """
+        t0 = time.perf_counter()
         try:
-            import soundfile as sf
-            for i, d in enumerate(sd.query_devices()):
-                print(f"[{i}] {d['name']} | hostapi: {d['hostapi']} | max_output_channels: {d['max_output_channels']}")
-            data, samplerate = sf.read(path, dtype='float32')
-            print("device id:", deviceName)
-            sd.play(data, samplerate=samplerate, device=deviceName)
-            sd.wait()
+            out = sf.read(_BufferReader(data), dtype="float32", always_2d=True)
+            metrics.DECODE_SECONDS.observe(time.perf_counter() - t0, stage="audio")
+            return out
         except Exception as e:
-            print(f"[warn] sounddevice playback failed: {e}")
+            _log.warning("in-memory decode failed (%s); retrying via temp file", e)
+        t0 = time.perf_counter()
+        out = self._decode_via_tempfile(data, ext)
+        metrics.DECODE_SECONDS.observe(time.perf_counter() - t0, stage="tempfile")
+        return out
 
-    def _sleep_interruptible(self, seconds: float) -> None:
-        """Sleep in small slices so `stop()` can interrupt promptly."""
-        end = time.time() + float(seconds)
-        while not self._stop.is_set():
-            remaining = end - time.time()
-            if remaining <= 0:
-                break
-            time.sleep(min(0.1, remaining))
+    def _decode_via_tempfile(self, data: Buffer, ext: str):
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix="audq_", suffix=ext)
+        self._tmp_files.add(tmp_path)
+        try:
+            with os.fdopen(tmp_fd, "wb") as f:
+                f.write(data)
+            return sf.read(tmp_path, dtype="float32", always_2d=True)
+        finally:
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
+            self._tmp_files.discard(tmp_path)
 
     @staticmethod
-    def _sniff_ext(data: bytes, hint: Optional[str]) -> str:
+    def _magic_ext(data: Buffer) -> Optional[str]:
+        """Container from the first bytes, or None if not recognised."""
+        if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+            return ".wav"
+        if data[:3] == b"ID3" or (len(data) > 2 and data[0] == 0xFF and (data[1] & 0xE0) == 0xE0):
+            return ".mp3"
+        if data[:4] == b"fLaC":
+            return ".flac"
+        if data[:4] == b"OggS":
+            return ".ogg"
+        return None
+
+    @classmethod
+    def _sniff_ext(cls, data: Buffer, hint: Optional[str]) -> str:
         h = (hint or "").lower()
         if h in ("mp3", "audio/mpeg", "mpeg", "mpga"):  # mp3
             return ".mp3"
@@ -183,24 +1437,30 @@ class AudioQueuePlayer:
             return ".flac"
         if h in ("ogg", "audio/ogg"):
             return ".ogg"
-        # Magic sniff
-        if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
-            return ".wav"
-        if data[:3] == b"ID3" or (len(data) > 2 and data[0] == 0xFF and (data[1] & 0xE0) == 0xE0):
-            return ".mp3"
-        if data[:4] == b"fLaC":
-            return ".flac"
-        if data[:4] == b"OggS":
-            return ".ogg"
-        # default
-        return ".mp3"
+        # Magic sniff, default mp3
+        return cls._magic_ext(data) or ".mp3"
 
 
 # Convenience singleton (optional):
 _default_player: Optional[AudioQueuePlayer] = None
 
-def get_player(gap_sec: float = 1.0) -> AudioQueuePlayer:
+def get_player(gap_sec: float = 1.0, cache_bytes: int = 64 * 1024 * 1024,
+               default_priority: int = AudioQueuePlayer.DEFAULT_PRIORITY,
+               preempt_priority: int = AudioQueuePlayer.PREEMPT_PRIORITY,
+               max_channels: int = AudioQueuePlayer.MAX_CHANNELS,
+               decode_workers: int = AudioQueuePlayer.DECODE_WORKERS,
+               lookahead: int = AudioQueuePlayer.LOOKAHEAD,
+               ahead_bytes: int = AudioQueuePlayer.AHEAD_BYTES,
+               limits: Optional[QueueLimits] = None,
+               assets: Optional[AssetStore] = None,
+               engine: Optional[AudioEngine] = None) -> AudioQueuePlayer:
     global _default_player
     if _default_player is None:
-        _default_player = AudioQueuePlayer(gap_sec=gap_sec)
+        _default_player = AudioQueuePlayer(gap_sec=gap_sec, cache_bytes=cache_bytes,
+                                           default_priority=default_priority,
+                                           preempt_priority=preempt_priority,
+                                           max_channels=max_channels,
+                                           decode_workers=decode_workers,
+                                           lookahead=lookahead, ahead_bytes=ahead_bytes,
+                                           limits=limits, assets=assets, engine=engine)
     return _default_player
\ No newline at end of file
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk library of decoded announcement audio, read back through mmap.
+
+Every clip the player decodes can be kept here as 16-bit PCM (half the
+size of float32, and "decoding" it is one vectorized scale), so a repeat
+broadcast, even after a restart, skips base64 and codec work entirely, and
+an event may carry just an asset id instead of the audio.
+
+Layout in `directory`:
+- data-<gen>.bin: append-only PCM records, interleaved int16
+- index.jsonl: the data file name on the first line, then one line per
+  record {"key", "off", "frames", "ch", "sr"} and per id alias
+  {"alias", "key"}; appended after the record's data is written, so a
+  crash can only leave unreferenced bytes behind, and records that point
+  past the end of the data file are ignored on load
+
+Reads go through one read-only mmap of the data file (remapped when it
+has grown), so only the pages being played are resident. When the data
+file would exceed `max_bytes`, the least recently used records are
+dropped by rewriting the live ones into data-<gen+1>.bin.
+
+Usage:
+    from services.assets import AssetStore
+
+    store = AssetStore("/var/lib/audq/assets", max_bytes=2 << 30)
+    store.put(key, pcm, 48000, alias="welcome-v3")
+    pcm, sr = store.get("welcome-v3")        # alias or content key
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from util.logs import get_logger
+
+_log = get_logger("assets")
+
+INDEX = "index.jsonl"
+
+
+class _Record:
+    __slots__ = ("off", "frames", "ch", "sr")
+
+    def __init__(self, off: int, frames: int, ch: int, sr: int):
+        self.off, self.frames, self.ch, self.sr = off, frames, ch, sr
+
+    @property
+    def nbytes(self) -> int:
+        return self.frames * self.ch * 2
+
+
+class AssetStore:
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.RLock()
+        self._records: "OrderedDict[str, _Record]" = OrderedDict()  # LRU order
+        self._aliases: Dict[str, str] = {}
+        self._gen = 0
+        self._size = 0
+        self._mm: Optional[mmap.mmap] = None
+        self._data = None  # append handle
+        self._index = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # --- public API -------------------------------------------------------
+    def resolve(self, key_or_alias: str) -> Optional[str]:
+        with self._lock:
+            key = self._aliases.get(key_or_alias, key_or_alias)
+            return key if key in self._records else None
+
+    def __contains__(self, key_or_alias: str) -> bool:
+        return self.resolve(key_or_alias) is not None
+
+    def get(self, key_or_alias: str) -> Optional[Tuple[np.ndarray, int]]:
+        """(float32 frames x channels, samplerate), or None if not stored."""
+        with self._lock:
+            key = self._aliases.get(key_or_alias, key_or_alias)
+            rec = self._records.get(key)
+            if rec is None:
+                return None
+            self._records.move_to_end(key)
+            mm = self._map(rec.off + rec.nbytes)
+            pcm16 = np.frombuffer(mm, dtype="<i2", count=rec.frames * rec.ch, offset=rec.off)
+            out = pcm16.reshape(rec.frames, rec.ch).astype(np.float32)
+        out *= 1.0 / 32768.0
+        return out, rec.sr
+
+    def put(self, key: str, pcm: np.ndarray, samplerate: int,
+            alias: Optional[str] = None) -> None:
+        """Store float32 PCM under its content `key` (no-op if present)."""
+        with self._lock:
+            if key not in self._records:
+                pcm16 = np.clip(np.asarray(pcm, dtype=np.float32) * 32767.0, -32768, 32767)
+                data = np.ascontiguousarray(pcm16.astype("<i2"))
+                if not data.nbytes or data.nbytes > self.max_bytes:
+                    return
+                if self._size + data.nbytes > self.max_bytes:
+                    self._compact(self.max_bytes // 2 - data.nbytes)
+                rec = _Record(self._size, len(data), data.shape[1], int(samplerate))
+                self._data.write(data.tobytes())
+                self._data.flush()
+                self._size += data.nbytes
+                self._records[key] = rec
+                self._append({"key": key, "off": rec.off, "frames": rec.frames,
+                              "ch": rec.ch, "sr": rec.sr})
+            if alias and self._aliases.get(alias) != key:
+                self.alias(alias, key)
+
+    def alias(self, alias: str, key: str) -> None:
+        """Let `alias` (e.g. a server asset id) name the record `key`."""
+        with self._lock:
+            self._aliases[alias] = key
+            self._append({"alias": alias, "key": key})
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._records), "aliases": len(self._aliases),
+                    "bytes": self._size, "max_bytes": self.max_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            for f in (self._data, self._index):
+                if f is not None:
+                    f.close()
+            self._data = self._index = None
+            self._mm = None
+
+    # --- files ------------------------------------------------------------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _data_name(self, gen: int) -> str:
+        return f"data-{gen}.bin"
+
+    def _load(self) -> None:
+        raw = ""
+        try:
+            with open(self._path(INDEX), "r", encoding="utf-8") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            pass
+        lines = raw.splitlines()
+        head = {}
+        try:
+            head = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            pass
+        if "data" not in head:
+            open(self._path(self._data_name(0)), "wb").close()  # fresh store
+            self._rewrite_index(0)
+            self._open_data(0)
+            self._remove_stale()
+            return
+        self._gen = int(head.get("gen", 0))
+        size = os.path.getsize(self._path(head["data"])) if os.path.exists(self._path(head["data"])) else 0
+        for line in lines[1:]:
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue  # torn last line
+            if "alias" in e:
+                self._aliases[e["alias"]] = e["key"]
+                continue
+            rec = _Record(int(e["off"]), int(e["frames"]), int(e["ch"]), int(e["sr"]))
+            if rec.off + rec.nbytes <= size:
+                self._records[e["key"]] = rec
+                self._size = max(self._size, rec.off + rec.nbytes)
+        self._aliases = {a: k for a, k in self._aliases.items() if k in self._records}
+        self._open_data(self._gen)
+        # drop a torn tail so appends line up with the index
+        if os.path.getsize(self._path(self._data_name(self._gen))) != self._size:
+            self._data.truncate(self._size)
+        self._index = open(self._path(INDEX), "a", encoding="utf-8")
+        if not raw.endswith("\n"):
+            self._index.write("\n")  # finish a torn line before appending
+        self._remove_stale()
+        _log.info("asset store: %d clips, %.1f MB", len(self._records), self._size / 2**20)
+
+    def _remove_stale(self) -> None:
+        """Data files of older generations (left behind if still mapped)."""
+        current = self._data_name(self._gen)
+        for name in os.listdir(self.directory):
+            if name.startswith("data-") and name.endswith(".bin") and name != current:
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+    def _open_data(self, gen: int) -> None:
+        if self._data is not None:
+            self._data.close()
+        self._data = open(self._path(self._data_name(gen)), "ab")
+        self._mm = None
+
+    def _rewrite_index(self, gen: int) -> None:
+        tmp = self._path(INDEX + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"data": self._data_name(gen), "gen": gen}) + "\n")
+            for key, rec in self._records.items():
+                f.write(json.dumps({"key": key, "off": rec.off, "frames": rec.frames,
+                                    "ch": rec.ch, "sr": rec.sr}) + "\n")
+            for alias, key in self._aliases.items():
+                f.write(json.dumps({"alias": alias, "key": key}) + "\n")
+        if self._index is not None:
+            self._index.close()
+        os.replace(tmp, self._path(INDEX))
+        self._index = open(self._path(INDEX), "a", encoding="utf-8")
+
+    def _append(self, entry: dict) -> None:
+        self._index.write(json.dumps(entry) + "\n")
+        self._index.flush()
+
+    def _map(self, end: int) -> mmap.mmap:
+        if self._mm is None or len(self._mm) < end:
+            # numpy views of the previous map keep it alive until released
+            with open(self._path(self._data_name(self._gen)), "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def _compact(self, target: int) -> None:
+        """Keep the most recently used records that fit in `target` bytes."""
+        keep = []
+        total = 0
+        for key, rec in reversed(self._records.items()):
+            if total + rec.nbytes > target:
+                break
+            keep.append((key, rec))
+            total += rec.nbytes
+        gen = self._gen + 1
+        old = self._path(self._data_name(self._gen))
+        try:
+            src = self._map(self._size) if self._size else None
+            records: "OrderedDict[str, _Record]" = OrderedDict()
+            off = 0
+            with open(self._path(self._data_name(gen)), "wb") as f:
+                for key, rec in reversed(keep):
+                    f.write(src[rec.off:rec.off + rec.nbytes])
+                    records[key] = _Record(off, rec.frames, rec.ch, rec.sr)
+                    off += rec.nbytes
+        except OSError as e:
+            _log.warning("asset store compaction failed: %s", e)
+            return
+        dropped = len(self._records) - len(records)
+        self._records = records
+        self._aliases = {a: k for a, k in self._aliases.items() if k in records}
+        self._size = off
+        self._gen = gen
+        self._rewrite_index(gen)
+        self._open_data(gen)
+        try:
+            os.remove(old)
+        except OSError:
+            pass  # still mapped (Windows); left for the next start
+        _log.info("asset store compacted: dropped %d clips, %.1f MB kept", dropped, off / 2**20)
+
+
+__all__ = ["AssetStore"]
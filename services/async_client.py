@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio flavour of AudioSocketClient, built on socketio.AsyncClient.
+
+Same constructor and handlers as the threaded client, but everything runs
+on one event loop: no worker thread per connection and no sleep loop.
+Base64/audio decoding is pushed to an executor so a large payload never
+blocks the loop, and shutdown is awaitable.
+
+Usage (headless):
+    import asyncio
+    from services.async_client import AsyncAudioSocketClient
+
+    async def main():
+        clients = [AsyncAudioSocketClient(base, routes, areas, token) for base in bases]
+        await asyncio.gather(*(c.connect() for c in clients))
+        await asyncio.gather(*(c.wait() for c in clients))
+
+    asyncio.run(main())
+
+Usage (next to the Qt loop):
+    cli = AsyncAudioSocketClient(...)
+    cli.start_background()   # own loop on one daemon thread
+    ...
+    cli.stop_background()    # awaits close() on that loop
+"""
+from __future__ import annotations
+
+import asyncio
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import socketio
+
+from services.client import AudioSocketClient
+from util.logs import get_logger
+
+_log = get_logger("client.async")
+
+
+class AsyncAudioSocketClient(AudioSocketClient):
+    DECODE_WORKERS = 2
+
+    def __init__(self, *args, **kwargs):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.DECODE_WORKERS, thread_name_prefix="audq-decode"
+        )
+        super().__init__(*args, **kwargs)
+
+    # --- construction hooks ----------------------------------------------
+    def _create_sio(self, verify_opt):
+        # aiohttp takes the CA bundle through an SSLContext on the session
+        opts = self._sio_options(True)
+        # websocket-client option; aiohttp's ws_connect has no such keyword
+        opts.pop("websocket_extra_options", None)
+        return socketio.AsyncClient(**opts)
+
+    def _setup_http(self, verify_opt):
+        # aiohttp sessions must be created inside the running loop; see connect().
+        # (The pooled requests session cannot be shared with aiohttp.)
+        self._verify_opt = verify_opt
+        self._ses = None
+
+    class CatchAllNS(socketio.AsyncClientNamespace):
+        def __init__(self, outer, namespace):
+            super().__init__(namespace)
+            self.outer = outer
+
+        async def trigger_event(self, event, *args):
+            self.outer.tracer.trace(event, args)
+            return await super().trigger_event(event, *args)
+
+    # --- handlers ---------------------------------------------------------
+    async def _on_connect(self):
+        self._note_connected()
+        self.log_func(f"[OK] socket 已連接: {self.sio.sid}")
+        self.subs.resubscribe(self._channels())
+        self._notify_state(True)
+
+    # SubscriptionManager hooks: called on the loop, emits are queued as tasks
+    def _emit_nowait(self, event, data, callback):
+        asyncio.ensure_future(self.sio.emit(event, data, callback=callback))
+
+    def _call_later(self, seconds, func):
+        asyncio.get_running_loop().call_later(seconds, func)
+
+    async def _on_play_audio_generic(self, arg0=None, arg1=None):
+        # Routing is one dict lookup, but base64 + enqueue can be megabytes
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._executor, AudioSocketClient._on_play_audio_generic, self, arg0, arg1
+        )
+
+    # --- lifecycle --------------------------------------------------------
+    async def connect(self):
+        if self._ses is None or self._ses.closed:
+            import aiohttp
+
+            ctx = ssl.create_default_context(
+                cafile=self._verify_opt if isinstance(self._verify_opt, str) else None
+            )
+            self._ses = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ctx))
+            self.sio.eio.http = self._ses
+        self._begin_connect()
+        try:
+            await self._sio_connect()
+        except socketio.exceptions.ConnectionError as e:
+            if not self._should_relogin(e):
+                raise
+            self.log_func(f"連線遭拒（{e}），重新登入後重試")
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.login.get_token(refresh=True))
+            await self._sio_connect()
+        finally:
+            self._connecting = False
+        stats = self._finish_connect()
+        self._start_keepalive()
+        return stats
+
+    async def _sio_connect(self):
+        await self.sio.connect(
+            self.app_base,
+            headers=self.AUTH_HEADERS,
+            transports=self.transports,
+            socketio_path="/socket.io",
+            wait_timeout=self.connect_timeout,
+        )
+
+    def _start_keepalive(self):
+        if self.ping_interval > 0 and self._keepalive_task is None:
+            self._keepalive_task = asyncio.ensure_future(self._keepalive())
+
+    async def _keepalive(self):
+        try:
+            while not self._closing:
+                await self.sio.sleep(self.ping_interval)
+                if self._closing:
+                    break
+                if self.sio.connected:
+                    try:
+                        await self.sio.emit("client:ping", {"ts": time.time()})
+                    except Exception as e:
+                        _log.debug("keepalive emit failed: %s", e)
+        finally:
+            self._keepalive_task = None
+
+    async def wait(self):
+        """Resolve when the connection is closed for good (replaces run_forever)."""
+        await self.sio.wait()
+
+    async def close(self):
+        """Disconnect, release the HTTP session and the decode executor."""
+        self._closing = True
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+        try:
+            await self.sio.disconnect()
+        finally:
+            if self._ses is not None and not self._ses.closed:
+                await self._ses.close()
+            self._executor.shutdown(wait=False)
+
+    def run(self):
+        """Blocking headless entry point: connect and serve until closed."""
+        async def _main():
+            await self.connect()
+            try:
+                await self.wait()
+            finally:
+                await self.close()
+
+        try:
+            asyncio.run(_main())
+        except KeyboardInterrupt:
+            pass
+
+    # --- Qt / foreign-loop integration -----------------------------------
+    def start_background(self):
+        """Run connect()+wait() on a private loop in one daemon thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._loop = asyncio.new_event_loop()
+
+        def _runner():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self.connect())
+                self._loop.run_until_complete(self.wait())
+            except Exception as e:
+                self.log_func(f"連線失敗: {e}")
+            finally:
+                self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+                self._loop.close()
+
+        self._thread = threading.Thread(target=_runner, name="audq-asyncio", daemon=True)
+        self._thread.start()
+
+    def stop_background(self, timeout: float = 5.0):
+        if self._loop is None or not self._loop.is_running():
+            return
+        fut = asyncio.run_coroutine_threadsafe(self.close(), self._loop)
+        try:
+            fut.result(timeout=timeout)
+        except Exception as e:
+            _log.warning("async client shutdown: %s", e)
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def disconnect(self):
+        self.stop_background()
+
+
+__all__ = ["AsyncAudioSocketClient"]
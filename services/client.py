@@ -1,28 +1,95 @@
 import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 from util.common import resource_path
-import socketio, ssl, websocket, requests, json, time
+from util.logs import get_logger
+import socketio, ssl, websocket, json, time
 import base64
 from http.cookies import SimpleCookie
-from services.Audio import get_player
+from services import metrics
+from services.Audio import AudioQueuePlayer, get_player
+from services.http_session import get_session
+from services.login import LoginError
+from services.reassembly import Reassembler
+from services.routing import RoutingTable
+from services.subscriptions import SubscriptionManager
+from services.tracing import EventTracer
 import random
 import string
 
+_log = get_logger("client")
+
 class AudioSocketClient:
     MAX_LOG = 2000  # bytes/characters
     CLIENT_PING_SEC = 20  # 客戶端自送 keepalive，避免中間層(如 Nginx) 60s idle 斷線
     PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
 
-    def __init__(self, app_base, channel, area, token, gap_sec=1.0,log_func=None, cafile=None, ):
+    def __init__(self, app_base, channel, area, token, gap_sec=1.0,log_func=None, cafile=None, streaming=True, trace_events=False,
+                 transports=None, ping_interval=CLIENT_PING_SEC, ws_trace=False, connect_timeout=5,
+                 default_priority=AudioQueuePlayer.DEFAULT_PRIORITY,
+                 preempt_priority=AudioQueuePlayer.PREEMPT_PRIORITY, chunk_timeout=30.0,
+                 login=None, session=None, batch_subscribe=False, reconnection_delay=1,
+                 reconnection_delay_max=5, randomization_factor=0.5,
+                 asset_url="{app_base}/assets/{id}", event_filter=None, on_state=None,
+                 reassembler=None, ):
         self.app_base = app_base
         self.channel = channel
         self.areaList = area
         self.token = token
-        self.log_func = log_func
+        # Optional LoginClient: new tokens are pushed into the auth headers, and
+        # a connect rejected for auth logs in again (see _retry_auth)
+        self.login = login
+        self._session = session if session is not None else (login.session if login else None)
+        # User-facing status lines; defaults to the shared logger
+        self.log_func = log_func or _log.info
         self.gap_sec = gap_sec
+        # Chunked messages play gaplessly through the device's persistent stream
+        self.streaming = streaming
+        # Engine.IO transports: None = polling then upgrade, ("websocket",) skips
+        # the polling handshake round trips entirely
+        self.transports = list(transports) if transports else None
+        self.ping_interval = float(ping_interval or 0)  # 0 disables the app-level keepalive
+        self.connect_timeout = connect_timeout
+        # Reconnect backoff: delay doubles up to the max, each one randomized by
+        # +/- randomization_factor so a fleet does not reconnect in lockstep
+        self.reconnection_delay = reconnection_delay
+        self.reconnection_delay_max = reconnection_delay_max
+        self.randomization_factor = randomization_factor
+        self.connect_stats = {}
+        self.last_rtt = None
+        self.last_seen = None  # time.monotonic() of the last event/pong from the server
+        # Multi-endpoint hooks (services.multi): event_filter(client, channel,
+        # payload) -> False drops a PlayAudioEvent; on_state(client, connected)
+        self.event_filter = event_filter
+        self.on_state = on_state
+        self._closing = False
+        self._keepalive_task = None
+        self._t_connect_start = None
+        self._t_handshake = None
+        self._t_disconnected = None
+        self._connecting = False
+        self._connect_error = None  # last connect_error payload (namespace rejection)
+        # Opt-in event tracing; when off, handlers are registered unwrapped
+        self.tracer = EventTracer(_log, logging.INFO) if trace_events else None
         # If a cafile path is provided, resolve it; otherwise use system trust store (verify=True)
         self.cafile = resource_path(cafile) if cafile else None
 
-        self.player = get_player(gap_sec=self.gap_sec)
+        # Payload "priority" orders each device queue; >= preempt_priority cuts in
+        self.player = get_player(gap_sec=self.gap_sec, default_priority=default_priority,
+                                 preempt_priority=preempt_priority)
+        # Messages sent one chunk per event ({"message_id", "seq", "total"});
+        # partial ones are dropped after chunk_timeout seconds without a chunk.
+        # Clients fed the same messages (services.multi) share one reassembler
+        self.reassembler = reassembler or Reassembler(timeout=chunk_timeout)
+        # Events may name an "asset_id" instead of carrying audio: played from
+        # the player's asset store, else fetched once from asset_url
+        self.asset_url = asset_url
+        self._asset_fetches = {}
+        self._fetch_lock = threading.Lock()
+        self._fetch_pool = None
 
         self.AUTH_HEADERS = {
             "Authorization": f"Bearer {self.token}",
@@ -30,41 +97,122 @@ class AudioSocketClient:
             "Accept": "application/json",
         }
         verify_opt = self.cafile if self.cafile else True
+        if login is not None:
+            login.add_listener(self.set_token)
+
+        self.sio = self._create_sio(verify_opt)
+        # batch_subscribe: False = one subscribe per area (pipelined), True = one
+        # batched request, None = probe for batching once (waits for its ack)
+        self.subs = SubscriptionManager(self._emit_nowait, self._call_later, self._auth_payload,
+                                        batch=batch_subscribe, log_func=self.log_func,
+                                        on_complete=self._note_subscribed)
+
+        # Register events; the catch-all namespace only exists to trace
+        # events nobody handles, so it is skipped when tracing is off
+        if self.tracer is not None:
+            self.sio.register_namespace(self._create_namespace())
+
+        self._on("PlayAudioEvent", self._on_play_audio_generic)
+        self._on("reconnect_attempt", self._on_reconnect_attempt)
+        self._on("reconnect", self._on_reconnect)
+        self._on("reconnect_error", self._on_reconnect_error)
+        self._on("error", self._on_error)
+        self._on("server:pong", self._on_server_pong)
+
+        self._on("connect", self._on_connect)
+        self._on("connect_error", self._on_connect_error)
+        self._on("disconnect", self._on_disconnect)
+
+        self._hook_handshake()
+        self._setup_http(verify_opt)
+
+        # Optional: websocket-client frame trace to debug TLS/handshake errors
+        if ws_trace:
+            try:
+                websocket.enableTrace(True)
+            except Exception:
+                pass
 
-        self.sio = socketio.Client(
+    def _sio_options(self, verify_opt):
+        return dict(
             logger=False,
             engineio_logger=False,  # 暫時開啟，抓到真實錯誤位置（握手/升級/timeout）
             reconnection=True,
             reconnection_attempts=0,       # 無限次
-            reconnection_delay=1,          # 1s 起跳
-            reconnection_delay_max=5,      # 最長 5s
+            reconnection_delay=self.reconnection_delay,          # 1s 起跳
+            reconnection_delay_max=self.reconnection_delay_max,  # 最長 5s
+            randomization_factor=self.randomization_factor,      # ±50% jitter
             ssl_verify=verify_opt,
+            # Text frames are JSON that gets parsed anyway; websocket-client's
+            # pure-Python UTF-8 check on every frame costs more CPU than the
+            # rest of the receive path (binary attachments skip it already)
+            websocket_extra_options={"skip_utf8_validation": True},
         )
 
-        # Register namespace and events
-        self.sio.register_namespace(self.CatchAllNS(self, '/'))
+    def _create_sio(self, verify_opt):
+        return socketio.Client(**self._sio_options(verify_opt))
+
+    def _on(self, event, handler):
+        if self.tracer is not None:
+            handler = self.tracer.wrap(event, handler)
+        self.sio.on(event, handler=handler)
+
+    def _hook_handshake(self):
+        # Engine.IO fires its own "connect" once the transport handshake is
+        # done (before the Socket.IO namespace connects); timestamp it.
+        eio_connect = self.sio.eio.handlers.get("connect")
+        if eio_connect is None:
+            return
+        if asyncio.iscoroutinefunction(eio_connect):
+            async def _on_eio_open(*args):
+                self._t_handshake = time.perf_counter()
+                return await eio_connect(*args)
+        else:
+            def _on_eio_open(*args):
+                self._t_handshake = time.perf_counter()
+                return eio_connect(*args)
+        self.sio.eio.handlers["connect"] = _on_eio_open
+
+    def _create_namespace(self):
+        return self.CatchAllNS(self, '/')
+
+    def _setup_http(self, verify_opt):
+        # Trust our self-signed/CA for HTTP polling requests used by Engine.IO.
+        # The pooled session is shared with LoginClient, so polling reuses the
+        # kept-alive login connection instead of a second TLS handshake. It is
+        # pooled per verify setting and never changed here: other clients use
+        # it too (a session passed in keeps its own verify).
+        self._ses = self._session or get_session(verify_opt)
+        self.sio.eio.http = self._ses
 
-        self.sio.on("PlayAudioEvent", handler=self._on_play_audio_generic)
-        self.sio.on("reconnect_attempt", handler=self._on_reconnect_attempt)
-        self.sio.on("reconnect", handler=self._on_reconnect)
-        self.sio.on("reconnect_error", handler=self._on_reconnect_error)
-        self.sio.on("error", handler=self._on_error)
-        self.sio.on("server:pong", handler=self._on_server_pong)
+    def set_token(self, token):
+        """Use `token` from now on, including for automatic reconnects.
 
-        self.sio.on("connect", handler=self._on_connect)
-        self.sio.on("connect_error", handler=self._on_connect_error)
-        self.sio.on("disconnect", handler=self._on_disconnect)
+        AUTH_HEADERS is updated in place: python-socketio reconnects with the
+        same dict it was given at connect().
+        """
+        self.token = token
+        self.AUTH_HEADERS["Authorization"] = f"Bearer {token}"
 
-        # Trust our self-signed/CA for HTTP polling requests used by Engine.IO
-        self._ses = requests.Session()
-        self._ses.verify = verify_opt  # True uses system trust; or a path when provided
-        self.sio.eio.http = self._ses
+    AUTH_ERRORS = ("401", "403", "unauthorized", "unauthenticated", "forbidden")
 
-        # Optional: turn on websocket-client trace to see TLS/handshake errors
-        try:
-            websocket.enableTrace(True)
-        except Exception:
-            pass
+    @classmethod
+    def _is_auth_error(cls, err):
+        text = " ".join(str(a) for a in getattr(err, "args", (err,))).lower()
+        return any(s in text for s in cls.AUTH_ERRORS)
+
+    def _should_relogin(self, err):
+        """Whether a failed connect is worth one fresh login and retry.
+
+        A namespace rejection only shows its reason in the connect_error
+        event; a websocket-only handshake hides the HTTP status ("Connection error"),
+        so a token restored from the store is also retried on that.
+        """
+        if self.login is None:
+            return False
+        if self._is_auth_error(err) or self._is_auth_error(self._connect_error):
+            return True
+        return self.login.from_cache and "connection error" in str(err).lower()
 
     def _fmt(self, obj, key=None, limit=MAX_LOG):
         try:
@@ -101,22 +249,52 @@ class AudioSocketClient:
         except Exception as e:
             return f"<fmt_err {e}>"
 
+    def _channels(self):
+        return [f"private-audio.{area['code']}" for area in self.areaList]
+
+    def _auth_payload(self):
+        return {
+            "headers": {
+                # 只需要這幾個就夠了；視你的後端中介層而定
+                "Authorization": self.AUTH_HEADERS.get("Authorization"),
+                "Accept": "application/json",
+                "X-Requested-With": "XMLHttpRequest",
+            }
+        }
+
+    # SubscriptionManager I/O hooks (the asyncio client overrides them)
+    def _emit_nowait(self, event, data, callback):
+        self.sio.emit(event, data, callback=callback)
+
+    def _call_later(self, seconds, func):
+        t = threading.Timer(seconds, func)
+        t.daemon = True
+        t.start()
+
+    def _note_connected(self):
+        if self._t_disconnected is not None:
+            metrics.RECONNECTS.inc()
+            self.connect_stats["reconnect_sec"] = time.perf_counter() - self._t_disconnected
+            self._t_disconnected = None
+            _log.info("[OK] reconnected in %.3fs via %s",
+                      self.connect_stats["reconnect_sec"], self.sio.transport())
+
+    def _note_subscribed(self, seconds):
+        self.connect_stats["subscribed_sec"] = seconds
+
     def _on_connect(self):
+        self._note_connected()
         self.log_func(f"[OK] socket 已連接: {self.sio.sid}")
-        for area in self.areaList:
-            sub_payload = {
-                "channel": f"private-audio.{area['code']}",
-                "auth": {
-                    "headers": {
-                        # 只需要這幾個就夠了；視你的後端中介層而定
-                        "Authorization": self.AUTH_HEADERS.get("Authorization"),
-                        "Accept": "application/json",
-                        "X-Requested-With": "XMLHttpRequest",
-                    }
-                }
-            }
-            self.sio.emit("subscribe", sub_payload)
-            self.log_func(f"[OK] 已訂閱: {area['name']}")
+        self.subs.resubscribe(self._channels())
+        self._notify_state(True)
+
+    def _notify_state(self, connected):
+        self.last_seen = time.monotonic() if connected else self.last_seen
+        if self.on_state is not None:
+            try:
+                self.on_state(self, connected)
+            except Exception as e:
+                _log.warning("on_state callback failed: %s", e)
 
     class CatchAllNS(socketio.ClientNamespace):
         def __init__(self, outer, namespace):
@@ -124,29 +302,78 @@ class AudioSocketClient:
             self.outer = outer
 
         def trigger_event(self, event, *args):
-            try:
-                head = args[0] if args else None
-                print(f"[*] event={event} data={self.outer._fmt(head)}")
-            except Exception:
-                print(f"[*] event={event} (no data)")
+            self.outer.tracer.trace(event, args)
             return super().trigger_event(event, *args)
 
     def _on_play_audio_generic(self, arg0=None, arg1=None):
+        received_at = time.perf_counter()
         chan = arg0 if isinstance(arg0, str) else None
         payload = arg1 if isinstance(arg1, dict) else (arg0 if isinstance(arg0, dict) else {})
+        metrics.EVENTS_RECEIVED.inc(event="PlayAudioEvent")
+        metrics.BYTES_RECEIVED.inc(self._audio_bytes(payload))
+        self.last_seen = time.monotonic()
+        if self.event_filter is not None and not self.event_filter(self, chan, payload):
+            return
 
-        channelMap = self.channel.get_channel_map()
+        devices = self._routes().devices_for(chan)
         self.log_func(f"收到廣播 區域：{chan}")
-        self.log_func(f"裝置頻道 map：{channelMap}")
-        channelName = next((k for k, v in channelMap.items() if v == chan), None)
-        device = next((k for k, v in channelMap.items() if v == chan), None)
-        if device is None:
+        if not devices:
             return  # ignore other channels
-        self.log_func(f"配對裝置：{device}")
-
-        self._handle_audio(payload, device)
-
-    def _handle_audio(self, msg, device):
+        if self._reassemble(payload, devices, received_at):
+            return
+        self.log_func(f"配對裝置：{list(devices)}")
+        self._handle_audio(payload, devices, received_at)
+
+    def _reassemble(self, payload, devices, received_at):
+        """File one chunk of a multi-event message; False if `payload` is not one.
+
+        The first chunk seen (whatever its seq) queues a live stream on every
+        device, which starts as soon as chunk 0 is there; later chunks only
+        fill in the message. Always streamed, regardless of `streaming`.
+        """
+        msg = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+        if msg.get("message_id") is None or msg.get("seq") is None:
+            return False
+        try:
+            message, is_new = self.reassembler.add(
+                msg["message_id"], msg["seq"], msg.get("total"),
+                msg.get("audio") or msg.get("base64"), bool(msg.get("last")))
+        except (TypeError, ValueError) as e:
+            _log.warning("[handler-error broadcasting:chunk] %s", e)
+            return True
+        if not is_new:
+            return True
+        self.log_func(f"分段廣播 {message.msg_id} 配對裝置：{list(devices)}")
+        fmt = msg.get("format") or msg.get("mime")
+        sched = dict(received_at=received_at, **self.player.schedule_fields(payload))
+        for device in devices:
+            try:
+                self.player.enqueue_stream(message.reader(), device, fmt, **sched)
+            except Exception as e:
+                _log.warning("[handler-error broadcasting:message] %s", e)
+        return True
+
+    @staticmethod
+    def _audio_bytes(payload):
+        msg = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+        a = msg.get("audio") or msg.get("base64")
+        if isinstance(a, dict):
+            a = a.values()
+        if isinstance(a, (str, bytes, bytearray, memoryview)):
+            return len(a)
+        try:
+            return sum(len(c) for c in a if isinstance(c, (str, bytes, bytearray, memoryview)))
+        except TypeError:
+            return 0
+
+    def _routes(self):
+        # `channel` is either a RoutingTable or an owner exposing routes() (the UI manager)
+        ch = self.channel
+        return ch if isinstance(ch, RoutingTable) else ch.routes()
+
+    def _handle_audio(self, msg, devices, received_at=None):
+        """Queue one broadcast on every device it is routed to (audio decoded once)."""
+        sched = dict(received_at=received_at, **self.player.schedule_fields(msg))
         if isinstance(msg, dict) and "data" in msg and isinstance(msg["data"], dict):
             msg = msg["data"]
         try:
@@ -163,66 +390,196 @@ class AudioSocketClient:
                 elif isinstance(a, (list, tuple)):
                     chunks = list(a)
 
+            if chunks and self.streaming:
+                for device in devices:
+                    self.player.enqueue_stream(chunks, device, fmt, **sched)
+                return
             if chunks:
-                for b64 in chunks:
-                    if isinstance(b64, (bytes, bytearray)):
-                        b64 = b64.decode('utf-8', 'ignore')
-                    if isinstance(b64, str) and b64:
-                        print(f"45: {device}")
-                        self.player.enqueue_base64(b64, device,fmt)
+                for c in chunks:
+                    _log.debug("chunk -> devices %s", list(devices))
+                    self._enqueue_one(c, devices, fmt, sched)
                 return
 
-            b64 = (msg or {}).get('audio') or (msg or {}).get('base64')
-            if isinstance(b64, (bytes, bytearray)):
-                b64 = b64.decode('utf-8', 'ignore')
-            if isinstance(b64, str) and b64:
-                self.player.enqueue_base64(b64, device, fmt)
+            audio = (msg or {}).get('audio') or (msg or {}).get('base64')
+            asset_id = (msg or {}).get('asset_id')
+            if asset_id is not None and not audio:
+                self._play_asset(str(asset_id), devices, fmt, sched)
+                return
+            self._enqueue_one(audio, devices, fmt, sched,
+                              None if asset_id is None else str(asset_id))
         except Exception as e:
-            print("[handler-error broadcasting:message]", e)
+            _log.warning("[handler-error broadcasting:message] %s", e)
+
+    def _enqueue_one(self, audio, devices, fmt, sched, asset_id=None):
+        # str = base64, bytes = Socket.IO binary attachment (no str round trip);
+        # either way decoded and hashed once for all devices
+        if isinstance(audio, (str, bytes, bytearray, memoryview)) and audio:
+            self.player.enqueue_many(audio, devices, fmt, asset_id=asset_id, **sched)
+
+    # --- assets -----------------------------------------------------------
+    def _play_asset(self, asset_id, devices, fmt, sched):
+        devices = [d for d in devices if not self.player.enqueue_asset(asset_id, d, **sched)]
+        if not devices:
+            return
+
+        def _fetched(fut):
+            try:
+                audio, mime = fut.result()
+            except Exception as e:
+                _log.warning("音檔 %s 下載失敗：%s", asset_id, e)
+                return
+            self._enqueue_one(audio, devices, fmt or mime, sched, asset_id)
+
+        self._fetch_asset(asset_id).add_done_callback(_fetched)
+
+    def _fetch_asset(self, asset_id):
+        """Future of (audio, mime); one download per asset id at a time."""
+        with self._fetch_lock:
+            fut = self._asset_fetches.get(asset_id)
+            if fut is None:
+                if self._fetch_pool is None:
+                    self._fetch_pool = ThreadPoolExecutor(2, thread_name_prefix="asset-fetch")
+                fut = self._fetch_pool.submit(self._download_asset, asset_id)
+                self._asset_fetches[asset_id] = fut
+                fut.add_done_callback(lambda _f: self._asset_fetches.pop(asset_id, None))
+            return fut
+
+    def _download_asset(self, asset_id):
+        # over the shared requests session (the asyncio client's aiohttp one
+        # belongs to its event loop)
+        ses = self._session or get_session(self.cafile or True)
+        url = self.asset_url.format(app_base=self.app_base.rstrip("/"), id=quote(asset_id, safe=""))
+        self.log_func(f"下載音檔：{asset_id}")
+        r = ses.get(url, headers=self.AUTH_HEADERS, timeout=30)
+        if r.status_code == 401 and self.login is not None:
+            self.login.get_token(refresh=True)
+            r = ses.get(url, headers=self.AUTH_HEADERS, timeout=30)
+        r.raise_for_status()
+        metrics.BYTES_RECEIVED.inc(len(r.content))
+        mime = r.headers.get("Content-Type", "")
+        if "json" in mime:
+            data = r.json()
+            data = data.get("data") if isinstance(data.get("data"), dict) else data
+            return data.get("audio") or data.get("base64"), data.get("format") or data.get("mime")
+        return r.content, mime.split(";")[0] or None
 
     def _on_connect_error(self, data):
-        print("[!] connect_error:", self._fmt(data))
+        _log.warning("[!] connect_error: %s", self._fmt(data))
+        self._connect_error = data
+        # Rejected while reconnecting on its own: get a new token for the next
+        # attempt (a rejected connect() retries itself, see _should_relogin)
+        if self.login is not None and not self._connecting and self._is_auth_error(data):
+            self.login.request_refresh()
 
     def _on_reconnect_attempt(self, attempt):
-        print(f"[~] reconnect_attempt #{attempt}")
+        _log.info("[~] reconnect_attempt #%s", attempt)
 
     def _on_reconnect(self, attempt):
-        print(f"[OK] reconnected after #{attempt}")
+        _log.info("[OK] reconnected after #%s", attempt)
 
     def _on_reconnect_error(self, err):
-        print("[!] reconnect_error:", self._fmt(err))
+        _log.warning("[!] reconnect_error: %s", self._fmt(err))
 
     def _on_error(self, err):
-        print("[!] error:", self._fmt(err))
+        _log.warning("[!] error: %s", self._fmt(err))
 
     def _on_disconnect(self):
-        print("[X] disconnected")
+        if not self._closing:
+            self._t_disconnected = time.perf_counter()
+        _log.info("[X] disconnected")
+        self._notify_state(False)
 
     def _on_server_pong(self, msg):
-        print("[server:pong]", self._fmt(msg))
+        self.last_seen = time.monotonic()
+        if isinstance(msg, dict) and isinstance(msg.get("ts"), (int, float)):
+            self.last_rtt = time.time() - msg["ts"]
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("[server:pong] %s rtt=%s", self._fmt(msg), self.last_rtt)
 
     def connect(self):
+        """Connect and return the measured timings (seconds).
+
+        {"transport": "websocket", "handshake_sec": ..., "connect_sec": ...}
+        handshake_sec is the Engine.IO open, connect_sec includes the
+        Socket.IO namespace connect. Also kept in `self.connect_stats`.
+        """
+        self._begin_connect()
         try:
-            print("Attempting Socket.IO connect via HTTPS (/socket.io)")
-            self.sio.connect(
-                self.app_base,
-                headers=self.AUTH_HEADERS,
-                socketio_path="/socket.io",
-            )
-        except Exception as e1:
-            print("[connect] retry with trailing slash:", e1)
-            self.sio.connect(
-                self.app_base,
-                headers=self.AUTH_HEADERS,
-                socketio_path="/socket.io/",
-            )
+            self._sio_connect()
+        except socketio.exceptions.ConnectionError as e:
+            if not self._should_relogin(e):
+                raise
+            self.log_func(f"連線遭拒（{e}），重新登入後重試")
+            try:
+                self.login.get_token(refresh=True)  # set_token() via the listener
+            except LoginError:
+                raise
+            except Exception:
+                raise e from None  # /login unreachable as well: the server is down
+            self._sio_connect()
+        finally:
+            self._connecting = False
+        stats = self._finish_connect()
+        self._start_keepalive()
+        return stats
+
+    def _sio_connect(self):
+        self.sio.connect(
+            self.app_base,
+            headers=self.AUTH_HEADERS,
+            transports=self.transports,
+            socketio_path="/socket.io",
+            wait_timeout=self.connect_timeout,
+        )
+
+    def disconnect(self):
+        self._closing = True
+        self.sio.disconnect()
+
+    def _begin_connect(self):
+        self._closing = False
+        self._connecting = True
+        self._connect_error = None
+        self._t_handshake = None
+        self._t_connect_start = time.perf_counter()
+        _log.info("Attempting Socket.IO connect to %s (transports=%s)",
+                  self.app_base, ",".join(self.transports or ["polling", "websocket"]))
+
+    def _finish_connect(self):
+        t0 = self._t_connect_start
+        self.connect_stats.update(
+            transport=self.sio.transport(),
+            handshake_sec=(self._t_handshake - t0) if self._t_handshake else None,
+            connect_sec=time.perf_counter() - t0,
+        )
+        _log.info("[OK] connected via %s in %.3fs", self.connect_stats["transport"],
+                  self.connect_stats["connect_sec"])
+        return dict(self.connect_stats)
+
+    def _start_keepalive(self):
+        # 客戶端自送 keepalive: keeps idle proxies (e.g. Nginx 60s) from
+        # dropping the socket; the server echoes "ts" back in server:pong
+        if self.ping_interval > 0 and self._keepalive_task is None:
+            self._keepalive_task = self.sio.start_background_task(self._keepalive)
+
+    def _keepalive(self):
+        while not self._closing:
+            self.sio.sleep(self.ping_interval)
+            if self._closing:
+                break
+            if self.sio.connected:
+                try:
+                    self.sio.emit("client:ping", {"ts": time.time()})
+                except Exception as e:
+                    _log.debug("keepalive emit failed: %s", e)
+        self._keepalive_task = None
 
     def run_forever(self):
         try:
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
-            self.sio.disconnect()
+            self.disconnect()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Audio output in a separate process, fed through shared-memory PCM rings.
+
+With an `AudioEngine` the player keeps queueing, decoding and gap timing
+where they are, but each device's ring buffer lives in a
+multiprocessing.shared_memory segment and the PortAudio streams (and their
+callbacks) run in a spawned engine process. A GUI stall, a large JSON
+payload or decode work in this interpreter then no longer competes for the
+GIL with the audio callback, and whatever is already in a ring (up to
+`buffer_sec` per device) keeps playing while this process is busy or hung.
+
+The control channel is a multiprocessing Pipe carrying small tuples
+("open", "close", "ping", "stop"); PCM never goes through it. Ring read
+and write positions live in the segment itself, so the engine can be
+restarted on its own: a watchdog respawns it when it exits (or stops
+answering) and reopens every stream on the same segments, continuing from
+the frame it had reached. The engine exits when this process goes away.
+
+Usage:
+    from services.engine import AudioEngine
+
+    engine = AudioEngine(buffer_sec=10.0).start()
+    player = get_player(engine=engine)     # device streams now play in the engine
+    engine.stats()   # {"pid": 4242, "alive": True, "restarts": 0, "outputs": 2}
+    engine.restart() # e.g. after changing the audio setup
+    engine.stop()
+"""
+from __future__ import annotations
+
+import itertools
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+from services import metrics
+from util.logs import get_logger
+
+_log = get_logger("engine")
+
+# int64 header slots: the producer owns W and SKIP, the consumer R (own cache line)
+_W, _SKIP, _R = 0, 1, 8
+_HEADER_BYTES = 128
+POLL_SEC = 0.005  # producer wait while the ring is full (no cross-process Event)
+
+
+class EngineError(Exception):
+    pass
+
+
+class SharedPCMRing:
+    """float32 SPSC ring in shared memory; same interface as Audio._PCMRing.
+
+    Frame counters only grow and each has one writer, so neither side
+    takes a lock. The producer stores the samples before advancing W.
+    """
+
+    def __init__(self, frames: int, channels: int, name: Optional[str] = None):
+        self.size = int(frames)
+        self.channels = int(channels)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=self.owner, size=_HEADER_BYTES + self.size * self.channels * 4)
+        self._hdr = np.ndarray((_HEADER_BYTES // 8,), dtype=np.int64, buffer=self.shm.buf)
+        self.buf = np.ndarray((self.size, self.channels), dtype=np.float32,
+                              buffer=self.shm.buf, offset=_HEADER_BYTES)
+        if self.owner:
+            self._hdr[:] = 0
+        self.closed = False
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def _w(self) -> int:
+        return int(self._hdr[_W])
+
+    @property
+    def _r(self) -> int:
+        return int(self._hdr[_R])
+
+    def available(self) -> int:
+        return self._w - self._r
+
+    def write(self, data: np.ndarray, stop) -> bool:
+        """Copy `data` in, blocking while the ring is full. False if stopped."""
+        return self._put(data, len(data), stop)
+
+    def write_silence(self, frames: int, stop) -> bool:
+        return self._put(None, frames, stop)
+
+    def _put(self, data: Optional[np.ndarray], n: int, stop) -> bool:
+        off = 0
+        w = self._w
+        while off < n:
+            if self.closed:
+                return False
+            free = self.size - (w - self._r)
+            if free <= 0:
+                if stop.is_set():
+                    return False
+                time.sleep(POLL_SEC)
+                continue
+            k = min(free, n - off)
+            pos = w % self.size
+            first = min(k, self.size - pos)
+            if data is None:
+                self.buf[pos:pos + first] = 0
+                self.buf[:k - first] = 0
+            else:
+                self.buf[pos:pos + first] = data[off:off + first]
+                if k > first:
+                    self.buf[:k - first] = data[off + first:off + k]
+            w += k
+            self._hdr[_W] = w
+            off += k
+        return True
+
+    def flush(self) -> None:
+        """Producer side: drop everything written but not yet played."""
+        self._hdr[_SKIP] = self._hdr[_W]
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Consumer side (engine callback): fill `out`, zero-padding on underrun."""
+        hdr = self._hdr
+        r = max(int(hdr[_R]), int(hdr[_SKIP]))
+        k = min(len(out), int(hdr[_W]) - r)
+        pos = r % self.size
+        first = min(k, self.size - pos)
+        out[:first] = self.buf[pos:pos + first]
+        if k > first:
+            out[first:k] = self.buf[:k - first]
+        out[k:] = 0
+        hdr[_R] = r + k
+        return k
+
+    def drain(self, stop) -> None:
+        while not self.closed and self.available() > 0 and not stop.is_set():
+            time.sleep(POLL_SEC)
+
+    def close(self) -> None:
+        self.closed = True
+        self._hdr = self.buf = None  # numpy views must go before the mapping
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# --- engine process ---------------------------------------------------------
+def _engine_main(conn, init: Optional[Callable[[], None]]) -> None:
+    if init is not None:
+        init()  # e.g. a test sink; must run before sounddevice is imported
+    import sounddevice as sd
+
+    outputs: Dict[int, tuple] = {}
+
+    def _close(oid):
+        ring, stream = outputs.pop(oid)
+        try:
+            stream.stop()
+            stream.close()
+        except Exception:
+            pass
+        ring.close()
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break  # parent gone
+        op = msg[0]
+        try:
+            if op == "open":
+                _, oid, device, samplerate, channels, name, frames = msg
+                ring = SharedPCMRing(frames, channels, name=name)
+                stream = sd.OutputStream(
+                    device=device, samplerate=samplerate, channels=channels, dtype="float32",
+                    callback=lambda outdata, n, t, status, ring=ring: ring.read_into(outdata))
+                stream.start()
+                outputs[oid] = (ring, stream)
+                conn.send(("ok", None))
+            elif op == "close":
+                if msg[1] in outputs:
+                    _close(msg[1])
+                conn.send(("ok", None))
+            elif op == "ping":
+                conn.send(("ok", {oid: ring.available() for oid, (ring, _) in outputs.items()}))
+            elif op == "stop":
+                conn.send(("ok", None))
+                break
+            else:
+                conn.send(("error", f"unknown command {op!r}"))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    for oid in list(outputs):
+        _close(oid)
+
+
+# --- parent side ------------------------------------------------------------
+class EngineOutput:
+    """Stands in for Audio._StreamOutput: the stream plays in the engine."""
+
+    def __init__(self, engine: "AudioEngine", oid: int, device: Any,
+                 samplerate: int, channels: int, ring: SharedPCMRing):
+        self.engine = engine
+        self.oid = oid
+        self.device = device
+        self.samplerate = int(samplerate)
+        self.channels = int(channels)
+        self.ring = ring
+
+    def matches(self, samplerate: int, channels: int) -> bool:
+        return self.samplerate == int(samplerate) and self.channels == int(channels)
+
+    def close(self) -> None:
+        self.engine._close_output(self)
+
+
+class AudioEngine:
+    BUFFER_SEC = 10.0    # per-device ring; how long playback outlives a stall here
+    CALL_TIMEOUT = 5.0   # an engine that does not answer a command is restarted
+    WATCH_SEC = 0.5
+
+    def __init__(self, buffer_sec: float = BUFFER_SEC, init: Optional[Callable[[], None]] = None,
+                 log_func: Optional[Callable[[str], None]] = None):
+        self.buffer_sec = float(buffer_sec)
+        self.init = init  # picklable callable run first in the engine process
+        self.log_func = log_func or _log.info
+        self.restarts = 0
+        self._ctx = mp.get_context("spawn")  # no forked copies of our threads or Qt state
+        self._proc = None
+        self._conn = None
+        self._lock = threading.RLock()
+        self._outputs: Dict[int, EngineOutput] = {}
+        self._ids = itertools.count(1)
+        self._closing = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    # --- lifecycle --------------------------------------------------------
+    def start(self) -> "AudioEngine":
+        with self._lock:
+            self._spawn()
+        self._closing.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="audq-engine-watch", daemon=True)
+        self._watchdog.start()
+        return self
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.is_alive()
+
+    def restart(self, reason: str = "requested") -> None:
+        """Replace the engine process; open streams resume where they were."""
+        with self._lock:
+            self._kill()
+            self._spawn()
+            self.restarts += 1
+            metrics.ENGINE_RESTARTS.inc(reason=reason)
+            self.log_func(f"[!] 音訊引擎已重新啟動（{reason}），恢復 {len(self._outputs)} 個輸出")
+            for out in list(self._outputs.values()):
+                try:
+                    self._open_remote(out)
+                except EngineError as e:
+                    _log.warning("engine could not reopen device %s: %s", out.device, e)
+
+    def stop(self) -> None:
+        self._closing.set()
+        with self._lock:
+            if self.alive:
+                try:
+                    self._call_locked("stop")
+                except EngineError:
+                    pass
+            self._kill()
+            for out in list(self._outputs.values()):
+                out.ring.close()
+            self._outputs.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pid": self._proc.pid if self._proc else None, "alive": self.alive,
+                "restarts": self.restarts, "outputs": len(self._outputs),
+                "buffered_sec": {out.device: round(out.ring.available() / out.samplerate, 3)
+                                 for out in list(self._outputs.values())}}
+
+    # --- outputs (called by the player's device workers) ----------------------
+    def open(self, device: Any, samplerate: int, channels: int) -> EngineOutput:
+        ring = SharedPCMRing(int(samplerate * self.buffer_sec), channels)
+        out = EngineOutput(self, next(self._ids), device, samplerate, channels, ring)
+        try:
+            with self._lock:
+                self._open_remote(out)
+                self._outputs[out.oid] = out
+        except Exception:
+            ring.close()
+            raise
+        return out
+
+    def _open_remote(self, out: EngineOutput) -> None:
+        self._call("open", out.oid, out.device, out.samplerate, out.channels,
+                   out.ring.name, out.ring.size)
+
+    def _close_output(self, out: EngineOutput) -> None:
+        with self._lock:
+            if self._outputs.pop(out.oid, None) is None:
+                return
+            try:
+                if self.alive:
+                    self._call("close", out.oid)
+            except EngineError as e:
+                _log.debug("engine close %s: %s", out.device, e)
+            out.ring.close()
+
+    # --- control channel ----------------------------------------------------
+    def _call(self, *msg) -> Any:
+        with self._lock:
+            if not self.alive:
+                if self._closing.is_set():
+                    raise EngineError("audio engine stopped")
+                self.restart("exited")
+            return self._call_locked(*msg)
+
+    def _call_locked(self, *msg) -> Any:
+        try:
+            self._conn.send(msg)
+            if not self._conn.poll(self.CALL_TIMEOUT):
+                raise EngineError(f"no answer to {msg[0]!r} in {self.CALL_TIMEOUT:.0f}s")
+            status, value = self._conn.recv()
+        except (EOFError, OSError) as e:
+            raise EngineError(f"control channel closed: {e}") from e
+        if status != "ok":
+            raise EngineError(value)
+        return value
+
+    def _spawn(self) -> None:
+        parent, child = self._ctx.Pipe()
+        proc = self._ctx.Process(target=_engine_main, args=(child, self.init),
+                                 name="audq-engine", daemon=True)
+        proc.start()
+        child.close()
+        self._proc, self._conn = proc, parent
+        _log.info("audio engine process started (pid %s)", proc.pid)
+
+    def _kill(self) -> None:
+        proc, conn = self._proc, self._conn
+        self._proc = self._conn = None
+        if conn is not None:
+            conn.close()  # the engine sees EOF and exits
+        if proc is not None:
+            proc.join(1.0)
+            if proc.is_alive():
+                proc.kill()
+                proc.join(1.0)
+
+    def _watch(self) -> None:
+        while not self._closing.wait(self.WATCH_SEC):
+            with self._lock:
+                if self._closing.is_set():
+                    return
+                if not self.alive:
+                    code = self._proc.exitcode if self._proc else None
+                    _log.warning("音訊引擎程序結束（exit code %s），重新啟動", code)
+                    self.restart("exited")
+                    continue
+                try:
+                    self._call_locked("ping")
+                except EngineError as e:
+                    _log.warning("音訊引擎無回應（%s），重新啟動", e)
+                    self.restart("hung")
+
+
+__all__ = ["AudioEngine", "EngineError", "EngineOutput", "SharedPCMRing"]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+One pooled keep-alive HTTP session per CA setting, shared process-wide.
+
+LoginClient and the Engine.IO polling transport talk to the same host; with
+a session each they would pay for a TCP + TLS handshake twice. The shared
+session keeps the connection open between the login POST and the
+Socket.IO handshake, and retries idempotent requests on connect errors.
+
+Usage:
+    from services.http_session import get_session
+
+    sess = get_session(verify="app.crt")   # same object for the same verify
+"""
+from __future__ import annotations
+
+import threading
+from typing import Dict, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_CONNECTIONS = 4   # distinct hosts kept
+POOL_MAXSIZE = 16      # sockets per host (many clients share one backend)
+
+_sessions: Dict[Union[bool, str], requests.Session] = {}
+_lock = threading.Lock()
+
+
+def _new_session(verify: Union[bool, str]) -> requests.Session:
+    sess = requests.Session()
+    sess.verify = verify
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+        max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.2,
+                          allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"})),
+    )
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
+
+
+def get_session(verify: Union[bool, str, None] = True) -> requests.Session:
+    """The shared session for this CA setting (True, False or a bundle path)."""
+    key = True if verify is None else verify
+    with _lock:
+        sess = _sessions.get(key)
+        if sess is None:
+            sess = _sessions[key] = _new_session(key)
+        return sess
+
+
+__all__ = ["get_session"]
@@ -10,17 +10,31 @@ Usage:
     headers = client.auth_headers()       # {"Authorization": "Bearer ...", ...}
     sess = client.session                 # underlying requests.Session (verify already set)
 
+    # Survive restarts without a /login round trip, and keep the token fresh
+    client = LoginClient(app_base, user, pw, store=TokenStore())
+    client.add_listener(socket_client.set_token)   # called with each new token
+    client.start_auto_refresh()
+    client.stop_auto_refresh(); client.remove_listener(socket_client.set_token)
+
 Notes:
 - Password is base64-encoded to match your server-side expectation (same as old code).
 - CA verification defaults to "./app.crt"; override with True/False or a custom bundle path.
+- Without an explicit `session`, the pooled session from services.http_session
+  is used, so the Engine.IO polling transport reuses the login connection.
 """
 from __future__ import annotations
 
 import base64
+import threading
+import time
 import requests
-from typing import List, Optional, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
+
+from services.http_session import get_session
+from services.token_store import TokenStore, token_expiry
+from util.logs import get_logger
 
-from util.common import resource_path
+_log = get_logger("login")
 
 
 class LoginError(Exception):
@@ -38,16 +52,28 @@ class LoginClient:
         log_func=None,
         timeout: int = 15,
         session: Optional[requests.Session] = None,
+        store: Optional[TokenStore] = None,
+        refresh_margin: float = 300.0,
     ) -> None:
         self.app_base = (app_base or "").rstrip("/")
         self.username = username
         self.password = password
         self.verify = ca_verify if ca_verify else True
-        self.log_func = log_func
+        self.log_func = log_func or _log.info
         self.timeout = int(timeout)
         self._token: Optional[str] = None
-        self._sess: requests.Session = session or requests.Session()
+        self.area_list = None
+        self.expires_at: Optional[float] = None  # epoch seconds
+        self.from_cache = False  # token came from the store, not this process's login
+        self._sess: requests.Session = session or get_session(self.verify)
         self._sess.verify = self.verify
+        self.store = store
+        self.refresh_margin = float(refresh_margin)
+        self._listeners: List[Callable[[str], None]] = []
+        self._login_lock = threading.Lock()
+        self._refresh_stop = threading.Event()
+        self._refresh_wake = threading.Event()
+        self._refresh_thread: Optional[threading.Thread] = None
 
     # --- public API ---
     def login(self) -> str:
@@ -79,19 +105,118 @@ class LoginClient:
         self.area_list = data.get("area")
         if not token:
             raise LoginError("Login succeeded but no token in payload")
-        self.log_func(f"登入成功")
+        self.log_func("登入成功")
         self._token = token
+        self.from_cache = False
+        if self.store is None:
+            self.expires_at = token_expiry(token, data)
+        else:
+            self.expires_at = self.store.expiry(token, data)
+            self.store.save(self.app_base, self.username, token, self.area_list, self.expires_at)
+        self._notify(token)
         return token, self.area_list
 
     def get_token(self, refresh: bool = False) -> Tuple[str, List[str]]:
-        """Return cached token; if missing or refresh=True, perform login."""
-        if not self._token or refresh:
-            return self.login()
-        return self._token, self.area_list
+        """Return cached token; if missing, expired or refresh=True, perform login.
+
+        With a store, a still valid persisted token is used before logging in.
+        """
+        with self._login_lock:
+            if not refresh and not self._token and self.store is not None:
+                entry = self.store.load(self.app_base, self.username)
+                if entry is not None:
+                    self._token, self.area_list = entry["token"], entry.get("area")
+                    self.expires_at = float(entry["expires_at"])
+                    self.from_cache = True
+                    self.log_func("使用快取的登入 token")
+            expired = self.expires_at is not None and self.expires_at <= time.time()
+            if not self._token or refresh or expired:
+                return self.login()
+            return self._token, self.area_list
+
+    def invalidate(self) -> None:
+        """Forget the token here and in the store (e.g. the server rejected it)."""
+        with self._login_lock:
+            self._token = None
+            self.expires_at = None
+            if self.store is not None:
+                self.store.clear(self.app_base, self.username)
+
+    # --- refresh ---
+    def add_listener(self, func: Callable[[str], None]) -> None:
+        """Call func(token) whenever a new token is obtained."""
+        self._listeners.append(func)
+
+    def remove_listener(self, func: Callable[[str], None]) -> None:
+        try:
+            self._listeners.remove(func)
+        except ValueError:
+            pass
+
+    def _notify(self, token: str) -> None:
+        for func in list(self._listeners):
+            try:
+                func(token)
+            except Exception as e:
+                _log.warning("token listener failed: %s", e)
+
+    def request_refresh(self) -> None:
+        """Log in again soon, off the calling thread (e.g. a socket callback)."""
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            self._refresh_wake.set()
+            return
+        threading.Thread(target=self._refresh_once, name="login-refresh", daemon=True).start()
+
+    def _refresh_once(self) -> bool:
+        try:
+            self.get_token(refresh=True)
+            return True
+        except Exception as e:
+            _log.warning("token 更新失敗：%s", e)
+            return False
+
+    def start_auto_refresh(self) -> None:
+        """Refresh `refresh_margin` seconds before expiry, on a daemon thread."""
+        t = self._refresh_thread
+        if t is not None and t.is_alive():
+            if not self._refresh_stop.is_set():
+                return
+            t.join()  # stop_auto_refresh() just ran: let that loop exit first
+        self._refresh_stop.clear()
+        self._refresh_wake.clear()
+        self._refresh_thread = threading.Thread(
+            target=self._refresh_loop, name="login-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_auto_refresh(self) -> None:
+        self._refresh_stop.set()
+        self._refresh_wake.set()
+
+    def _refresh_loop(self) -> None:
+        retry = 5.0
+        while not self._refresh_stop.is_set():
+            if self.expires_at is None:
+                wait = None  # unknown expiry: only explicit requests
+            else:
+                wait = max(self.expires_at - self.refresh_margin - time.time(), 0.0)
+            woken = self._refresh_wake.wait(wait)
+            self._refresh_wake.clear()
+            if self._refresh_stop.is_set():
+                break
+            if not woken and self.expires_at is not None \
+                    and self.expires_at - self.refresh_margin > time.time():
+                continue  # expiry moved (someone else refreshed)
+            if self._refresh_once():
+                retry = 5.0
+            else:
+                # back off, but never past the expiry itself
+                left = (self.expires_at or time.time()) - time.time()
+                self._refresh_stop.wait(min(retry, max(left, 1.0)))
+                retry = min(retry * 2, 300.0)
 
     def auth_headers(self) -> dict:
         """Convenience: build Authorization/Accept/X-Requested-With headers."""
-        token = self.get_token()
+        token, _ = self.get_token()
         return {
             "Authorization": f"Bearer {token}",
             "Accept": "application/json",
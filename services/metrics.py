@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+In-process metrics with a Prometheus text endpoint (stdlib only).
+
+Counters, gauges and histograms live in one module-level REGISTRY; the
+client and player update them on their hot paths (a dict lookup and an
+add under a small lock). `serve()` optionally exposes them on a local
+HTTP port in the Prometheus text exposition format, so fleet alerting can
+scrape playback lag without any extra dependency.
+
+Usage:
+    from services import metrics
+
+    metrics.serve(9464)                       # http://127.0.0.1:9464/metrics
+    metrics.EVENTS_RECEIVED.inc(event="PlayAudioEvent")
+    metrics.DECODE_SECONDS.observe(0.012, stage="audio")
+    print(metrics.REGISTRY.render())
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, object]) -> _LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _esc(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(key: _LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in items) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[str]:  # pragma: no cover - overridden
+        return ()
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[_LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        k = _key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for k, v in items:
+            yield f"{self.name}{_fmt_labels(k)} {v}"
+
+
+class Gauge(_Metric):
+    """Gauge whose samples are read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        super().__init__(name, help)
+        self.label = label
+        self._fn: Optional[Callable[[], object]] = None
+
+    def set_function(self, fn: Callable[[], object]) -> None:
+        """fn() returns a number, or {label_value: number} if `label` is set."""
+        self._fn = fn
+
+    def samples(self):
+        if self._fn is None:
+            return
+        try:
+            val = self._fn()
+        except Exception:
+            return
+        if isinstance(val, dict):
+            for lv, v in val.items():
+                yield f"{self.name}{_fmt_labels(((self.label or 'key', str(lv)),))} {v}"
+        else:
+            yield f"{self.name} {val}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[_LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        k = _key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(k)
+            if row is None:
+                row = self._values[k] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(row)) for k, row in self._values.items()]
+        for k, row in items:
+            acc = 0
+            for b, n in zip(self.buckets, row):
+                acc += n
+                yield f"{self.name}_bucket{_fmt_labels(k, ('le', repr(float(b))))} {acc}"
+            acc += row[len(self.buckets)]
+            yield f"{self.name}_bucket{_fmt_labels(k, ('le', '+Inf'))} {acc}"
+            yield f"{self.name}_count{_fmt_labels(k)} {acc}"
+            yield f"{self.name}_sum{_fmt_labels(k)} {row[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        return "".join(m.render() for m in list(self._metrics.values()))
+
+
+REGISTRY = Registry()
+
+EVENTS_RECEIVED = REGISTRY.register(Counter(
+    "audq_events_received_total", "Socket.IO events handled, by event name"))
+BYTES_RECEIVED = REGISTRY.register(Counter(
+    "audq_bytes_received_total", "Encoded audio payload bytes received"))
+DECODE_SECONDS = REGISTRY.register(Histogram(
+    "audq_decode_seconds", "Decode time per clip/chunk, by stage (base64, audio, tempfile, convert)"))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "audq_queue_wait_seconds", "Time a clip waited in its device queue before playback"))
+TIME_TO_FIRST_AUDIO = REGISTRY.register(Histogram(
+    "audq_time_to_first_audio_seconds", "Event received -> first sample handed to the device"))
+PLAYBACK_SECONDS = REGISTRY.register(Histogram(
+    "audq_playback_seconds", "Audio duration played per item, by device",
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300)))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "audq_pcm_cache_requests_total", "Decoded-PCM cache lookups, by result"))
+RECONNECTS = REGISTRY.register(Counter(
+    "audq_reconnects_total", "Socket.IO reconnections"))
+ENDPOINT_EVENTS = REGISTRY.register(Counter(
+    "audq_endpoint_events_total", "PlayAudioEvents per endpoint, by result (played, duplicate, standby)"))
+FAILOVERS = REGISTRY.register(Counter(
+    "audq_failovers_total", "Active endpoint switches in hot-standby mode"))
+ENGINE_RESTARTS = REGISTRY.register(Counter(
+    "audq_engine_restarts_total", "Audio engine process restarts, by reason"))
+SUBSCRIBE_SECONDS = REGISTRY.register(Histogram(
+    "audq_subscribe_seconds", "Socket.IO connect -> every area subscription confirmed"))
+CLIPS_DROPPED = REGISTRY.register(Counter(
+    "audq_clips_dropped_total", "Queued clips not played to the end, by reason"))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "audq_queue_depth", "Pending items per output device", label="device"))
+QUEUE_BYTES = REGISTRY.register(Gauge(
+    "audq_queue_bytes", "Encoded bytes queued per output device", label="device"))
+DECODE_AHEAD_BYTES = REGISTRY.register(Gauge(
+    "audq_decode_ahead_bytes", "Decoded PCM waiting for playback (decode-ahead)"))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Start the /metrics endpoint on a daemon thread (idempotent)."""
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, int(port)), _Handler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="audq-metrics", daemon=True).start()
+    return _server
+
+
+def shutdown() -> None:
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+
+__all__ = [
+    "Counter", "Gauge", "Histogram", "Registry", "REGISTRY", "serve", "shutdown",
+    "EVENTS_RECEIVED", "BYTES_RECEIVED", "DECODE_SECONDS", "QUEUE_WAIT_SECONDS",
+    "TIME_TO_FIRST_AUDIO", "PLAYBACK_SECONDS", "CACHE_REQUESTS", "RECONNECTS", "SUBSCRIBE_SECONDS",
+    "ENDPOINT_EVENTS", "FAILOVERS", "ENGINE_RESTARTS",
+    "CLIPS_DROPPED",
+    "QUEUE_DEPTH", "QUEUE_BYTES", "DECODE_AHEAD_BYTES",
+]
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+One player fed by several backend endpoints, for failover.
+
+`MultiEndpointClient` keeps an AudioSocketClient connected and subscribed
+to every endpoint; all of them feed the shared AudioQueuePlayer. Modes:
+
+- "standby" (hot standby): only the active endpoint's broadcasts play.
+  When it disconnects, the next healthy endpoint (already connected and
+  subscribed) becomes active right away in the disconnect callback, so
+  failover costs no reconnect. An endpoint that has been silent (no event
+  or pong) for `stale_sec` counts as down. When a higher-listed endpoint
+  is healthy again, playback fails back to it.
+- "active" (active-active): every endpoint's broadcasts are accepted and
+  duplicates are dropped.
+
+Duplicates are detected in both modes, which also covers the moment of a
+switchover. An event with a "message_id" is a duplicate if that id was
+seen in the last `dedup_sec` seconds. Messages sent one chunk per event
+(services.reassembly) go through one Reassembler shared by all clients,
+so the stream is queued once and chunks from any endpoint fill the same
+message: a chunk is only dropped if that slot is already filled, and in
+standby mode a standby endpoint's chunks still fill in a message that is
+already in progress (a failover mid-message loses no chunk the new
+endpoint delivers). Without an id, the channel and audio are
+hashed, and a duplicate only counts when it arrives from a *different*
+endpoint within `content_dedup_sec`. A server repeating the same
+announcement on purpose still plays.
+
+Per-endpoint counters are in metrics.ENDPOINT_EVENTS and `stats()`.
+
+Usage:
+    multi = MultiEndpointClient(["https://a", "https://b"], routes, areas, token,
+                                mode="standby", login=login, log_func=print)
+    multi.connect()
+    multi.stats()   # {"mode": ..., "active": "https://a", "endpoints": [...]}
+"""
+from __future__ import annotations
+
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from services import metrics
+from services.client import AudioSocketClient
+from services.reassembly import Reassembler
+from util.logs import get_logger
+
+_log = get_logger("multi")
+
+MODES = ("standby", "active")
+
+
+class _Dedup:
+    """Recently seen broadcast keys -> (time, endpoint that delivered first)."""
+
+    def __init__(self, id_ttl: float, content_ttl: float, max_entries: int = 8192):
+        self.ttl = {"id": float(id_ttl), "content": float(content_ttl)}
+        self.max_entries = int(max_entries)
+        self._seen: Dict[str, "OrderedDict[tuple, tuple]"] = {"id": OrderedDict(), "content": OrderedDict()}
+        self._lock = threading.Lock()
+
+    def first(self, key: tuple, endpoint: Any) -> bool:
+        kind = key[0]
+        seen, ttl = self._seen[kind], self.ttl[kind]
+        now = time.monotonic()
+        with self._lock:
+            while seen:
+                k, (t, _) = next(iter(seen.items()))
+                if now - t < ttl and len(seen) <= self.max_entries:
+                    break
+                seen.popitem(last=False)
+            prev = seen.get(key)
+            if prev is not None and (kind == "id" or prev[1] is not endpoint):
+                return False
+            seen[key] = (now, endpoint)
+            seen.move_to_end(key)
+            return True
+
+
+class MultiEndpointClient:
+    CHECK_SEC = 0.25  # health check period (staleness, failback, retries)
+
+    def __init__(self, endpoints: List[str], channel, area, token, mode: str = "standby",
+                 stale_sec: Optional[float] = None, dedup_sec: float = 300.0,
+                 content_dedup_sec: float = 5.0, client_factory=AudioSocketClient,
+                 **client_kwargs):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, not {mode!r}")
+        endpoints = [e.rstrip("/") for e in dict.fromkeys(endpoints)]
+        if not endpoints:
+            raise ValueError("no endpoints")
+        self.mode = mode
+        self.log_func = client_kwargs.get("log_func") or _log.info
+        self._dedup = _Dedup(dedup_sec, content_dedup_sec)
+        self._lock = threading.RLock()
+        self.reassembler = Reassembler(timeout=client_kwargs.pop("chunk_timeout", 30.0))
+        self.clients: List[AudioSocketClient] = [
+            client_factory(url, channel, area, token, event_filter=self._accept,
+                           on_state=self._on_state, reassembler=self.reassembler,
+                           **client_kwargs)
+            for url in endpoints
+        ]
+        # all clients share the module-level player
+        self.player = self.clients[0].player
+        ping = self.clients[0].ping_interval
+        # silent for this long = down (the app keepalive gets a pong every ping_interval)
+        self.stale_sec = stale_sec if stale_sec is not None else (3 * ping if ping > 0 else None)
+        self.active: Optional[AudioSocketClient] = None
+        self.failovers = 0
+        self.last_failover: Optional[Dict[str, Any]] = None
+        self._closing = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+        self._retry_at: Dict[int, float] = {}
+
+    # --- event gate -------------------------------------------------------
+    def _accept(self, client: AudioSocketClient, chan, payload) -> bool:
+        ep = client.app_base
+        key = self._event_key(chan, payload)
+        if key is not None and key[0] == "chunk":
+            return self._accept_chunk(client, key[1], key[2])
+        if self.mode == "standby":
+            with self._lock:
+                if self.active is None:
+                    self._switch(client, "first event")
+                active = self.active
+            if client is not active:
+                metrics.ENDPOINT_EVENTS.inc(endpoint=ep, result="standby")
+                return False
+        if key is not None and not self._dedup.first(key, client):
+            metrics.ENDPOINT_EVENTS.inc(endpoint=ep, result="duplicate")
+            return False
+        metrics.ENDPOINT_EVENTS.inc(endpoint=ep, result="played")
+        return True
+
+    @staticmethod
+    def _event_key(chan, payload) -> Optional[tuple]:
+        if not isinstance(payload, dict):
+            return None
+        msg = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+        if msg.get("message_id") is not None:
+            if msg.get("seq") is not None:
+                try:
+                    return ("chunk", str(msg["message_id"]), int(msg["seq"]))
+                except (TypeError, ValueError):
+                    pass  # the client logs and drops it
+            return ("id", str(msg["message_id"]))
+        audio = msg.get("audio") or msg.get("base64") or msg.get("asset_id")
+        if audio is None:
+            return None
+        h = hashlib.blake2b(str(chan).encode("utf-8"), digest_size=16)
+        parts = audio.values() if isinstance(audio, dict) else (
+            audio if isinstance(audio, (list, tuple)) else (audio,))
+        for part in parts:
+            if part is None:
+                continue
+            if isinstance(part, (bytes, bytearray, memoryview)):
+                h.update(part)
+            else:  # str, or a scalar such as a numeric asset_id
+                h.update(str(part).encode("utf-8", "ignore"))
+            h.update(b"\0")
+        return ("content", h.digest())
+
+    def _accept_chunk(self, client: AudioSocketClient, msg_id: str, seq: int) -> bool:
+        """One chunk of a chunked message; all go to the shared reassembler."""
+        ep = client.app_base
+        if self.reassembler.has(msg_id, seq):
+            metrics.ENDPOINT_EVENTS.inc(endpoint=ep, result="duplicate")
+            return False
+        if self.mode == "standby":
+            with self._lock:
+                if self.active is None:
+                    self._switch(client, "first event")
+                active = self.active
+        if self.mode == "standby" and client is not active \
+                and not self.reassembler.has(msg_id):
+            metrics.ENDPOINT_EVENTS.inc(endpoint=ep, result="standby")
+            return False
+        metrics.ENDPOINT_EVENTS.inc(endpoint=ep, result="played")
+        return True
+
+    # --- failover ---------------------------------------------------------
+    def _healthy(self, client: AudioSocketClient) -> bool:
+        if not client.sio.connected or not client.subs.complete:
+            return False
+        if self.stale_sec is None or client.last_seen is None:
+            return True
+        return time.monotonic() - client.last_seen < self.stale_sec
+
+    def _pick(self, exclude: Optional[AudioSocketClient] = None) -> Optional[AudioSocketClient]:
+        clients = [c for c in self.clients if c is not exclude]  # list order = preference
+        for c in clients:
+            if self._healthy(c):
+                return c
+        return next((c for c in clients if c.sio.connected), None)
+
+    def _switch(self, new: Optional[AudioSocketClient], reason: str, t0: Optional[float] = None) -> None:
+        old = self.active
+        if new is old:
+            return
+        self.active = new
+        if old is None or self.mode != "standby":
+            return
+        self.failovers += 1
+        metrics.FAILOVERS.inc()
+        ms = (time.perf_counter() - t0) * 1000 if t0 is not None else None
+        self.last_failover = {"from": old.app_base, "to": new.app_base if new else None,
+                              "reason": reason, "switch_ms": ms}
+        self.log_func(f"播放來源切換：{old.app_base} → {new.app_base if new else '無'}（{reason}）")
+
+    def _on_state(self, client: AudioSocketClient, connected: bool) -> None:
+        t0 = time.perf_counter()
+        if self._closing.is_set():
+            return
+        with self._lock:
+            if not connected and client is self.active:
+                # sio.connected is still True inside the disconnect handler
+                self._switch(self._pick(exclude=client), "disconnected", t0)
+            elif connected and self.active is None:
+                self._switch(client, "connected", t0)
+
+    def _watch(self) -> None:
+        while not self._closing.wait(self.CHECK_SEC):
+            t0 = time.perf_counter()
+            with self._lock:
+                best, active = self._pick(), self.active
+                if best is not None and best is not active:
+                    if active is None or not active.sio.connected:
+                        self._switch(best, "disconnected", t0)
+                    elif not self._healthy(active):
+                        self._switch(best, "stale", t0)
+                    elif self.clients.index(best) < self.clients.index(active):
+                        self._switch(best, "failback", t0)
+            self._retry_failed()
+
+    # --- connections ------------------------------------------------------
+    def _connect_one(self, i: int) -> Optional[Exception]:
+        try:
+            self.clients[i].connect()
+            return None
+        except Exception as e:
+            # python-socketio only reconnects connections that were up once;
+            # endpoints that were down at start are retried by the monitor
+            delay = self.clients[i].reconnection_delay_max
+            self._retry_at[i] = time.monotonic() + delay * (1 + random.uniform(-0.5, 0.5))
+            return e
+
+    def _retry_failed(self) -> None:
+        now = time.monotonic()
+        for i, at in list(self._retry_at.items()):
+            if now >= at and not self._closing.is_set():
+                del self._retry_at[i]
+                if self._connect_one(i) is None:
+                    self.log_func(f"[OK] 伺服器恢復連線：{self.clients[i].app_base}")
+
+    def connect(self) -> Dict[str, Any]:
+        """Connect every endpoint in parallel; raises only if none is reachable."""
+        errors: List[Optional[Exception]] = [None] * len(self.clients)
+
+        def _run(i):
+            errors[i] = self._connect_one(i)
+
+        threads = [threading.Thread(target=_run, args=(i,), daemon=True) for i in range(len(self.clients))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for c, e in zip(self.clients, errors):
+            if e is not None:
+                _log.warning("連線失敗 %s：%s", c.app_base, e)
+        if all(e is not None for e in errors):
+            raise errors[0]
+        with self._lock:
+            # start on the most preferred endpoint, whichever connected first
+            self.active = self._pick() or self.active
+        self._closing.clear()
+        if self._monitor is None or not self._monitor.is_alive():
+            self._monitor = threading.Thread(target=self._watch, name="multi-endpoint", daemon=True)
+            self._monitor.start()
+        return self.stats()
+
+    def disconnect(self) -> None:
+        self._closing.set()
+        for c in self.clients:
+            try:
+                c.disconnect()
+            except Exception as e:
+                _log.debug("disconnect %s: %s", c.app_base, e)
+
+    def run_forever(self) -> None:
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.disconnect()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        eps = []
+        for c in self.clients:
+            ep = c.app_base
+            eps.append({
+                "url": ep,
+                "connected": c.sio.connected,
+                "active": c is self.active if self.mode == "standby" else c.sio.connected,
+                "subscribed": c.sio.connected and c.subs.complete,
+                "played": int(metrics.ENDPOINT_EVENTS.value(endpoint=ep, result="played")),
+                "duplicate": int(metrics.ENDPOINT_EVENTS.value(endpoint=ep, result="duplicate")),
+                "standby": int(metrics.ENDPOINT_EVENTS.value(endpoint=ep, result="standby")),
+                "rtt": c.last_rtt,
+                "idle_sec": None if c.last_seen is None else round(now - c.last_seen, 3),
+                **{k: c.connect_stats.get(k) for k in ("connect_sec", "reconnect_sec", "subscribed_sec")},
+            })
+        return {"mode": self.mode, "active": self.active.app_base if self.active else None,
+                "failovers": self.failovers, "last_failover": self.last_failover, "endpoints": eps}
+
+
+__all__ = ["MultiEndpointClient", "MODES"]
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Reassembly of one broadcast sent as chunks over many events.
+
+Instead of one huge PlayAudioEvent carrying every chunk, the server may
+send each chunk as its own event as soon as it is encoded:
+
+    {"message_id": "m-42", "seq": 3, "total": 12, "audio": <chunk>, "format": "mp3"}
+
+`seq` is 0-based; `total` may be on any (ideally the first) chunk, or the
+last chunk can carry "last": true instead. Each chunk is a self-contained
+encoded clip, like the entries of the single-event {"audio": {"0": ...}}
+form.
+
+`Reassembler.add()` files each chunk into its message's preallocated slot
+table (chunks may arrive out of order; duplicates, e.g. replays after a
+reconnect, are ignored). Every device the message is routed to reads it
+through its own `ChunkReader`, which hands over the contiguous prefix as it
+completes, so playback starts with chunk 0 while later chunks are still in
+flight. Messages that stop receiving chunks for `timeout` seconds, or
+exceed the memory cap, are evicted; their readers end after the prefix
+they already have.
+
+Usage:
+    from services.reassembly import Reassembler
+
+    asm = Reassembler(timeout=30)
+    msg, is_new = asm.add("m-42", 0, 12, chunk0)
+    if is_new:
+        player.enqueue_stream(msg.reader(), device)
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from util.logs import get_logger
+
+_log = get_logger("reassembly")
+
+# ChunkReader.get(block=False) result when the next chunk has not arrived yet
+PENDING = object()
+
+
+class Message:
+    """Slot table for one chunked message; shared by all of its readers."""
+
+    def __init__(self, msg_id: str, total: Optional[int], timeout: float = 30.0):
+        self.msg_id = msg_id
+        self.timeout = timeout
+        self.total = total
+        self.slots: List[Any] = [None] * total if total else []
+        self.received = 0
+        self.nbytes = 0
+        self.closed = False  # complete or evicted: no more chunks will come
+        self.last_seen = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _put(self, seq: int, total: Optional[int], last: bool, chunk: Any) -> bool:
+        with self._cond:
+            if self.closed:
+                return False
+            if total and self.total is None:
+                self.total = total
+            if last and self.total is None:
+                self.total = seq + 1
+            need = max(seq + 1, self.total or 0)
+            if need > len(self.slots):
+                self.slots.extend([None] * (need - len(self.slots)))
+            if self.total is not None and seq >= self.total:
+                return False
+            if self.slots[seq] is not None:
+                return False  # duplicate
+            self.slots[seq] = chunk
+            self.received += 1
+            self.nbytes += len(chunk)
+            self.last_seen = time.monotonic()
+            if self.total is not None and self.received >= self.total:
+                self.closed = True
+            self._cond.notify_all()
+            return True
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    @property
+    def complete(self) -> bool:
+        return self.total is not None and self.received >= self.total
+
+    def reader(self) -> "ChunkReader":
+        return ChunkReader(self)
+
+
+class ChunkReader:
+    """In-order view of a message for one consumer (the chunk source protocol).
+
+    get() returns the next chunk, None once the message has ended (all
+    chunks read, evicted, or no chunk for `message.timeout` seconds while
+    waiting), or PENDING when called with block=False and the next chunk
+    is still in flight. `stop` (anything with is_set()) aborts a wait.
+    """
+
+    def __init__(self, message: Message):
+        self.message = message
+        self.pos = 0
+
+    def get(self, block: bool = True, timeout: Optional[float] = None, stop=None):
+        m = self.message
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with m._cond:
+            while True:
+                if self.pos < len(m.slots) and m.slots[self.pos] is not None:
+                    chunk = m.slots[self.pos]
+                    self.pos += 1
+                    return chunk
+                if m.closed or (m.total is not None and self.pos >= m.total):
+                    return None
+                if not block:
+                    return PENDING
+                if stop is not None and stop.is_set():
+                    return None
+                now = time.monotonic()
+                # stalled sender: the Reassembler evicts on its next add(),
+                # which may never come, so give up here as well
+                left = m.last_seen + m.timeout - now
+                if deadline is not None:
+                    left = min(left, deadline - now)
+                if left <= 0:
+                    return None
+                m._cond.wait(min(left, 0.1) if stop is not None else left)
+
+
+class Reassembler:
+    def __init__(self, timeout: float = 30.0, max_bytes: int = 64 * 1024 * 1024,
+                 max_messages: int = 64, remember: int = 256):
+        self.timeout = float(timeout)
+        self.max_bytes = int(max_bytes)
+        self.max_messages = int(max_messages)
+        self._partial: "OrderedDict[str, Message]" = OrderedDict()  # by last activity
+        self._finished: "OrderedDict[str, None]" = OrderedDict()    # recent ids, for replays
+        self._remember = int(remember)
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def add(self, msg_id: Any, seq: int, total: Optional[int], chunk: Any,
+            last: bool = False) -> Tuple[Optional[Message], bool]:
+        """File one chunk. Returns (message, is_new); message is None for
+        chunks of finished/evicted messages or invalid ones."""
+        msg_id = str(msg_id)
+        seq = int(seq)
+        total = int(total) if total else None
+        if seq < 0 or (total is not None and seq >= total) or not chunk:
+            return None, False
+        with self._lock:
+            self._evict_stale()
+            if msg_id in self._finished:
+                return None, False
+            m = self._partial.get(msg_id)
+            is_new = m is None
+            if is_new:
+                m = self._partial[msg_id] = Message(msg_id, total, self.timeout)
+            else:
+                self._partial.move_to_end(msg_id)
+        m._put(seq, total, last, chunk)
+        with self._lock:
+            if m.complete:
+                self._finish(msg_id)
+            self._enforce_limits()
+        return m, is_new
+
+    def pending(self) -> int:
+        return len(self._partial)
+
+    def has(self, msg_id: Any, seq: Optional[int] = None) -> bool:
+        """Whether message `msg_id` is known (chunk `seq` of it, if given)."""
+        msg_id = str(msg_id)
+        with self._lock:
+            if msg_id in self._finished:
+                return True
+            m = self._partial.get(msg_id)
+        if m is None or seq is None:
+            return m is not None
+        with m._cond:
+            return 0 <= seq < len(m.slots) and m.slots[seq] is not None
+
+    # --- Internals --------------------------------------------------------
+    def _finish(self, msg_id: str) -> None:
+        m = self._partial.pop(msg_id, None)
+        if m is not None:
+            m.close()
+        self._finished[msg_id] = None
+        while len(self._finished) > self._remember:
+            self._finished.popitem(last=False)
+
+    def _evict(self, msg_id: str, why: str) -> None:
+        m = self._partial.get(msg_id)
+        if m is None:
+            return
+        _log.warning("捨棄未完成的分段廣播 %s（%s，已收 %d/%s）",
+                     msg_id, why, m.received, m.total or "?")
+        self.evicted += 1
+        self._finish(msg_id)
+
+    def _evict_stale(self) -> None:
+        now = time.monotonic()
+        while self._partial:
+            msg_id, m = next(iter(self._partial.items()))
+            if now - m.last_seen < self.timeout:
+                break
+            self._evict(msg_id, "逾時")
+
+    def _enforce_limits(self) -> None:
+        while len(self._partial) > self.max_messages:
+            self._evict(next(iter(self._partial)), "訊息數上限")
+        while self._partial and sum(m.nbytes for m in self._partial.values()) > self.max_bytes:
+            self._evict(next(iter(self._partial)), "記憶體上限")
+
+
+__all__ = ["Reassembler", "Message", "ChunkReader", "PENDING"]
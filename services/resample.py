@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized PCM conversion to an output device's native format.
+
+Decoded clips come in whatever rate/layout the file has (44.1 kHz mono
+MP3s, 22.05 kHz WAVs, ...). Handing those to PortAudio either fails on
+devices that only accept their native rate or pushes resampling into the
+host API, and mono on multichannel outputs is left to the driver. `convert`
+brings float32 (frames x channels) PCM to the device's rate and channel
+count up front, in NumPy only:
+
+- Resampling is a polyphase windowed-sinc (Kaiser) filter for the exact
+  rational ratio (e.g. 44100 -> 48000 = 160/147). The filter bank is
+  computed once per ratio and each output block is one gather + one
+  multiply-sum, so there is no per-sample Python loop.
+- Channel mapping: mono is copied to every output channel, anything to
+  mono is averaged, otherwise channels map 1:1 (extra outputs silent,
+  extra inputs dropped).
+
+Usage:
+    from services.resample import convert
+
+    pcm48 = convert(pcm, 44100, 48000, channels=2)
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from math import gcd
+from typing import Tuple
+
+import numpy as np
+
+TAPS = 32          # filter length per phase (zero crossings on both sides)
+KAISER_BETA = 8.0  # ~80 dB stopband
+BLOCK = 1 << 14    # output frames per vectorized block (bounds temp memory)
+
+
+@lru_cache(maxsize=32)
+def _filter_bank(up: int, down: int, taps: int = TAPS) -> Tuple[np.ndarray, int]:
+    """(up x taps) polyphase coefficients and the left-hand tap offset."""
+    cutoff = min(1.0, up / down)  # low-pass below the lower Nyquist
+    half = taps // 2
+    phase = np.arange(up, dtype=np.float64)[:, None] / up  # fractional delay
+    k = np.arange(-half + 1, half + 1, dtype=np.float64)[None, :]
+    t = k - phase
+    # Kaiser window evaluated at the actual (fractional) tap positions
+    window = np.i0(KAISER_BETA * np.sqrt(np.clip(1.0 - (t / half) ** 2, 0.0, None)))
+    h = cutoff * np.sinc(cutoff * t) * window
+    h /= h.sum(axis=1, keepdims=True)  # unity DC gain for every phase
+    return h.astype(np.float32), half - 1
+
+
+def resample(pcm: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """Resample float32 (frames x channels) from src_rate to dst_rate."""
+    src_rate, dst_rate = int(src_rate), int(dst_rate)
+    if src_rate == dst_rate or len(pcm) == 0:
+        return pcm
+    g = gcd(src_rate, dst_rate)
+    up, down = dst_rate // g, src_rate // g
+    bank, left = _filter_bank(up, down)
+    taps = bank.shape[1]
+
+    n_in = len(pcm)
+    n_out = (n_in * up) // down
+    # zero-pad so every tap index is valid
+    padded = np.zeros((n_in + taps, pcm.shape[1]), dtype=np.float32)
+    padded[left:left + n_in] = pcm
+    offsets = np.arange(taps)
+
+    out = np.empty((n_out, pcm.shape[1]), dtype=np.float32)
+    for start in range(0, n_out, BLOCK):
+        n = np.arange(start, min(start + BLOCK, n_out))
+        pos = n * down
+        base = pos // up                      # input frame at/behind the output instant
+        coef = bank[pos % up]                 # (block x taps)
+        idx = base[:, None] + offsets[None, :]  # (block x taps) input rows
+        out[start:start + len(n)] = np.einsum("bt,btc->bc", coef, padded[idx])
+    return out
+
+
+def remix(pcm: np.ndarray, channels: int) -> np.ndarray:
+    """Map (frames x C) to (frames x channels)."""
+    src = pcm.shape[1]
+    channels = int(channels)
+    if src == channels:
+        return pcm
+    if src == 1:
+        return np.repeat(pcm, channels, axis=1)
+    if channels == 1:
+        return pcm.mean(axis=1, keepdims=True, dtype=np.float32)
+    out = np.zeros((len(pcm), channels), dtype=np.float32)
+    n = min(src, channels)
+    out[:, :n] = pcm[:, :n]
+    return out
+
+
+def convert(pcm: np.ndarray, src_rate: int, dst_rate: int, channels: int) -> np.ndarray:
+    """Channel-map then resample; returns `pcm` itself if nothing changes."""
+    # remix first when it reduces channels (less to filter), after otherwise
+    if channels < pcm.shape[1]:
+        return resample(remix(pcm, channels), src_rate, dst_rate)
+    return remix(resample(pcm, src_rate, dst_rate), channels)
+
+
+__all__ = ["convert", "resample", "remix"]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Immutable channel -> devices routing snapshot.
+
+The GUI (or a config file) owns the device -> channel bindings; a new
+`RoutingTable` is built from them whenever they change and swapped in with
+a single attribute assignment, so the Socket.IO thread only ever does one
+dict lookup on a snapshot that nobody mutates.
+
+Usage:
+    from services.routing import RoutingTable
+
+    table = RoutingTable.from_device_map({3: "private-audio.Lobby", 5: "private-audio.Lobby"})
+    table.devices_for("private-audio.Lobby")   # (3, 5)
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+
+class RoutingTable:
+    __slots__ = ("_routes",)
+
+    def __init__(self, routes: Optional[Mapping[str, Iterable[Any]]] = None):
+        self._routes: Dict[str, Tuple[Any, ...]] = {
+            ch: tuple(devs) for ch, devs in (routes or {}).items() if devs
+        }
+
+    @classmethod
+    def from_device_map(cls, device_map: Mapping[Any, Optional[str]]) -> "RoutingTable":
+        """Invert a {device_id: channel} map; unbound devices ("" / None) are skipped."""
+        routes: Dict[str, list] = {}
+        for device, channel in device_map.items():
+            if channel:
+                routes.setdefault(channel, []).append(device)
+        return cls(routes)
+
+    def devices_for(self, channel: Optional[str]) -> Tuple[Any, ...]:
+        return self._routes.get(channel, ())
+
+    def channels(self) -> Tuple[str, ...]:
+        return tuple(self._routes)
+
+    def as_dict(self) -> Dict[str, Tuple[Any, ...]]:
+        return dict(self._routes)
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def __repr__(self) -> str:
+        return f"RoutingTable({self._routes!r})"
+
+
+__all__ = ["RoutingTable"]
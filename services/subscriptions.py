@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Area subscriptions for one Socket.IO connection, redone on every (re)connect.
+
+By default `resubscribe()` pipelines the classic one-channel "subscribe"
+payloads back to back, with an ack callback each and no logging per
+area. Servers that support it can be sent one batched request instead
+(`batch=True`):
+
+    "subscribe" {"channels": ["private-audio.A", ...], "auth": {...}}
+
+acked with {"channels": [<subscribed>, ...]}. `batch=None` probes for
+that: the batch is sent first, and any other ack (or none within
+`ack_timeout`) marks batching unsupported for the rest of the session
+and falls back to the pipeline. Against a server that never acks, the
+probe delays the first subscription by `ack_timeout`, which is why it
+is opt-in. Channels are confirmed by
+their acks; unconfirmed ones are re-sent once after `ack_timeout`. A server
+that never acks anything is assumed subscribed after that (logged once).
+
+The time from `resubscribe()` to the last confirmation is kept in
+`subscribed_sec`, passed to `on_complete` and observed into
+metrics.SUBSCRIBE_SECONDS.
+
+The manager does no I/O itself: `emit(event, data, callback)` and
+`call_later(seconds, func)` come from the client, so the same code serves
+the threaded and the asyncio client.
+
+Usage:
+    subs = SubscriptionManager(emit, call_later, auth=lambda: {...})
+    subs.resubscribe(["private-audio.A", "private-audio.B"])   # in on_connect
+    subs.stats()   # {"channels": 2, "confirmed": 2, "batch": True, "subscribed_sec": 0.004, ...}
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from services import metrics
+from util.logs import get_logger
+
+_log = get_logger("subscriptions")
+
+EVENT = "subscribe"
+
+
+class SubscriptionManager:
+    def __init__(self, emit: Callable[[str, Any, Callable], Any],
+                 call_later: Callable[[float, Callable[[], None]], Any],
+                 auth: Callable[[], Dict[str, Any]], batch: Optional[bool] = False,
+                 ack_timeout: float = 2.0, log_func: Optional[Callable[[str], None]] = None,
+                 on_complete: Optional[Callable[[float], None]] = None):
+        self._emit = emit
+        self._call_later = call_later
+        self._auth = auth
+        self.batch = batch  # None: probe once, then remember the answer
+        self.ack_timeout = float(ack_timeout)
+        self.log_func = log_func or _log.info
+        self.on_complete = on_complete  # called with subscribed_sec
+        self._lock = threading.Lock()
+        self._gen = 0
+        self._channels: List[str] = []
+        self._pending: set = set()
+        self._confirmed: set = set()
+        self._acks = 0
+        self._retried = False
+        self._t0 = 0.0
+        self.subscribed_sec: Optional[float] = None
+
+    # --- public API -------------------------------------------------------
+    def resubscribe(self, channels: Iterable[str]) -> None:
+        """Subscribe `channels` on a fresh connection (forgets earlier state)."""
+        with self._lock:
+            self._gen += 1
+            gen = self._gen
+            self._channels = list(dict.fromkeys(channels))
+            self._pending = set(self._channels)
+            self._confirmed = set()
+            self._acks = 0
+            self._retried = False
+            self._t0 = time.perf_counter()
+            self.subscribed_sec = None
+            batch = self.batch
+        if not self._channels:
+            return
+        if batch is False:
+            self._pipeline(gen, self._channels)
+            return
+        self._emit(EVENT, {"channels": self._channels, "auth": self._auth()},
+                   lambda *resp: self._on_batch_ack(gen, resp))
+        self._call_later(self.ack_timeout, lambda: self._on_batch_timeout(gen))
+
+    @property
+    def complete(self) -> bool:
+        return bool(self._channels) and not self._pending
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"channels": len(self._channels), "confirmed": len(self._confirmed),
+                    "pending": sorted(self._pending), "batch": self.batch,
+                    "subscribed_sec": self.subscribed_sec}
+
+    # --- batch ------------------------------------------------------------
+    def _on_batch_ack(self, gen: int, resp: tuple) -> None:
+        data = resp[0] if resp else None
+        chans = data.get("channels") if isinstance(data, dict) else None
+        with self._lock:
+            if gen != self._gen or self.batch is False:
+                return
+            if not isinstance(chans, list):
+                self.batch = False
+                _log.info("server has no batched subscribe; sending one per area")
+            else:
+                self.batch = True
+        if isinstance(chans, list):
+            self._confirm(gen, chans)
+            missing = self._still_pending(gen)
+            if missing:
+                _log.warning("批次訂閱未確認 %d 個區域，逐一重送", len(missing))
+                self._pipeline(gen, missing)
+        else:
+            self._pipeline(gen, self._channels)
+
+    def _on_batch_timeout(self, gen: int) -> None:
+        with self._lock:
+            if gen != self._gen or self.batch is not None:
+                return  # answered (or already fell back)
+            self.batch = False
+        _log.info("batched subscribe not acknowledged in %.1fs; sending one per area",
+                  self.ack_timeout)
+        self._pipeline(gen, self._channels)
+
+    # --- one per channel --------------------------------------------------
+    def _pipeline(self, gen: int, channels: List[str]) -> None:
+        auth = self._auth()  # one auth dict shared by every payload
+        for ch in channels:
+            self._emit(EVENT, {"channel": ch, "auth": auth},
+                       lambda *resp, ch=ch: self._on_ack(gen, ch, resp))
+        self._call_later(self.ack_timeout, lambda: self._on_pipeline_timeout(gen))
+
+    def _on_ack(self, gen: int, channel: str, resp: tuple) -> None:
+        data = resp[0] if resp else None
+        with self._lock:
+            if gen != self._gen:
+                return
+            self._acks += 1
+        if isinstance(data, dict) and (data.get("ok") is False or data.get("error")):
+            _log.warning("訂閱失敗 %s：%s", channel, data.get("error") or data)
+            return
+        self._confirm(gen, [channel])
+
+    def _on_pipeline_timeout(self, gen: int) -> None:
+        missing = self._still_pending(gen)
+        if not missing:
+            return
+        with self._lock:
+            acks, retried = self._acks, self._retried
+            self._retried = True
+        if acks == 0 and not self.batch:
+            _log.info("server does not acknowledge subscribe; assuming %d areas subscribed",
+                      len(missing))
+            self._confirm(gen, missing)
+        elif not retried:
+            _log.warning("%d 個區域訂閱未確認，重送", len(missing))
+            self._pipeline(gen, missing)
+        else:
+            _log.warning("區域訂閱仍未確認：%s", ", ".join(sorted(missing)))
+
+    # --- bookkeeping ------------------------------------------------------
+    def _still_pending(self, gen: int) -> List[str]:
+        with self._lock:
+            return [] if gen != self._gen else [c for c in self._channels if c in self._pending]
+
+    def _confirm(self, gen: int, channels: Iterable[str]) -> None:
+        with self._lock:
+            if gen != self._gen or not self._pending:
+                return
+            for ch in channels:
+                if ch in self._pending:
+                    self._pending.discard(ch)
+                    self._confirmed.add(ch)
+            if self._pending:
+                return
+            self.subscribed_sec = time.perf_counter() - self._t0
+            n = len(self._confirmed)
+        metrics.SUBSCRIBE_SECONDS.observe(self.subscribed_sec)
+        self.log_func(f"[OK] 已訂閱 {n} 個區域（{self.subscribed_sec:.3f}s）")
+        if self.on_complete is not None:
+            self.on_complete(self.subscribed_sec)
+
+
+__all__ = ["SubscriptionManager"]
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent login token cache, so a restart can connect without /login.
+
+Stores, per (app_base, username), the token and area list LoginClient got
+from /login together with an expiry time. The expiry comes from the login
+payload ("expires_in" seconds or "expires_at" epoch) if present, else from
+a JWT "exp" claim, else `default_ttl` after login. The file is JSON,
+written atomically and readable by the owner only; it holds no password.
+
+Usage:
+    from services.token_store import TokenStore
+
+    store = TokenStore()                              # default per-user path
+    login = LoginClient(base, user, pw, store=store)  # get_token() reads it first
+"""
+from __future__ import annotations
+
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from util.logs import get_logger
+
+_log = get_logger("token_store")
+
+APP_DIR = "AudioSocketClient"
+
+
+def default_path() -> str:
+    """$AUDQ_TOKEN_STORE, else token.json in the per-user config dir."""
+    env = os.environ.get("AUDQ_TOKEN_STORE")
+    if env:
+        return env
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return os.path.join(base, APP_DIR, "token.json")
+
+
+def _jwt_exp(token: str) -> Optional[float]:
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(parts[1] + "=" * (-len(parts[1]) % 4)))
+        return float(claims["exp"])
+    except Exception:
+        return None
+
+
+def token_expiry(token: str, payload: Optional[Dict[str, Any]] = None) -> Optional[float]:
+    """Epoch expiry from the login payload or the token itself; None if unknown."""
+    payload = payload or {}
+    try:
+        if payload.get("expires_in") is not None:
+            return time.time() + float(payload["expires_in"])
+        if payload.get("expires_at") is not None:
+            return float(payload["expires_at"])
+    except (TypeError, ValueError):
+        pass
+    return _jwt_exp(token)
+
+
+class TokenStore:
+    DEFAULT_TTL = 12 * 3600.0
+
+    def __init__(self, path: Optional[str] = None, default_ttl: float = DEFAULT_TTL):
+        self.path = path or default_path()
+        self.default_ttl = float(default_ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(app_base: str, username: str) -> str:
+        return f"{username}@{(app_base or '').rstrip('/')}"
+
+    def expiry(self, token: str, payload: Optional[Dict[str, Any]] = None) -> float:
+        """Epoch seconds at which `token` (from login `payload`) expires."""
+        return token_expiry(token, payload) or time.time() + self.default_ttl
+
+    def load(self, app_base: str, username: str) -> Optional[Dict[str, Any]]:
+        """{"token", "area", "expires_at"} if a still valid entry exists."""
+        entry = self._read().get(self._key(app_base, username))
+        if not isinstance(entry, dict) or not entry.get("token"):
+            return None
+        if float(entry.get("expires_at") or 0) <= time.time():
+            return None
+        return entry
+
+    def save(self, app_base: str, username: str, token: str, area: Any,
+             expires_at: float) -> None:
+        with self._lock:
+            data = self._read()
+            data[self._key(app_base, username)] = {
+                "token": token, "area": area, "expires_at": float(expires_at)}
+            self._write(data)
+
+    def clear(self, app_base: str, username: str) -> None:
+        with self._lock:
+            data = self._read()
+            if data.pop(self._key(app_base, username), None) is not None:
+                self._write(data)
+
+    # --- file I/O -----------------------------------------------------------
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            _log.warning("token 快取無法讀取（%s）：%s", self.path, e)
+            return {}
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        tmp = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            _log.warning("token 快取無法寫入（%s）：%s", self.path, e)
+
+
+__all__ = ["TokenStore", "default_path", "token_expiry"]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in Socket.IO event tracing.
+
+When tracing is off the client registers its handlers directly, so there
+is no wrapper, no formatting and no logging call on the receive path.
+When it is on, every handler is wrapped and each event is summarised by
+walking the payload's *shape* only (types, keys, lengths); payloads are
+never serialised, so multi-megabyte audio costs the same as a ping.
+
+Usage:
+    from services.tracing import EventTracer, shape
+
+    tracer = EventTracer(log)
+    sio.on("PlayAudioEvent", handler=tracer.wrap("PlayAudioEvent", handler))
+    shape({"audio": {"0": big_b64_chunk}, "format": "mp3"})
+    # -> "{audio: {0: str[1398104]}, format: 'mp3'}"
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+from typing import Any, Callable
+
+SHORT_STR = 48     # strings up to this length are shown verbatim
+MAX_ITEMS = 8      # keys/elements listed per container
+
+
+def shape(obj: Any, depth: int = 3) -> str:
+    """Describe `obj` by structure and sizes without copying or encoding it."""
+    if obj is None or isinstance(obj, (bool, int, float)):
+        return repr(obj)
+    if isinstance(obj, str):
+        return repr(obj) if len(obj) <= SHORT_STR else f"str[{len(obj)}]"
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return f"{type(obj).__name__}[{len(obj)}]"
+    if isinstance(obj, dict):
+        if depth <= 0:
+            return f"dict[{len(obj)}]"
+        parts = []
+        for i, (k, v) in enumerate(obj.items()):
+            if i >= MAX_ITEMS:
+                parts.append(f"...+{len(obj) - MAX_ITEMS}")
+                break
+            parts.append(f"{k}: {shape(v, depth - 1)}")
+        return "{" + ", ".join(parts) + "}"
+    if isinstance(obj, (list, tuple)):
+        if depth <= 0 or not obj:
+            return f"{type(obj).__name__}[{len(obj)}]"
+        return f"{type(obj).__name__}[{len(obj)}] of {shape(obj[0], depth - 1)}"
+    return f"<{type(obj).__name__}>"
+
+
+class EventTracer:
+    def __init__(self, log: logging.Logger, level: int = logging.DEBUG):
+        self.log = log
+        self.level = level
+
+    def trace(self, event: str, args: tuple) -> None:
+        if self.log.isEnabledFor(self.level):
+            self.log.log(self.level, "[*] event=%s data=%s", event,
+                         " | ".join(shape(a) for a in args) if args else "(no data)")
+
+    def wrap(self, event: str, handler: Callable) -> Callable:
+        """Return `handler` wrapped with a trace call (keeps coroutine-ness)."""
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def traced_async(*args):
+                self.trace(event, args)
+                return await handler(*args)
+            return traced_async
+
+        @functools.wraps(handler)
+        def traced(*args):
+            self.trace(event, args)
+            return handler(*args)
+        return traced
+
+
+__all__ = ["EventTracer", "shape"]
@@ -0,0 +1,5 @@
+# Route audio to the benchmark null sink before any test imports services.Audio
+# (no speakers, and no PortAudio needed).
+from bench import null_sink
+
+null_sink.install(devices=4, speed=50.0)
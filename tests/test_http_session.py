@@ -0,0 +1,19 @@
+from services.client import AudioSocketClient
+from services.http_session import get_session
+
+
+def _client(**kw):
+    return AudioSocketClient("https://example.invalid", {}, [], "token", log_func=lambda m: None, **kw)
+
+
+def test_sessions_are_pooled_per_verify_setting():
+    assert get_session(False) is get_session(False)
+    assert get_session(False) is not get_session(True)
+    assert get_session(True).verify is True and get_session(False).verify is False
+
+
+def test_client_never_changes_a_session_it_did_not_create():
+    shared = get_session(False)
+    _client(cafile="app.crt", session=shared)
+    assert shared.verify is False
+    assert _client(cafile="app.crt")._ses is not _client()._ses
@@ -0,0 +1,29 @@
+import tracemalloc
+
+from services.multi import MultiEndpointClient
+
+key = MultiEndpointClient._event_key
+
+
+def test_numeric_asset_id_is_hashed_as_text():
+    tracemalloc.start()
+    try:
+        k = key("private-audio.A", {"asset_id": 50_000_000})
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 1024 * 1024  # bytes(50_000_000) would allocate 50 MB
+    assert k == key("private-audio.A", {"asset_id": "50000000"})
+    assert k != key("private-audio.A", {"asset_id": 7})
+
+
+def test_none_and_binary_chunks():
+    assert key("c", {"audio": {"0": "abc", "1": None}}) == key("c", {"audio": {"0": "abc"}})
+    raw = b"RIFF\x00\x01"
+    assert key("c", {"audio": raw}) == key("c", {"audio": memoryview(raw)})
+    assert key("c", {"audio": [raw, bytearray(b"x")]})[0] == "content"
+
+
+def test_same_content_other_channel_differs():
+    assert key("a", {"audio": "abc"}) != key("b", {"audio": "abc"})
+    assert key("a", {"data": {"audio": "abc"}}) == key("a", {"audio": "abc"})
@@ -0,0 +1,93 @@
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+from services.Audio import AudioQueuePlayer, QueueLimits, _Clip, _ClipQueue, _Stream
+
+
+@pytest.fixture
+def make_player():
+    players = []
+
+    def make(policy, max_items=2):
+        limits = QueueLimits(max_items=max_items, max_bytes=None, max_total_items=None,
+                             max_total_bytes=None, policy=policy)
+        p = AudioQueuePlayer(gap_sec=0, limits=limits)
+        # a queue without a playback thread, so nothing is taken off it
+        w = SimpleNamespace(q=_ClipQueue(p.preempt_priority))
+        p._workers["dev"] = w
+        players.append(p)
+        return p, w
+
+    yield make
+    for p in players:
+        p._workers.clear()
+        p.stop()
+
+
+def offer(p, w, data, priority=0):
+    """What AudioQueuePlayer._submit does once the item is built."""
+    clip = _Clip(data, "wav")
+    clip.priority = priority
+    if p.limits.policy == "coalesce":
+        clip.key = p._content_key(clip)
+    if p._admit(w, clip):
+        w.q.put(clip)
+    return clip
+
+
+def queued(w):
+    return [bytes(i.data) for i in w.q.peek(10)]
+
+
+def test_drop_oldest_makes_room(make_player):
+    p, w = make_player("drop_oldest")
+    for data in (b"a", b"b", b"c"):
+        offer(p, w, data)
+    assert queued(w) == [b"b", b"c"]
+    assert p.drop_stats() == {"overflow": 1}
+
+
+def test_drop_newest_rejects_the_incoming_clip(make_player):
+    p, w = make_player("drop_newest")
+    for data in (b"a", b"b", b"c"):
+        offer(p, w, data)
+    assert queued(w) == [b"a", b"b"]
+    assert p.drop_stats() == {"rejected": 1}
+
+
+def test_urgent_clips_are_always_admitted(make_player):
+    p, w = make_player("drop_newest")
+    offer(p, w, b"a")
+    offer(p, w, b"b")
+    offer(p, w, b"alarm", priority=p.preempt_priority)
+    assert b"alarm" in queued(w) and len(queued(w)) == 2
+    assert p.drop_stats() == {"overflow": 1}
+
+
+def test_coalesce_keeps_repeats_below_the_limit(make_player):
+    p, w = make_player("coalesce", max_items=3)
+    offer(p, w, b"a")
+    offer(p, w, b"a")
+    assert queued(w) == [b"a", b"a"]
+    assert p.drop_stats() == {}
+
+
+def test_coalesce_once_a_limit_is_hit(make_player):
+    p, w = make_player("coalesce")
+    offer(p, w, b"a")
+    offer(p, w, b"b")
+    offer(p, w, b"a")  # full, and already queued: dropped as a repeat
+    assert queued(w) == [b"a", b"b"]
+    assert p.drop_stats() == {"coalesced": 1}
+    offer(p, w, b"c")  # full, but new: falls back to drop_oldest
+    assert queued(w) == [b"b", b"c"]
+    assert p.drop_stats() == {"coalesced": 1, "overflow": 1}
+
+
+def test_stream_size_counts_decoded_bytes():
+    raw = bytes(300)
+    text = base64.b64encode(raw).decode("ascii")
+    assert _Stream([text, text], "wav").nbytes == 2 * len(raw)
+    assert _Stream([raw], "wav").nbytes == len(raw)
@@ -1,28 +1,13 @@
 import platform
-import sounddevice as sd
 from PySide6.QtWidgets import QVBoxLayout, QHBoxLayout, QLabel, QComboBox
-
-class OutputDeviceDetector:
-    def __init__(self):
-        pass
-
-    def get_output_devices(self):
-        output_devices = []
-        try:
-            all_devices = sd.query_devices()
-            for i, dev in enumerate(all_devices):
-                if dev['max_output_channels'] > 0:
-                    output_devices.append({
-                        'name': dev['name'],
-                        'id': i
-                    })
-        except Exception as e:
-            print(f"Error listing output devices: {e}")
-        return output_devices
+from util.devices import get_registry, OutputDeviceDetector
+from services.routing import RoutingTable
 
 class AudioUIManager:
     def __init__(self, parent):
         self.parent = parent
+        # Read lock-free from the Socket.IO thread; replaced wholesale on the GUI thread
+        self._routes = RoutingTable()
 
     def populate_output_devices(self, areaList,force_reload=False):
         if force_reload:
@@ -47,9 +32,11 @@ class AudioUIManager:
             combo.addItem("不綁定", "")
             for area in areaList:
                 combo.addItem(area["name"], f"private-audio.{area['code']}")
+            combo.currentIndexChanged.connect(self._rebuild_routes)
             layout.addWidget(label)
             layout.addWidget(combo)
             output_mapping_layout.addLayout(layout)
+        self._rebuild_routes()
 
     def _delete_layout(self, layout):
         while layout.count():
@@ -59,11 +46,15 @@ class AudioUIManager:
             elif item.layout():
                 self._delete_layout(item.layout())
     def refresh_devices(self):
-        try:
-            sd._terminate()
-            sd._initialize()
-        except Exception as e:
-            print(f"Failed to reinitialize PortAudio: {e}")
+        get_registry().reload()
+    def routes(self):
+        """Current channel -> devices snapshot; safe to call from any thread."""
+        return self._routes
+
+    def _rebuild_routes(self, *_):
+        # GUI thread only: walk the widgets once, then swap the snapshot atomically
+        self._routes = RoutingTable.from_device_map(self.get_channel_map())
+
     def get_channel_map(self):
         channel_map = {}
         output_mapping_layout = self.parent.findChild(QVBoxLayout, "output_mapping_layout")
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Shared output-device registry.
+
+PortAudio enumeration is slow on boxes with many ALSA/PulseAudio endpoints,
+so devices are enumerated once and served from an immutable snapshot that
+both the player and the mapping UI read. The snapshot is only rebuilt on an
+explicit `reload()` or `invalidate()`, which the player calls when a
+device fails to open.
+
+PortAudio only sees devices that were plugged in or removed after a
+re-init, and a re-init invalidates every open stream. `reload()`
+therefore tells listeners first ("reinit": the player closes its
+streams), re-initialises, re-enumerates, then notifies "changed".
+Streams are opened inside `opening()`, which waits out a re-init in
+progress and holds off the next one until the open has finished, so no
+stream can be opened between the "reinit" notification and the
+terminate. `invalidate()` only re-enumerates; it tells the caller when
+the failing device is gone from the list, i.e. when only a `reload()`
+could bring it back. Whether that is worth closing every other stream is
+the caller's call (the player only does it while no other zone is
+playing, and at most once per REINIT_MIN_SEC).
+
+Usage:
+    from util.devices import get_registry
+
+    reg = get_registry()
+    reg.output_devices()          # [{"id": 3, "name": ..., "samplerate": 48000, ...}]
+    reg.by_id(3)["channels"]      # max output channels
+    reg.by_name("USB Audio")      # first output device with that name
+    reg.by_hostapi("ALSA")        # all output devices of one host API
+    reg.reload()                  # re-scan after plugging a device in
+    with reg.opening():           # no PortAudio re-init while opening
+        stream = sd.OutputStream(...)
+    reg.add_listener(lambda event: ...)   # "reinit" (before), "changed" (after)
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import sounddevice as sd
+
+from util.logs import get_logger
+
+_log = get_logger("devices")
+
+
+class _Snapshot:
+    __slots__ = ("devices", "by_id", "by_name", "by_hostapi")
+
+    def __init__(self, devices: List[Dict[str, Any]]):
+        self.devices = devices
+        self.by_id = {d["id"]: d for d in devices}
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.by_hostapi: Dict[str, List[Dict[str, Any]]] = {}
+        for d in devices:
+            self.by_name.setdefault(d["name"], d)
+            self.by_hostapi.setdefault(d["hostapi_name"], []).append(d)
+
+
+class DeviceRegistry:
+    REINIT_MIN_SEC = 5.0   # reinit_due(): minimum spacing of automatic re-inits
+    OPEN_WAIT_SEC = 10.0   # opening() / reload(): give up waiting after this
+
+    def __init__(self):
+        self._snap: Optional[_Snapshot] = None
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str], None]] = []
+        self._reinit_at = float("-inf")
+        # opening() vs reload(): opens in progress, and a re-init in progress
+        self._gate = threading.Condition()
+        self._opening = 0
+        self._reiniting = 0
+
+    # --- Public API -------------------------------------------------------
+    def output_devices(self) -> List[Dict[str, Any]]:
+        return list(self._snapshot().devices)
+
+    def by_id(self, device_id: Any) -> Optional[Dict[str, Any]]:
+        return self._snapshot().by_id.get(device_id)
+
+    def by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._snapshot().by_name.get(name)
+
+    def by_hostapi(self, hostapi: str) -> List[Dict[str, Any]]:
+        return list(self._snapshot().by_hostapi.get(hostapi, ()))
+
+    def native_format(self, device_id: Any) -> Optional[tuple]:
+        """(default samplerate, max output channels) or None if unknown."""
+        d = self.by_id(device_id)
+        if d is None:
+            return None
+        return d["samplerate"], d["channels"]
+
+    def reload(self) -> None:
+        """Re-initialise PortAudio and re-enumerate (picks up hotplug changes)."""
+        with self._gate:
+            self._reiniting += 1  # from here until "changed", opening() waits
+            if not self._gate.wait_for(lambda: self._opening == 0, self.OPEN_WAIT_SEC):
+                _log.warning("PortAudio re-init: a stream is still being opened")
+        try:
+            self._notify("reinit")  # open streams must be closed before the terminate
+            with self._lock:
+                try:
+                    sd._terminate()
+                    sd._initialize()
+                except Exception as e:
+                    _log.warning("Failed to reinitialize PortAudio: %s", e)
+                self._reinit_at = time.monotonic()
+                self._snap = self._enumerate()
+        finally:
+            with self._gate:
+                self._reiniting -= 1
+                self._gate.notify_all()
+        self._notify("changed")
+
+    def invalidate(self, device_id: Any = None) -> bool:
+        """A device failed to open: re-enumerate, without a PortAudio re-init.
+
+        Returns True if `device_id` is missing from the fresh list, so that
+        only a `reload()` could find it again; whether that is worth closing
+        every other stream for is the caller's decision.
+        """
+        with self._lock:
+            self._snap = snap = self._enumerate()
+        self._notify("changed")
+        return device_id is not None and device_id not in snap.by_id
+
+    def reinit_due(self) -> bool:
+        """False within REINIT_MIN_SEC of the last PortAudio re-init."""
+        return time.monotonic() - self._reinit_at >= self.REINIT_MIN_SEC
+
+    @contextmanager
+    def opening(self) -> Iterator[None]:
+        """Open a stream inside this: waits for a re-init in progress and
+        keeps the next one from starting until the block has finished."""
+        with self._gate:
+            if not self._gate.wait_for(lambda: not self._reiniting, self.OPEN_WAIT_SEC):
+                _log.warning("PortAudio re-init still running, opening anyway")
+            self._opening += 1
+        try:
+            yield
+        finally:
+            with self._gate:
+                self._opening -= 1
+                self._gate.notify_all()
+
+    def add_listener(self, cb: Callable[[str], None]) -> None:
+        """`cb(event)` runs on the caller's thread: "reinit" right before
+        PortAudio is re-initialised, "changed" after the device set was re-read."""
+        self._listeners.append(cb)
+
+    def remove_listener(self, cb: Callable[[str], None]) -> None:
+        try:
+            self._listeners.remove(cb)
+        except ValueError:
+            pass
+
+    # --- Internals --------------------------------------------------------
+    def _snapshot(self) -> _Snapshot:
+        snap = self._snap
+        if snap is not None:
+            return snap
+        with self._lock:
+            if self._snap is None:
+                self._snap = self._enumerate()
+            return self._snap
+
+    @staticmethod
+    def _enumerate() -> _Snapshot:
+        devices: List[Dict[str, Any]] = []
+        try:
+            hostapis = sd.query_hostapis()
+            for i, dev in enumerate(sd.query_devices()):
+                if dev["max_output_channels"] <= 0:
+                    continue
+                devices.append({
+                    "id": i,
+                    "name": dev["name"],
+                    "hostapi": dev["hostapi"],
+                    "hostapi_name": hostapis[dev["hostapi"]]["name"],
+                    "channels": int(dev["max_output_channels"]),
+                    "samplerate": int(dev["default_samplerate"]),
+                })
+        except Exception as e:
+            _log.warning("Error listing output devices: %s", e)
+        return _Snapshot(devices)
+
+    def _notify(self, event: str) -> None:
+        for cb in list(self._listeners):
+            try:
+                cb(event)
+            except Exception as e:
+                _log.warning("device listener failed: %s", e)
+
+
+class OutputDeviceDetector:
+    """Qt-free device listing (kept for callers of the old util.AudioInput API)."""
+
+    def __init__(self):
+        self.registry = get_registry()
+
+    def get_output_devices(self):
+        # Served from the shared registry; no PortAudio enumeration per call
+        return self.registry.output_devices()
+
+
+_default_registry: Optional[DeviceRegistry] = None
+_default_registry_lock = threading.Lock()
+
+
+def get_registry() -> DeviceRegistry:
+    global _default_registry
+    if _default_registry is None:
+        with _default_registry_lock:
+            if _default_registry is None:
+                _default_registry = DeviceRegistry()
+    return _default_registry
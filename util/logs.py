@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Logging for the player: stdlib levels + a bounded in-memory ring.
+
+Producer threads (Socket.IO, device workers) only append the LogRecord to
+a `collections.deque(maxlen=N)`; `deque.append` is atomic under the GIL,
+so no lock is taken and the oldest lines are dropped once the ring is
+full. Records are formatted later, on the consumer side (the GUI timer or
+whoever calls `drain()`), in batches.
+
+Hot-path debug lines use %-style arguments, so a disabled DEBUG level
+costs one level check and no string formatting. Set AUDQ_LOG_LEVEL=DEBUG
+to turn them on.
+
+Usage:
+    from util.logs import get_logger, setup
+
+    ring = setup()                 # once, at startup
+    log = get_logger("client")
+    log.info("已連接")
+    log.debug("chunk %d -> device %s", i, dev)
+
+    # GUI side, e.g. from a QTimer every 100 ms:
+    lines = ring.drain()
+    if lines:
+        widget.appendPlainText("\\n".join(lines))
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sys
+from collections import deque
+from typing import List, Optional
+
+LOGGER_NAME = "audq"
+DEFAULT_FORMAT = "%(asctime)s %(levelname).1s %(message)s"
+
+
+class RingHandler(logging.Handler):
+    def __init__(self, capacity: int = 10000, level: int = logging.NOTSET):
+        super().__init__(level)
+        self._ring: deque = deque(maxlen=int(capacity))
+        self.setFormatter(logging.Formatter(DEFAULT_FORMAT, "%H:%M:%S"))
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # No handler lock: a single deque.append is already thread-safe
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return bool(rv)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._ring.append(record)
+
+    def drain(self, max_items: int = 1000) -> List[str]:
+        """Pop and format up to `max_items` pending records (consumer side)."""
+        out: List[str] = []
+        pop = self._ring.popleft
+        for _ in range(max_items):
+            try:
+                record = pop()
+            except IndexError:
+                break
+            try:
+                out.append(self.format(record))
+            except Exception:
+                out.append(f"<log format error: {record.msg!r}>")
+        return out
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+
+_ring: Optional[RingHandler] = None
+
+
+def get_logger(name: Optional[str] = None) -> logging.Logger:
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+def setup(level: Optional[str] = None, capacity: int = 10000,
+          stream: bool = False) -> Optional[RingHandler]:
+    """Configure the `audq` logger once and return its ring handler.
+
+    stream=True (headless/daemon) writes to stderr instead of the ring,
+    since nothing would drain it; None is returned then.
+    """
+    global _ring
+    root = get_logger()
+    lvl = (level or os.environ.get("AUDQ_LOG_LEVEL") or "INFO").upper()
+    root.setLevel(getattr(logging, lvl, logging.INFO))
+    root.propagate = False
+    if root.handlers:
+        return _ring
+    if stream:
+        h = logging.StreamHandler(sys.stderr)
+        h.setFormatter(logging.Formatter(DEFAULT_FORMAT))
+        root.addHandler(h)
+    else:
+        _ring = RingHandler(capacity)
+        root.addHandler(_ring)
+    return _ring
+
+
+def ring() -> Optional[RingHandler]:
+    return _ring
+
+
+__all__ = ["RingHandler", "get_logger", "setup", "ring", "LOGGER_NAME"]